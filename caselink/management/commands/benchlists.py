@@ -0,0 +1,32 @@
+import json
+import time
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory
+from caselink.views.restful import WorkItemList, AutoCaseList
+
+
+class Command(BaseCommand):
+    help = 'Compare time of listing workitems and autocases with ?format=json and ?format=fast.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=1000, help='Objects in a page.')
+        parser.add_argument('--repeat', type=int, default=5, help='Times to list a page, the fastest counts.')
+
+    def _list(self, view, url, limit, format):
+        request = APIRequestFactory().get(url, {'limit': limit, 'format': format})
+        started = time.time()
+        response = view(request)
+        response.render()
+        return time.time() - started, json.loads(response.content.decode('utf-8'))
+
+    def handle(self, *args, **options):
+        for url, view in (('/workitem/', WorkItemList.as_view()), ('/autocase/', AutoCaseList.as_view())):
+            results = {}
+            for format in ('json', 'fast'):
+                runs = [self._list(view, url, options['limit'], format) for _ in range(options['repeat'])]
+                results[format] = min(runs, key=lambda run: run[0])
+            (slow, expected), (fast, data) = results['json'], results['fast']
+            same = expected['results'] == data['results']
+            print("%s %s objects: json %.3fs, fast %.3fs, %.1fx faster, %s" % (
+                url, len(data['results']), slow, fast, slow / max(fast, 1e-6),
+                "same output" if same else "OUTPUT DIFFERS"))
@@ -1,12 +1,22 @@
+import time
 from django.core.management.base import BaseCommand
+from caselink.models import changed_rows
 from caselink.tasks.common import init_linkage, init_error_checking
 
 
 class Command(BaseCommand):
     help = 'Manually initialize database, create linkage and mark error.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of processes for pattern matching, default to CPU count.')
+
     def handle(self, *args, **options):
         print("Initializing Linkage...")
-        init_linkage()
+        for phase, seconds in init_linkage(workers=options['workers']).items():
+            print("  %s: %.2fs" % (phase, seconds))
         print("Checking for error...")
+        started = time.time()
+        changed_rows(reset=True)
         init_error_checking()
+        print("  error check: %.2fs, %s rows changed" % (time.time() - started, changed_rows()))
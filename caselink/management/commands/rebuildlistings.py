@@ -0,0 +1,14 @@
+import time
+from django.core.management.base import BaseCommand
+from caselink.models import WorkItemListing, AutoCaseListing, rebuild_listings
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized workitem and autocase listing tables.'
+
+    def handle(self, *args, **options):
+        print("Rebuilding listings...")
+        started = time.time()
+        rebuild_listings()
+        print("  %s workitems, %s autocases: %.2fs" % (
+            WorkItemListing.objects.count(), AutoCaseListing.objects.count(), time.time() - started))
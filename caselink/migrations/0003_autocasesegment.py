@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:09
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def index_autocases(apps, schema_editor):
+    AutoCase = apps.get_model('caselink', 'AutoCase')
+    AutoCaseSegment = apps.get_model('caselink', 'AutoCaseSegment')
+    AutoCaseSegment.objects.bulk_create([
+        AutoCaseSegment(segment=segment, autocase_id=case_id)
+        for case_id in AutoCase.objects.values_list('id', flat=True).iterator()
+        for segment in set(item[:255] for item in case_id.split('.'))
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caselink', '0002_auto_20170717_0412'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AutoCaseSegment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('segment', models.CharField(db_index=True, max_length=255)),
+                ('autocase', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segments', to='caselink.AutoCase')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='autocasesegment',
+            unique_together=set([('segment', 'autocase')]),
+        ),
+        migrations.RunPython(index_autocases, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:22
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caselink', '0003_autocasesegment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingErrorCheck',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=255)),
+                ('object_id', models.CharField(max_length=65535)),
+                ('queued', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='pendingerrorcheck',
+            unique_together=set([('model', 'object_id')]),
+        ),
+    ]
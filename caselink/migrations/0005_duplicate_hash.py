@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from caselink.utils.helpers import normalized_hash, chunked
+
+
+def fill_hashes(apps, schema_editor):
+    for model_name, field, hash_field in (('WorkItem', 'title', 'title_hash'),
+                                          ('Linkage', 'autocase_pattern', 'pattern_hash')):
+        model = apps.get_model('caselink', model_name)
+        groups = {}
+        for pk, value in model.objects.values_list('pk', field).iterator():
+            groups.setdefault(normalized_hash(value), []).append(pk)
+        for value_hash, pks in groups.items():
+            for chunk in chunked(pks, 500):
+                model.objects.filter(pk__in=chunk).update(**{hash_field: value_hash})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caselink', '0004_pendingerrorcheck'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='linkage',
+            name='error_related',
+        ),
+        migrations.RemoveField(
+            model_name='workitem',
+            name='error_related',
+        ),
+        migrations.AddField(
+            model_name='linkage',
+            name='pattern_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=40),
+        ),
+        migrations.AddField(
+            model_name='workitem',
+            name='title_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=40),
+        ),
+        migrations.RunPython(fill_hashes, migrations.RunPython.noop),
+    ]
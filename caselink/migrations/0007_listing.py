@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:39
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_listings(apps, schema_editor):
+    # Rows are built with SQL on the tables, written with the historical models
+    from caselink.models.listing import build_listings
+    build_listings(apps.get_model('caselink', 'WorkItemListing'), apps.get_model('caselink', 'AutoCaseListing'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caselink', '0006_dataversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AutoCaseListing',
+            fields=[
+                ('case', models.CharField(max_length=65535, primary_key=True, serialize=False)),
+                ('framework', models.CharField(blank=True, db_index=True, max_length=255, null=True)),
+                ('pr', models.CharField(blank=True, max_length=255, null=True)),
+                ('components', models.TextField(default='[]')),
+                ('title', models.TextField(default='[]')),
+                ('polarion', models.TextField(default='[]')),
+                ('errors', models.TextField(default='[]')),
+                ('documents', models.TextField(default='[]')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WorkItemListing',
+            fields=[
+                ('polarion', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('title', models.CharField(blank=True, max_length=65535)),
+                ('automation', models.CharField(blank=True, db_index=True, max_length=255)),
+                ('need_automation', models.BooleanField(default=False)),
+                ('maitai_id', models.CharField(blank=True, max_length=65535)),
+                ('jira_id', models.CharField(blank=True, max_length=65535, null=True)),
+                ('comment', models.CharField(blank=True, max_length=65565, null=True)),
+                ('patterns', models.TextField(default='[]')),
+                ('cases', models.TextField(default='[]')),
+                ('errors', models.TextField(default='[]')),
+                ('documents', models.TextField(default='[]')),
+            ],
+        ),
+        migrations.RunPython(fill_listings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:44
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caselink', '0007_listing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('listing', models.CharField(max_length=16)),
+                ('row', models.CharField(blank=True, max_length=65535)),
+                ('version', models.BigIntegerField()),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='changelog',
+            index_together=set([('listing', 'row'), ('listing', 'version')]),
+        ),
+    ]
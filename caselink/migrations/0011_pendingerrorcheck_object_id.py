@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 13:59
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caselink', '0010_pattern_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pendingerrorcheck',
+            name='object_id',
+            field=models.CharField(max_length=255),
+        ),
+    ]
@@ -1,45 +1,113 @@
 from django.db import transaction
 from django.dispatch import receiver
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_init, pre_save, post_save, pre_delete, post_delete, m2m_changed
 
 from .models import (
-    WorkItem, AutoCase, Linkage, Bug, BlackListEntry, AutoCaseFailure,
-    Framework, Component, Arch, Project, Document, Error)
-from .error import ErrorCheckModel
+    WorkItem, AutoCase, AutoCaseSegment, Linkage, Bug, BlackListEntry, AutoCaseFailure,
+    Framework, Component, Arch, Project, Document, Error,
+    AutolinkDelta, get_pattern_matcher, update_pattern_matcher, match_autocase)
+from .error import ErrorCheckModel, PendingErrorCheck, changed_rows
+from .version import DataVersion, current_data_version, bump_data_version, coalesce_version_bumps
+from .listing import (
+    WorkItemListing, AutoCaseListing, ChangeLog, mark_listings_dirty, rebuild_listings,
+    listing_changes, m2m_related_pks, LISTED_MODELS, VALUE_MODELS)
+from .queue import (
+    enqueue_error_check, flush_error_check_queue, check_instances, bulk_mode,
+    is_deferred, is_discarded)
+from .upsert import upsert_autocases
 
 
 def _set_skip_signal(instance, value=True):
     """
-    Set a skip signal sign, to avoid signal recursion
+    Set a skip signal sign, to avoid signal recursion, return the previous sign
     """
-    if hasattr(instance, '__skip_signal'):
-        return instance.__skip_signal
+    skip = getattr(instance, '__skip_signal', False)
     setattr(instance, '__skip_signal', value)
+    return skip
 
 
 __all__ = [
-    'WorkItem', 'AutoCase', 'Linkage', 'Bug', 'BlackListEntry', 'AutoCaseFailure',
+    'WorkItem', 'AutoCase', 'AutoCaseSegment', 'Linkage', 'Bug', 'BlackListEntry', 'AutoCaseFailure',
     'Framework', 'Component', 'Arch', 'Project', 'Document',
-    'Error']
+    'Error', 'PendingErrorCheck', 'DataVersion', 'WorkItemListing', 'AutoCaseListing', 'ChangeLog']
+
+
+@receiver(pre_save, sender=WorkItem)
+@receiver(pre_save, sender=Linkage)
+def update_hash_handler(sender, instance, **kwargs):
+    # Also covers raw saves of loaddata and restoring, which skip Model.save
+    instance.update_hash()
+
+
+@receiver(post_save, sender=AutoCase)
+def index_autocase_handler(sender, instance, created, **kwargs):
+    # Connected before save_error_check_handler, autolink needs the index.
+    # AutoCase id is the primary key, so only new autocases need indexing,
+    # index entries of deleted autocases are removed by cascading.
+    if created:
+        AutoCaseSegment.index([instance.id])
 
 
 @receiver(post_save)
 def save_error_check_handler(sender, instance, created, raw, **kwargs):
     # Returns false if 'sender' is NOT a subclass of AbstractModel
+    if not hasattr(sender, 'autolink') and not issubclass(sender, ErrorCheckModel):
+        return
+    if is_deferred():
+        enqueue_error_check([instance] + instance.get_previous_duplicates()
+                            if issubclass(sender, ErrorCheckModel) else [instance])
+        return
     if _set_skip_signal(instance):
         return
     with transaction.atomic():
+        delta = None
         if hasattr(sender, 'autolink'):
-            instance.autolink()
+            delta = instance.autolink()
             instance.save()
         if issubclass(sender, ErrorCheckModel):
-            instance.error_check(depth=1)
+            if isinstance(delta, AutolinkDelta):
+                # Only autocases whose linkage changed need rechecking
+                instance.error_check(depth=1, autocases=delta.changed)
+            else:
+                instance.error_check(depth=1)
             instance.save()
     _set_skip_signal(instance, False)
 
 
+@receiver(post_init, sender=Linkage)
+@receiver(post_init, sender=AutoCaseFailure)
+def init_pattern_handler(sender, instance, **kwargs):
+    # Pattern as loaded, unknown if deferred, to tell if saving changes it
+    instance._saved_pattern = instance.__dict__.get('autocase_pattern')
+
+
+@receiver(post_save, sender=Linkage)
+@receiver(post_save, sender=AutoCaseFailure)
+def save_pattern_handler(sender, instance, created, raw, **kwargs):
+    # Raw saves of loaddata are built with the saved pattern
+    if created or raw or instance.autocase_pattern != instance._saved_pattern:
+        update_pattern_matcher(instance)
+        instance._saved_pattern = instance.autocase_pattern
+
+
+@receiver(post_delete, sender=Linkage)
+@receiver(post_delete, sender=AutoCaseFailure)
+def delete_pattern_handler(sender, instance, **kwargs):
+    update_pattern_matcher(instance, deleted=True)
+
+
+@receiver(pre_delete)
+def collect_error_related_handler(sender, instance, **kwargs):
+    # m2m rows are gone in post_delete, collect related objects before deleting
+    if is_deferred() and not is_discarded() and issubclass(sender, ErrorCheckModel):
+        instance._error_related = instance.get_error_related()
+
+
 @receiver(post_delete)
 def delete_error_check_handler(sender, instance, **kwargs):
+    if is_deferred():
+        enqueue_error_check(getattr(instance, '_error_related', []))
+        return
     # Returns false if 'sender' is NOT a subclass of AbstractModel
     if _set_skip_signal(instance):
         return
@@ -52,3 +120,54 @@ def delete_error_check_handler(sender, instance, **kwargs):
                     instance_.error_check(depth=0)
                     instance_.save()
     _set_skip_signal(instance, False)
+
+
+# Bookkeeping models, changing them doesn't change the data
+_UNVERSIONED_MODELS = (
+    DataVersion, PendingErrorCheck, AutoCaseSegment, WorkItemListing, AutoCaseListing, ChangeLog)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def data_version_handler(sender, **kwargs):
+    if sender._meta.app_label == 'caselink' and not issubclass(sender, _UNVERSIONED_MODELS):
+        bump_data_version()
+
+
+@receiver(m2m_changed)
+def m2m_data_version_handler(sender, instance, action, **kwargs):
+    if action.startswith('post_') and instance._meta.app_label == 'caselink':
+        bump_data_version()
+
+
+@receiver(post_save)
+def save_listing_handler(sender, instance, **kwargs):
+    if not is_discarded():
+        mark_listings_dirty(sender, [instance.pk])
+
+
+@receiver(pre_delete)
+def delete_listing_handler(sender, instance, **kwargs):
+    # Related rows are looked up before the object and its m2m rows are gone
+    if not is_discarded():
+        mark_listings_dirty(sender, [instance.pk], resolve=True)
+
+
+@receiver(m2m_changed)
+def m2m_listing_handler(sender, instance, action, model, pk_set, **kwargs):
+    if is_discarded():
+        return
+    # Relating a value (an error) changes rows of the objects it's related
+    # to, not rows of every object showing the value
+    own = type(instance) not in VALUE_MODELS
+    related = model in LISTED_MODELS and model not in VALUE_MODELS
+    if action == 'pre_clear':
+        if own:
+            mark_listings_dirty(type(instance), [instance.pk], resolve=True)
+        if related:
+            mark_listings_dirty(model, m2m_related_pks(sender, instance, model), resolve=True)
+    elif action.startswith('post_'):
+        if own:
+            mark_listings_dirty(type(instance), [instance.pk])
+        if related:
+            mark_listings_dirty(model, pk_set)
@@ -0,0 +1,175 @@
+"""
+Set based error checking, compute error flags of many objects with a few
+aggregate queries and write the difference of the errors m2m rows in bulk.
+
+Results are the same as calling error_check(depth=0) on every object.
+"""
+from django.db.models import Count
+
+from caselink.utils.helpers import chunked
+from caselink.utils.sql import insert_rows
+from .models import WorkItem, AutoCase, Linkage
+from .error import count_changed_rows
+from .version import bump_data_version
+from .listing import mark_listings_dirty
+
+
+# Errors computed by each check, other errors (eg. WORKITEM_DELETED) are left untouched
+WORKITEM_ERRORS = (
+    'WORKITEM_TITLE_DUPLICATE', 'WORKITEM_MULTI_PATTERN', 'WORKITEM_AUTOMATED_NO_LINKAGE',
+    'WORKITEM_NOTAUTOMATED_WITH_LINKAGE', 'WORKITEM_HAS_COMMENT', 'WORKITEM_CHANGED')
+AUTOCASE_ERRORS = ('NO_LINKAGE', 'MULTIPLE_WORKITEM')
+LINKAGE_ERRORS = ('PATTERN_INVALID', 'PATTERN_DUPLICATE')
+
+# Objects checked at once by check_in_chunks
+CHECK_CHUNK_SIZE = 5000
+
+
+def _objects(model, ids):
+    """
+    Yield querysets covering all objects, or objects with given ids in chunks.
+    """
+    if ids is None:
+        yield model.objects.all()
+    else:
+        for chunk in chunked(set(ids), 500):
+            yield model.objects.filter(pk__in=chunk)
+
+
+def _duplicated(model, field, values=None):
+    """
+    Return values of field shared by more than one object,
+    only given values are looked up if provided.
+    """
+    if values is None:
+        querysets = [model.objects.all()]
+    else:
+        querysets = [model.objects.filter(**{'%s__in' % field: chunk})
+                     for chunk in chunked(set(values), 500)]
+    duplicated = set()
+    for queryset in querysets:
+        duplicated.update(queryset.values(field).annotate(count=Count('pk'))
+                          .filter(count__gt=1).values_list(field, flat=True))
+    return duplicated
+
+
+def write_m2m_rows(model, field, source_ids, desired, scope=None):
+    """
+    Make the m2m rows of 'field' for objects 'source_ids' (None for all) equal to 'desired',
+    a set of (source_id, target_id), only rows with target in 'scope' are touched.
+    Return number of rows added and removed.
+    """
+    m2m_field = getattr(model, field).field
+    through = getattr(model, field).through
+    source = '%s_id' % m2m_field.m2m_field_name()
+    target = '%s_id' % m2m_field.m2m_reverse_field_name()
+
+    if source_ids is None:
+        querysets = [through.objects.all()]
+    else:
+        querysets = [through.objects.filter(**{'%s__in' % source: chunk})
+                     for chunk in chunked(source_ids, 500)]
+
+    current = set()
+    for queryset in querysets:
+        if scope is not None:
+            queryset = queryset.filter(**{'%s__in' % target: scope})
+        current.update(queryset.values_list(source, target))
+
+    added, removed = desired - current, current - desired
+    by_target = {}
+    for source_id, target_id in removed:
+        by_target.setdefault(target_id, []).append(source_id)
+    for target_id, sources in by_target.items():
+        for chunk in chunked(sources, 500):
+            through.objects.filter(**{target: target_id, '%s__in' % source: chunk}).delete()
+    insert_rows(through._meta.db_table, (source, target), added)
+    count_changed_rows(len(added) + len(removed))
+    if added or removed:
+        bump_data_version()
+        mark_listings_dirty(model, set(source_id for source_id, _ in added | removed))
+    return len(added), len(removed)
+
+
+def check_workitems(ids=None):
+    """
+    Check errors of workitems with given ids, or all workitems.
+    """
+    rows = [row for queryset in _objects(WorkItem, ids) for row in
+            queryset.annotate(link_count=Count('linkages'))
+            .values_list('id', 'title_hash', 'automation', 'comment', 'changes', 'link_count')]
+    duplicated = _duplicated(WorkItem, 'title_hash', None if ids is None else [row[1] for row in rows])
+
+    errors = set()
+    for pk, title_hash, automation, comment, changes, link_count in rows:
+        if title_hash in duplicated:
+            errors.add((pk, 'WORKITEM_TITLE_DUPLICATE'))
+        if link_count > 1:
+            errors.add((pk, 'WORKITEM_MULTI_PATTERN'))
+        if link_count == 0:
+            if automation not in ['notautomated', 'manualonly']:
+                errors.add((pk, 'WORKITEM_AUTOMATED_NO_LINKAGE'))
+        elif automation != 'automated':
+            errors.add((pk, 'WORKITEM_NOTAUTOMATED_WITH_LINKAGE'))
+        if comment:
+            errors.add((pk, 'WORKITEM_HAS_COMMENT'))
+        if changes:
+            errors.add((pk, 'WORKITEM_CHANGED'))
+
+    pks = None if ids is None else [row[0] for row in rows]
+    return write_m2m_rows(WorkItem, 'errors', pks, errors, WORKITEM_ERRORS)
+
+
+def check_autocases(ids=None):
+    """
+    Check errors of autocases with given ids, or all autocases.
+    """
+    rows = [row for queryset in _objects(AutoCase, ids) for row in
+            queryset.annotate(link_count=Count('linkages')).values_list('id', 'link_count')]
+
+    errors = set()
+    for pk, link_count in rows:
+        if link_count < 1:
+            errors.add((pk, 'NO_LINKAGE'))
+        if link_count > 1:
+            errors.add((pk, 'MULTIPLE_WORKITEM'))
+
+    pks = None if ids is None else [row[0] for row in rows]
+    return write_m2m_rows(AutoCase, 'errors', pks, errors, AUTOCASE_ERRORS)
+
+
+def check_linkages(ids=None):
+    """
+    Check errors of linkages with given ids, or all linkages.
+    """
+    rows = [row for queryset in _objects(Linkage, ids) for row in
+            queryset.annotate(case_count=Count('autocases'))
+            .values_list('id', 'pattern_hash', 'case_count')]
+    duplicated = _duplicated(Linkage, 'pattern_hash', None if ids is None else [row[1] for row in rows])
+
+    errors = set()
+    for pk, pattern_hash, case_count in rows:
+        if case_count < 1:
+            errors.add((pk, 'PATTERN_INVALID'))
+        if pattern_hash in duplicated:
+            errors.add((pk, 'PATTERN_DUPLICATE'))
+
+    pks = None if ids is None else [row[0] for row in rows]
+    return write_m2m_rows(Linkage, 'errors', pks, errors, LINKAGE_ERRORS)
+
+
+def check_in_chunks(check, model, ids=None, progress=None):
+    """
+    Run a check of the model on objects with given ids, or all objects, in
+    chunks, calling progress(current, total) before each chunk.
+    Return number of error rows added and removed.
+    """
+    if ids is None:
+        ids = list(model.objects.order_by('pk').values_list('pk', flat=True))
+    added = removed = 0
+    for idx, chunk in enumerate(chunked(ids, CHECK_CHUNK_SIZE)):
+        if progress:
+            progress(idx * CHECK_CHUNK_SIZE, len(ids))
+        chunk_added, chunk_removed = check(chunk)
+        added, removed = added + chunk_added, removed + chunk_removed
+    return added, removed
@@ -1,5 +1,32 @@
+import threading
+
 from django.db import models
 
+from caselink.utils.helpers import normalized_hash
+
+
+_changed_rows = {'count': 0}
+_changed_rows_lock = threading.Lock()
+
+
+def count_changed_rows(count):
+    """
+    Record number of errors / error related rows written by error checking.
+    """
+    with _changed_rows_lock:
+        _changed_rows['count'] += count
+
+
+def changed_rows(reset=False):
+    """
+    Return number of rows written by error checking since last reset.
+    """
+    with _changed_rows_lock:
+        count = _changed_rows['count']
+        if reset:
+            _changed_rows['count'] = 0
+    return count
+
 
 class Error(models.Model):
     id = models.CharField(max_length=255, primary_key=True)
@@ -10,13 +37,73 @@ class Error(models.Model):
         return self.id + ":" + self.message
 
 
+class PendingErrorCheck(models.Model):
+    """
+    A object waiting for autolink and error checking,
+    a object saved many times is only queued once.
+    """
+    model = models.CharField(max_length=255)
+    object_id = models.CharField(max_length=255)
+    queued = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("model", "object_id",)
+
+    def __str__(self):
+        return "%s:%s" % (self.model, self.object_id)
+
+
 class ErrorCheckModel(object):
     """
     Model inherit this will have a errors m2m relation.
-    If error checking related to other object, subclass should have a error_related m2m relation.
+    If objects are duplicated by a field, subclass should set _duplicate_by to
+    (field, hash field), objects with the same hash form a duplicate group.
     """
     errors = models.ManyToManyField(Error, blank=True, related_name='autocases')
 
+    # Errors not set by error checking, kept when errors are updated
+    _sticky_errors = ()
+
+    _duplicate_by = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(ErrorCheckModel, cls).from_db(db, field_names, values)
+        if cls._duplicate_by:
+            # Members of the old group need rechecking if the field changed
+            instance._loaded_hash = instance.__dict__.get(cls._duplicate_by[1])
+        return instance
+
+    def update_hash(self):
+        field, hash_field = self._duplicate_by
+        setattr(self, hash_field, normalized_hash(getattr(self, field)))
+
+    def get_duplicates(self, group=None):
+        """
+        Return a queryset of other objects in the duplicate group, default to current group.
+        """
+        field, hash_field = self._duplicate_by
+        return type(self).objects.filter(
+            **{hash_field: group or getattr(self, hash_field)}).exclude(pk=self.pk)
+
+    def get_previous_duplicates(self):
+        """
+        Return objects in the group this object was in when loaded, if it has moved to another group.
+        """
+        if not self._duplicate_by:
+            return []
+        loaded_hash = getattr(self, '_loaded_hash', None)
+        if not loaded_hash or loaded_hash == getattr(self, self._duplicate_by[1]):
+            return []
+        return list(self.get_duplicates(loaded_hash))
+
+    def set_errors(self, errors):
+        """
+        Update errors to given error ids, only the difference is written.
+        """
+        current = set(self.errors.values_list('id', flat=True))
+        return _apply_diff(self.errors, current, set(errors) | (current & set(self._sticky_errors)))
+
     def get_error_related(self):
         """
         Deleting or updating instance of this model may introduce/fix error for other models,
@@ -30,3 +117,18 @@ class ErrorCheckModel(object):
         linkage or metadata error.
         """
         raise NotImplementedError()
+
+
+def _apply_diff(manager, current, desired):
+    """
+    Add and remove pks of a m2m manager to make it equal to desired,
+    return number of rows changed.
+    """
+    added, removed = desired - current, current - desired
+    if removed:
+        manager.remove(*removed)
+    if added:
+        manager.add(*added)
+    count = len(added) + len(removed)
+    count_changed_rows(count)
+    return count
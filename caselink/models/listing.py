@@ -0,0 +1,524 @@
+"""
+Denormalized read model of the m2a and a2m listings.
+
+WorkItemListing and AutoCaseListing keep one row per workitem / autocase
+with the m2m columns pre-aggregated, so listing endpoints are a single
+table scan. Writes mark the affected rows dirty, dirty rows are rebuilt
+from the normalized tables when the transaction commits. A full rebuild
+is done by rebuild_listings, or the 'rebuildlistings' command.
+
+Refreshed rows of m2a, a2m and the blacklist (which has no table of its
+own) are logged in ChangeLog with the data version, for clients fetching
+only rows changed since the version they have.
+
+Workitems, autocases and linkages whose REST representation may have
+changed are stamped with the version and time in the same pass, used
+to validate conditional requests.
+"""
+import json
+import threading
+from contextlib import contextmanager
+
+from django.db import models, connection, transaction
+from django.utils import timezone
+
+from caselink.utils.helpers import chunked
+from caselink.utils.sql import pk_filter, aggregated_rows, insert_rows
+from .models import WorkItem, AutoCase, Linkage, BlackListEntry, AutoCaseFailure, Bug
+from .error import Error
+from .version import current_data_version, next_data_version, data_version_pending
+
+
+class WorkItemListing(models.Model):
+    """
+    A row of the m2a listing, list columns are JSON encoded.
+    """
+    polarion = models.CharField(max_length=255, primary_key=True)
+    title = models.CharField(max_length=65535, blank=True)
+    automation = models.CharField(max_length=255, blank=True, db_index=True)
+    need_automation = models.BooleanField(default=False)
+    maitai_id = models.CharField(max_length=65535, blank=True)
+    jira_id = models.CharField(max_length=65535, blank=True, null=True)
+    comment = models.CharField(max_length=65565, blank=True, null=True)
+    patterns = models.TextField(default='[]')
+    cases = models.TextField(default='[]')
+    errors = models.TextField(default='[]')
+    documents = models.TextField(default='[]')
+
+    FIELDS = ('polarion', 'title', 'automation', 'need_automation', 'maitai_id', 'jira_id', 'comment',
+              'patterns', 'cases', 'errors', 'documents')
+    LIST_FIELDS = ('patterns', 'cases', 'errors', 'documents')
+
+    def __str__(self):
+        return self.polarion
+
+    @classmethod
+    def records(cls, pks=None):
+        return _records(cls, pks)
+
+
+class AutoCaseListing(models.Model):
+    """
+    A row of the a2m listing, list columns are JSON encoded.
+    """
+    case = models.CharField(max_length=65535, primary_key=True)
+    framework = models.CharField(max_length=255, blank=True, null=True, db_index=True)
+    pr = models.CharField(max_length=255, blank=True, null=True)
+    components = models.TextField(default='[]')
+    title = models.TextField(default='[]')
+    polarion = models.TextField(default='[]')
+    errors = models.TextField(default='[]')
+    documents = models.TextField(default='[]')
+
+    FIELDS = ('case', 'framework', 'pr', 'components', 'title', 'polarion', 'errors', 'documents')
+    LIST_FIELDS = ('components', 'title', 'polarion', 'errors', 'documents')
+
+    def __str__(self):
+        return self.case
+
+    @classmethod
+    def records(cls, pks=None):
+        return _records(cls, pks)
+
+
+# Listings logged in the change log
+LISTINGS = ('m2a', 'a2m', 'bl')
+
+
+class ChangeLog(models.Model):
+    """
+    Latest data version a row of a listing was upserted or deleted at.
+    """
+    # Row of a entry logged when the whole listing is rebuilt
+    RESET = ''
+
+    listing = models.CharField(max_length=16)
+    row = models.CharField(max_length=65535, blank=True)
+    version = models.BigIntegerField()
+
+    class Meta:
+        index_together = [('listing', 'version'), ('listing', 'row')]
+
+    def __str__(self):
+        return '%s %s@%s' % (self.listing, self.row, self.version)
+
+
+def _records(model, pks=None):
+    """
+    Yield listing rows as dict ordered by pk, list columns decoded.
+    """
+    queryset = model.objects.order_by('pk').values_list(*model.FIELDS)
+    if pks is not None:
+        querysets = [queryset.filter(pk__in=chunk) for chunk in chunked(sorted(pks), 500)]
+    else:
+        querysets = [queryset]
+    for queryset in querysets:
+        for row in queryset.iterator():
+            record = dict(zip(model.FIELDS, row))
+            for key in model.LIST_FIELDS:
+                record[key] = json.loads(record[key])
+            yield record
+
+
+# Lists of a workitem listing row, selecting "pk" (workitem id) and "value"
+WORKITEM_LISTS = (
+    ('patterns', """
+    select
+    caselink_linkage.workitem_id AS pk,
+    caselink_linkage.autocase_pattern AS value
+    from caselink_linkage
+    """),
+    ('cases', """
+    select
+    caselink_linkage.workitem_id AS pk,
+    caselink_linkage_autocases.autocase_id AS value
+    from
+    (
+    caselink_linkage
+    inner join caselink_linkage_autocases on caselink_linkage_autocases.linkage_id = caselink_linkage.id)
+    """),
+    ('errors', """
+    select
+    caselink_linkage.workitem_id AS pk,
+    caselink_error.message AS value
+    from
+    ((
+    caselink_linkage
+    inner join caselink_linkage_errors on caselink_linkage_errors.linkage_id = caselink_linkage.id)
+    inner join caselink_error on caselink_error.id = caselink_linkage_errors.error_id)
+    union all
+    select
+    caselink_workitem_errors.workitem_id AS pk,
+    caselink_error.message AS value
+    from
+    (
+    caselink_workitem_errors
+    inner join caselink_error on caselink_error.id = caselink_workitem_errors.error_id)
+    """),
+    ('documents', """
+    select
+    caselink_workitem_documents.workitem_id AS pk,
+    caselink_workitem_documents.document_id AS value
+    from caselink_workitem_documents
+    """),
+)
+
+# Lists of an autocase listing row, selecting "pk" (autocase id) and "value"
+AUTOCASE_LISTS = (
+    ('components', """
+    select
+    caselink_autocase_components.autocase_id AS pk,
+    caselink_autocase_components.component_id AS value
+    from caselink_autocase_components
+    """),
+    ('title', """
+    select
+    caselink_linkage_autocases.autocase_id AS pk,
+    caselink_workitem.title AS value
+    from
+    ((
+    caselink_linkage_autocases
+    inner join caselink_linkage on caselink_linkage.id = caselink_linkage_autocases.linkage_id)
+    inner join caselink_workitem on caselink_workitem.id = caselink_linkage.workitem_id)
+    """),
+    ('polarion', """
+    select
+    caselink_linkage_autocases.autocase_id AS pk,
+    caselink_linkage.workitem_id AS value
+    from
+    (
+    caselink_linkage_autocases
+    inner join caselink_linkage on caselink_linkage.id = caselink_linkage_autocases.linkage_id)
+    """),
+    ('errors', """
+    select
+    caselink_autocase_errors.autocase_id AS pk,
+    caselink_error.message AS value
+    from
+    (
+    caselink_autocase_errors
+    inner join caselink_error on caselink_error.id = caselink_autocase_errors.error_id)
+    """),
+    ('documents', """
+    select
+    caselink_linkage_autocases.autocase_id AS pk,
+    caselink_workitem_documents.document_id AS value
+    from
+    ((
+    caselink_linkage_autocases
+    inner join caselink_linkage on caselink_linkage.id = caselink_linkage_autocases.linkage_id)
+    inner join caselink_workitem_documents on caselink_workitem_documents.workitem_id = caselink_linkage.workitem_id)
+    """),
+)
+
+
+def workitem_records(pks=None):
+    """
+    Yield m2a records of workitems, or workitems with given ids, built from
+    the normalized tables.
+    """
+    sql = """
+    select
+    caselink_workitem.id AS "polarion",
+    caselink_workitem.title AS "title",
+    caselink_workitem.automation AS "automation",
+    caselink_workitem.need_automation AS "need_automation",
+    caselink_workitem.maitai_id AS "maitai_id",
+    caselink_workitem.jira_id AS "jira_id",
+    caselink_workitem.comment AS "comment"
+    from caselink_workitem
+    where caselink_workitem.type <> 'heading' %s
+    order by "polarion"
+    """
+    return aggregated_rows(sql, 'polarion', 'caselink_workitem.id', WORKITEM_LISTS, pks)
+
+
+def autocase_records(pks=None):
+    """
+    Yield a2m records of autocases, or autocases with given ids, built from
+    the normalized tables.
+    """
+    sql = """
+    select
+    caselink_autocase.id AS "case",
+    caselink_autocase.framework_id AS "framework",
+    caselink_autocase.pr AS "pr"
+    from caselink_autocase
+    where 1 = 1 %s
+    order by "case"
+    """
+    return aggregated_rows(sql, 'case', 'caselink_autocase.id', AUTOCASE_LISTS, pks)
+
+
+def _delete_rows(model, pks=None):
+    # Raw delete, listing rows have no relations nor signals to care about
+    sql = "delete from %s where 1 = 1 %%s" % connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(*pk_filter(sql, connection.ops.quote_name(model._meta.pk.column), pks))
+
+
+def _write_rows(model, records, list_fields):
+    records = list(records)
+    if not records:
+        return
+    keys = list(records[0])
+    insert_rows(model._meta.db_table, [model._meta.get_field(key).column for key in keys], (
+        [json.dumps(record[key]) if key in list_fields else record[key] for key in keys]
+        for record in records))
+
+
+def _refresh(model, build, ids):
+    for chunk in chunked(sorted(ids), 500):
+        _delete_rows(model, chunk)
+        _write_rows(model, build(chunk), model.LIST_FIELDS)
+
+
+def refresh_workitem_listings(ids):
+    """
+    Rebuild listing rows of given workitems, rows of deleted workitems are removed.
+    """
+    _refresh(WorkItemListing, workitem_records, ids)
+
+
+def refresh_autocase_listings(ids):
+    """
+    Rebuild listing rows of given autocases, rows of deleted autocases are removed.
+    """
+    _refresh(AutoCaseListing, autocase_records, ids)
+
+
+def build_listings(workitem_listing, autocase_listing):
+    """
+    Fill the listing models with rows of all workitems and autocases,
+    models are passed in for using with historical models.
+    """
+    for model, build, list_fields in (
+            (workitem_listing, workitem_records, WorkItemListing.LIST_FIELDS),
+            (autocase_listing, autocase_records, AutoCaseListing.LIST_FIELDS)):
+        _delete_rows(model)
+        for chunk in chunked(build(), 500):
+            _write_rows(model, chunk, list_fields)
+
+
+def log_changes(listing, rows, version):
+    """
+    Record rows of a listing changed at version, replacing older entries of them.
+    """
+    for chunk in chunked(sorted(str(row) for row in rows), 500):
+        ChangeLog.objects.filter(listing=listing, row__in=chunk).delete()
+        insert_rows(ChangeLog._meta.db_table, ('listing', 'row', 'version'),
+                    [(listing, row, version) for row in chunk])
+
+
+def stamp_rows(rows, version):
+    """
+    Stamp objects of tracked rows with the version and current time,
+    all objects are stamped if rows is None.
+    """
+    modified = timezone.now()
+    for key, model in STAMPED_ROWS:
+        if rows is None:
+            model.objects.update(version=version, modified=modified)
+            continue
+        for chunk in chunked(sorted(rows[key]), 500):
+            model.objects.filter(pk__in=chunk).update(version=version, modified=modified)
+
+
+def rebuild_listings():
+    """
+    Rebuild all listing rows, dirty rows are dropped as all are rebuilt,
+    and every listing is logged as reset.
+    """
+    _state().update(rows=_empty_rows(), dirty={})
+    with transaction.atomic():
+        build_listings(WorkItemListing, AutoCaseListing)
+        version = next_data_version()
+        ChangeLog.objects.all().delete()
+        ChangeLog.objects.bulk_create([
+            ChangeLog(listing=listing, row=ChangeLog.RESET, version=version) for listing in LISTINGS])
+        stamp_rows(None, version)
+
+
+# Rows changed up to this many versions before 'since' are listed again,
+# a transaction may commit after a later version was read by the client
+CHANGES_SAFETY_WINDOW = 10
+
+
+def listing_changes(listing, since):
+    """
+    Return (current version, rows of the listing changed after version
+    'since' - CHANGES_SAFETY_WINDOW), rows is None if the listing was
+    rebuilt after 'since'.
+    """
+    version = current_data_version()
+    rows = set()
+    for row, row_version in ChangeLog.objects.filter(
+            listing=listing, version__gt=since - CHANGES_SAFETY_WINDOW,
+            version__lte=version).values_list('row', 'version'):
+        if row != ChangeLog.RESET:
+            rows.add(row)
+        elif row_version > since:
+            return version, None
+    return version, rows
+
+
+_pending = threading.local()
+
+# Models whose changes affect the listings
+LISTED_MODELS = (WorkItem, AutoCase, Linkage, BlackListEntry, AutoCaseFailure, Bug, Error)
+
+# Listed models shown as values only, relating one to an object changes the
+# object's row, not rows of every object related to it
+VALUE_MODELS = (Error, )
+
+
+# Rows stamped with version and modified time, by the tracked rows they are
+STAMPED_ROWS = (('m2a', WorkItem), ('a2m', AutoCase), ('linkage', Linkage))
+
+
+def _empty_rows():
+    return dict((listing, set()) for listing in LISTINGS + ('linkage',))
+
+
+def _state():
+    if not hasattr(_pending, 'state'):
+        _pending.state = {'rows': _empty_rows(), 'dirty': {}, 'depth': 0}
+    return _pending.state
+
+
+def _listing_rows(model, pks):
+    """
+    Return rows of each listing affected by changing objects of model with given pks.
+    """
+    rows = _empty_rows()
+    through = Linkage.autocases.through
+    for chunk in chunked(list(pks), 500):
+        if model is WorkItem:
+            rows['m2a'].update(chunk)
+            rows['a2m'].update(through.objects.filter(
+                linkage__workitem__in=chunk).values_list('autocase_id', flat=True))
+            rows['bl'].update(BlackListEntry.objects.filter(
+                workitems__in=chunk).values_list('pk', flat=True))
+        elif model is Linkage:
+            rows['linkage'].update(chunk)
+            rows['m2a'].update(Linkage.objects.filter(
+                pk__in=chunk, workitem__isnull=False).values_list('workitem_id', flat=True))
+            rows['a2m'].update(through.objects.filter(
+                linkage__in=chunk).values_list('autocase_id', flat=True))
+        elif model is AutoCase:
+            rows['a2m'].update(chunk)
+            rows['m2a'].update(Linkage.objects.filter(
+                autocases__in=chunk, workitem__isnull=False).values_list('workitem_id', flat=True))
+            rows['bl'].update(BlackListEntry.objects.filter(
+                autocase_failures__autocases__in=chunk).values_list('pk', flat=True))
+            # Linkages list their autocases
+            rows['linkage'].update(through.objects.filter(
+                autocase__in=chunk).values_list('linkage_id', flat=True))
+        elif model is BlackListEntry:
+            rows['bl'].update(chunk)
+            # Workitems list their blacklist entries
+            rows['m2a'].update(BlackListEntry.workitems.through.objects.filter(
+                blacklistentry__in=chunk).values_list('workitem_id', flat=True))
+        elif model is AutoCaseFailure:
+            rows['bl'].update(BlackListEntry.objects.filter(
+                autocase_failures__in=chunk).values_list('pk', flat=True))
+            # Autocases list their failures
+            rows['a2m'].update(AutoCaseFailure.autocases.through.objects.filter(
+                autocasefailure__in=chunk).values_list('autocase_id', flat=True))
+        elif model is Bug:
+            rows['bl'].update(BlackListEntry.objects.filter(
+                bugs__in=chunk).values_list('pk', flat=True))
+        elif model is Error:
+            # Rows list messages of their errors
+            rows['m2a'].update(WorkItem.errors.through.objects.filter(
+                error__in=chunk).values_list('workitem_id', flat=True))
+            rows['m2a'].update(Linkage.objects.filter(
+                errors__in=chunk, workitem__isnull=False).values_list('workitem_id', flat=True))
+            rows['a2m'].update(AutoCase.errors.through.objects.filter(
+                error__in=chunk).values_list('autocase_id', flat=True))
+            rows['bl'].update(BlackListEntry.errors.through.objects.filter(
+                error__in=chunk).values_list('blacklistentry_id', flat=True))
+    return rows
+
+
+def mark_listings_dirty(model, pks, resolve=False):
+    """
+    Mark listing rows affected by objects of model with given pks dirty,
+    they are refreshed and logged when current transaction commits.
+
+    Affected rows are looked up on refreshing, unless 'resolve' is True,
+    which should be used before the objects or their relations are deleted.
+    """
+    if model not in LISTED_MODELS or not pks:
+        return
+    state = _state()
+    if resolve:
+        for listing, rows in _listing_rows(model, pks).items():
+            state['rows'][listing].update(rows)
+    else:
+        state['dirty'].setdefault(model, set()).update(pks)
+    if not state['depth']:
+        # Every mark registers a callback, rolled back ones are dropped,
+        # the first one committed refreshes all marked rows.
+        transaction.on_commit(refresh_dirty_listings)
+
+
+def refresh_dirty_listings():
+    """
+    Refresh all listing rows marked dirty, log them in the change log, and
+    increase the data version once for them and other pending changes.
+    """
+    state = _state()
+    if state['depth']:
+        # Refreshed when the outermost coalesce_listing_refresh exits
+        return
+    rows, dirty = state['rows'], state['dirty']
+    state.update(rows=_empty_rows(), dirty={})
+    for model, pks in dirty.items():
+        for listing, rows_ in _listing_rows(model, pks).items():
+            rows[listing].update(rows_)
+    if not any(rows.values()):
+        if data_version_pending():
+            next_data_version()
+        return
+    with transaction.atomic():
+        refresh_workitem_listings(rows['m2a'])
+        refresh_autocase_listings(rows['a2m'])
+        # Responses cached in between were built from the stale rows
+        version = next_data_version()
+        for listing in LISTINGS:
+            log_changes(listing, rows[listing], version)
+        stamp_rows(rows, version)
+
+
+@contextmanager
+def coalesce_listing_refresh():
+    """
+    Refresh listing rows marked dirty in the block once, when the block
+    exits (and current transaction commits).
+    """
+    state = _state()
+    state['depth'] += 1
+    try:
+        yield
+    finally:
+        state['depth'] -= 1
+        if not state['depth'] and (any(state['rows'].values()) or state['dirty'] or data_version_pending()):
+            transaction.on_commit(refresh_dirty_listings)
+
+
+def m2m_related_pks(through, instance, model):
+    """
+    Return pks of objects of model currently related to instance through
+    the m2m table, for a pre_clear m2m_changed signal which has no pk_set.
+    """
+    source = target = None
+    for field in through._meta.fields:
+        related = getattr(field, 'related_model', None)
+        if related is type(instance):
+            source = field.name
+        elif related is model:
+            target = field.name
+    if source is None or target is None:
+        return []
+    return list(through.objects.filter(**{source: instance.pk}).values_list(target, flat=True))
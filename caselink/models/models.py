@@ -1,9 +1,18 @@
+import time
+import threading
+from collections import namedtuple
+
+from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count
 
-from caselink.utils.helpers import is_pattern_match
+from caselink.utils.helpers import is_pattern_match, pattern_segments, chunked
+from caselink.utils.matcher import PatternMatcher
+from caselink.utils.sql import insert_rows
 from caselink.models.error import Error, ErrorCheckModel
+from caselink.models.version import bump_data_version, bump_pattern_version, current_pattern_version
 
 
 class Arch(models.Model):
@@ -70,21 +79,30 @@ class WorkItem(ErrorCheckModel, models.Model):
     changes = models.TextField(blank=True, null=True)
     confirmed = models.DateTimeField(blank=True, null=True)
 
+    # Data version and time of the last change, stamped when changes commit
+    version = models.BigIntegerField(default=0, editable=False)
+    modified = models.DateTimeField(blank=True, null=True, editable=False)
+
     # Field used to perform runtime error checking
-    error_related = models.ManyToManyField('self', blank=True)
+    title_hash = models.CharField(max_length=40, blank=True, db_index=True, editable=False)
 
     _user_data = ('comment', 'need_automation', 'maitai_id', 'jira_id', )
 
     _min_dump = ('id', 'type', 'title', 'automation', 'commit', 'project', 'archs',
                  'documents', 'maitai_id', 'jira_id', 'updated', 'errors', 'comment', 'changes', 'confirmed')  # TODO: some errors can be ignored
 
+    _sticky_errors = ('WORKITEM_DELETED', )
+
+    _duplicate_by = ('title', 'title_hash')
+
     def __str__(self):
         return self.id
 
     def get_error_related(self):
         """Get related objects for error cheking"""
         return (
-            list(self.error_related.all()) +
+            self.get_previous_duplicates() +
+            list(self.get_duplicates()) +
             list(self.linkages.all())
         )
 
@@ -95,40 +113,30 @@ class WorkItem(ErrorCheckModel, models.Model):
         self.errors.remove("WORKITEM_DELETED")
 
     def error_check(self, depth=1):
-        # error_related may change, so check it first
-        if depth > 0:
-            for item in self.error_related.all():
-                item.error_check(depth - 1)
-
-        deleted = bool(self.errors.filter(id="WORKITEM_DELETED").exists())
-        self.errors.clear()
+        errors = set()
 
-        self.error_related.clear()
-        self.error_related.add(*list(
-            WorkItem.objects.filter(title=self.title).exclude(id=self.id)))
-        if len(self.error_related.all()) > 0:
-            self.errors.add("WORKITEM_TITLE_DUPLICATE")
+        if self.get_duplicates().exists():
+            errors.add("WORKITEM_TITLE_DUPLICATE")
 
-        links = Linkage.objects.filter(workitem=self)
+        links = Linkage.objects.filter(workitem=self).count()
 
-        if len(links) > 1:
-            self.errors.add("WORKITEM_MULTI_PATTERN")
+        if links > 1:
+            errors.add("WORKITEM_MULTI_PATTERN")
 
-        if len(links) == 0:
+        if links == 0:
             if self.automation not in ['notautomated', 'manualonly']:
-                self.errors.add("WORKITEM_AUTOMATED_NO_LINKAGE")
+                errors.add("WORKITEM_AUTOMATED_NO_LINKAGE")
         else:
             if self.automation != 'automated':
-                self.errors.add("WORKITEM_NOTAUTOMATED_WITH_LINKAGE")
+                errors.add("WORKITEM_NOTAUTOMATED_WITH_LINKAGE")
 
         if self.comment:
-            self.errors.add("WORKITEM_HAS_COMMENT")
+            errors.add("WORKITEM_HAS_COMMENT")
 
         if self.changes:
-            self.errors.add("WORKITEM_CHANGED")
+            errors.add("WORKITEM_CHANGED")
 
-        if deleted:
-            self.errors.add("WORKITEM_DELETED")
+        self.set_errors(errors)
 
         if depth > 0:
             for item in self.get_error_related():
@@ -146,9 +154,15 @@ class AutoCase(ErrorCheckModel, models.Model):
     pr = models.CharField(max_length=255, blank=True, null=True)
     errors = models.ManyToManyField(Error, blank=True, related_name='autocases')
 
+    # Data version and time of the last change, stamped when changes commit
+    version = models.BigIntegerField(default=0, editable=False)
+    modified = models.DateTimeField(blank=True, null=True, editable=False)
+
     _min_dump = ('id', 'archs', 'framework', 'start_commit', 'end_commit', 'components',
                  'pr', 'errors')
 
+    _sticky_errors = ('AUTOCASE_PR_NOT_MERGED', 'AUTOCASE_DELETED_IN_PR')
+
     def get_error_related(self):
         """Get related objects for error cheking"""
         return (
@@ -159,36 +173,84 @@ class AutoCase(ErrorCheckModel, models.Model):
         return self.id
 
     def autolink(self):
-        for link in Linkage.objects.all():
-            if link.test_match(self):
-                link.autocases.add(self)
-                link.save()
-        for link in AutoCaseFailure.objects.all():
-            if link.test_match(self):
-                link.autocases.add(self)
-                link.save()
+        linkages, failures = match_autocase(self.id)
+        for link in linkages + failures:
+            link.autocases.add(self)
+            link.save()
 
     def error_check(self, depth=1):
-        # TODO: Use external errors list for prevent certain error from being cleaned.
-        add_in_pr = self.errors.filter(id="AUTOCASE_PR_NOT_MERGED").exists()
-        deleted_in_pr = self.errors.filter(id="AUTOCASE_DELETED_IN_PR").exists()
+        errors = set()
+        links = self.linkages.count()
 
-        self.errors.clear()
+        if links < 1:
+            errors.add("NO_LINKAGE")
 
-        if len(self.linkages.all()) < 1:
-            self.errors.add("NO_LINKAGE")
+        if links > 1:
+            errors.add("MULTIPLE_WORKITEM")
 
-        if len(self.linkages.all()) > 1:
-            self.errors.add("MULTIPLE_WORKITEM")
+        self.set_errors(errors)
 
         if depth > 0:
             for item in self.get_error_related():
                 item.error_check(depth - 1)
 
-        if add_in_pr:
-            self.errors.add("AUTOCASE_PR_NOT_MERGED")
-        if deleted_in_pr:
-            self.errors.add("AUTOCASE_DELETED_IN_PR")
+    @classmethod
+    def match_pattern(cls, pattern):
+        """
+        Return ids of all autocases matching the pattern, only candidates
+        found in the segment index are tested.
+        """
+        return [case_id for case_id in AutoCaseSegment.candidate_ids(pattern)
+                if is_pattern_match(pattern, case_id)]
+
+
+class AutoCaseSegment(models.Model):
+    """
+    Inverted index from dot-separated segments of AutoCase id to AutoCase,
+    used to narrow down the autocases a pattern could match.
+    """
+    segment = models.CharField(max_length=255, db_index=True)
+    autocase = models.ForeignKey(AutoCase, on_delete=models.CASCADE, related_name='segments')
+
+    class Meta:
+        unique_together = ("segment", "autocase",)
+
+    def __str__(self):
+        return "%s - %s" % (self.segment, self.autocase_id)
+
+    @staticmethod
+    def normalize(segments):
+        """
+        Long segments are truncated on both indexing and looking up,
+        so the index still returns a superset of matching autocases.
+        """
+        return set(segment[:255] for segment in segments)
+
+    @classmethod
+    def index(cls, autocase_ids):
+        """
+        Add index entries for autocases, autocases already indexed are skipped.
+        """
+        for chunk in chunked(set(autocase_ids), 500):
+            indexed = set(cls.objects.filter(autocase_id__in=chunk)
+                          .values_list('autocase_id', flat=True).distinct())
+            insert_rows(cls._meta.db_table, ('segment', 'autocase_id'), [
+                (segment, case_id)
+                for case_id in chunk if case_id not in indexed
+                for segment in cls.normalize(case_id.split('.'))
+            ])
+
+    @classmethod
+    def candidate_ids(cls, pattern):
+        """
+        Return a queryset of ids of autocases containing every segment of the pattern.
+        """
+        segments = cls.normalize(pattern_segments(pattern))
+        return (cls.objects.filter(segment__in=segments)
+                .values('autocase')
+                .annotate(hits=Count('segment'))
+                .filter(hits=len(segments))
+                .values_list('autocase', flat=True))
 
 
 class Linkage(ErrorCheckModel, models.Model):
@@ -200,10 +262,16 @@ class Linkage(ErrorCheckModel, models.Model):
     errors = models.ManyToManyField(Error, blank=True, related_name='linkages')
 
     # Field used to perform runtime error checking
-    error_related = models.ManyToManyField('self', blank=True)
+    pattern_hash = models.CharField(max_length=40, blank=True, db_index=True, editable=False)
+
+    # Data version and time of the last change, stamped when changes commit
+    version = models.BigIntegerField(default=0, editable=False)
+    modified = models.DateTimeField(blank=True, null=True, editable=False)
 
     _min_dump = ('workitem', 'autocase_pattern', 'framework', )
 
+    _duplicate_by = ('autocase_pattern', 'pattern_hash')
+
     def __str__(self):
         return str(self.workitem) + " - " + str(self.autocase_pattern)
 
@@ -217,50 +285,49 @@ class Linkage(ErrorCheckModel, models.Model):
         return is_pattern_match(self.autocase_pattern, auto_case.id)
 
     def autolink(self):
-        self.autocases.clear()
-        for case in AutoCase.objects.all():
-            if self.test_match(case):
-                self.autocases.add(case)
-        matched_autocases = set(self.autocases.all())
+        delta = relink_autocases(self)
+        matched_autocases = set(self.autocases.values_list('id', flat=True))
         if not matched_autocases:
-            return  # Skip invalid linakge
+            return delta  # Skip invalid linakge
         for other in self.workitem.linkages.all():
-            other_autocases = set(other.autocases.all())
+            other_autocases = set(other.autocases.values_list('id', flat=True))
             if matched_autocases > other_autocases:
                 other.delete()
             if matched_autocases < other_autocases:
                 self.delete()
-                return
+                return delta
+        return delta
 
-    def get_error_related(self):
-        """Get related objects for error cheking"""
+    def get_error_related(self, autocases=None):
+        """
+        Get related objects for error cheking,
+        if autocases ids is given, only return these autocases instead of all linked ones.
+        """
+        if autocases is None:
+            autocases = list(self.autocases.all())
+        else:
+            autocases = [case for chunk in chunked(autocases, 500)
+                         for case in AutoCase.objects.filter(id__in=chunk)]
         return (
-            list(self.error_related.all()) +
+            self.get_previous_duplicates() +
+            list(self.get_duplicates()) +
             list([self.workitem]) +
-            list(self.autocases.all())
+            autocases
         )
 
-    def error_check(self, depth=1):
-        if depth > 0:
-            for item in self.error_related.all():
-                item.error_check(depth - 1)
-        self.error_related.clear()
-        self.errors.clear()
+    def error_check(self, depth=1, autocases=None):
+        errors = set()
 
-        links_duplicate = Linkage.objects.filter(autocase_pattern=self.autocase_pattern)
+        if not self.autocases.exists():
+            errors.add("PATTERN_INVALID")
 
-        if len(self.autocases.all()) < 1:
-            self.errors.add("PATTERN_INVALID")
+        if self.get_duplicates().exists():
+            errors.add("PATTERN_DUPLICATE")
 
-        if len(links_duplicate) > 1:
-            self.errors.add("PATTERN_DUPLICATE")
-            for link in links_duplicate:
-                if link == self:
-                    continue
-                self.error_related.add(link)
+        self.set_errors(errors)
 
         if depth > 0:
-            for item in self.get_error_related():
+            for item in self.get_error_related(autocases):
                 item.error_check(depth - 1)
 
 
@@ -332,14 +399,139 @@ class AutoCaseFailure(ErrorCheckModel, models.Model):
         return is_pattern_match(self.autocase_pattern, auto_case.id)
 
     def autolink(self):
-        self.autocases.clear()
-        for case in AutoCase.objects.all():
-            if self.test_match(case):
-                self.autocases.add(case)
+        return relink_autocases(self)
 
-    def error_check(self, depth=1):
+    def error_check(self, depth=1, autocases=None):
         # TODO
         pass
 
     def __str__(self):
         return "<'%s' failing with '%s'>" % (self.autocase_pattern, self.failure_regex)
+
+
+class AutolinkDelta(namedtuple('AutolinkDelta', ['added', 'removed'])):
+    """
+    Autocase ids added to or removed from a pattern by autolink.
+    """
+    @property
+    def changed(self):
+        return self.added | self.removed
+
+
+def relink_autocases(link):
+    """
+    Update autocases of a Linkage or AutoCaseFailure to the ones matching its pattern,
+    only the difference is written with bulk inserts and deletes.
+    """
+    manager = link.autocases
+    through = manager.through
+    source, target = '%s_id' % manager.source_field_name, '%s_id' % manager.target_field_name
+
+    matched = set(AutoCase.match_pattern(link.autocase_pattern))
+    current = set(through.objects.filter(**{source: link.pk}).values_list(target, flat=True))
+    delta = AutolinkDelta(matched - current, current - matched)
+
+    for chunk in chunked(delta.removed, 500):
+        through.objects.filter(**{source: link.pk, '%s__in' % target: chunk}).delete()
+    insert_rows(through._meta.db_table, (source, target), [(link.pk, case_id) for case_id in delta.added])
+    if delta.changed:
+        bump_data_version()
+        # Imported here, listing models depend on this module
+        from caselink.models.listing import mark_listings_dirty
+        mark_listings_dirty(type(link), [link.pk])
+        mark_listings_dirty(AutoCase, delta.changed)
+    return delta
+
+
+# Matcher of the process, its pattern version and when the version was last read
+_pattern_matcher = None
+_pattern_matcher_version = None
+_pattern_version_read = 0
+# Set while own changes are not committed, the version is read on every use then
+_pattern_changes_pending = False
+_pattern_matcher_lock = threading.RLock()
+
+
+def get_pattern_matcher():
+    """
+    Return a PatternMatcher of all Linkage and AutoCaseFailure patterns,
+    keyed with (model, pk). It's built on first use, kept updated by model
+    signals, and rebuilt if the pattern version was bumped by other processes,
+    which is read at most once per CASELINK['PATTERN_VERSION_INTERVAL'] seconds.
+    Use matched_pattern_keys to match with it, under the lock.
+    """
+    global _pattern_matcher, _pattern_matcher_version, _pattern_version_read, _pattern_changes_pending
+    with _pattern_matcher_lock:
+        now = time.time()
+        if (_pattern_matcher is not None and not _pattern_changes_pending and
+                now - _pattern_version_read < settings.CASELINK.get('PATTERN_VERSION_INTERVAL', 1)):
+            return _pattern_matcher
+        version = current_pattern_version()
+        _pattern_version_read = now
+        if _pattern_matcher is None or version != _pattern_matcher_version:
+            # Built from uncommitted changes in a transaction, which may be rolled back
+            _pattern_changes_pending = transaction.get_connection().in_atomic_block
+            if _pattern_changes_pending:
+                transaction.on_commit(_pattern_changes_committed)
+            _pattern_matcher = PatternMatcher(
+                ((model, pk), pattern)
+                for model in (Linkage, AutoCaseFailure)
+                for pk, pattern in model.objects.values_list('id', 'autocase_pattern').iterator())
+            _pattern_matcher_version = version
+        return _pattern_matcher
+
+
+def matched_pattern_keys(case_ids):
+    """
+    Return (model, pk) keys of Linkages and AutoCaseFailures whose pattern
+    matches any of the autocase ids.
+    """
+    keys = set()
+    with _pattern_matcher_lock:
+        matcher = get_pattern_matcher()
+        for case_id in case_ids:
+            keys.update(matcher.match(case_id))
+    return keys
+
+
+def update_pattern_matcher(instance, deleted=False):
+    """
+    Update the pattern of a Linkage or AutoCaseFailure in the PatternMatcher,
+    and bump the pattern version for other processes.
+    """
+    global _pattern_matcher, _pattern_matcher_version, _pattern_changes_pending
+    with _pattern_matcher_lock:
+        version = current_pattern_version()
+        bump_pattern_version()
+        if _pattern_matcher is None:
+            return
+        if version != _pattern_matcher_version or current_pattern_version() != version + 1:
+            # Patterns were changed elsewhere too, rebuilt on next use
+            _pattern_matcher = None
+            return
+        key = (type(instance), instance.pk)
+        if deleted:
+            _pattern_matcher.remove(key)
+        else:
+            _pattern_matcher.add(key, instance.autocase_pattern)
+        _pattern_matcher_version = version + 1
+        # Until committed, a rollback is a mismatch on next read
+        _pattern_changes_pending = True
+        transaction.on_commit(_pattern_changes_committed)
+
+
+def _pattern_changes_committed():
+    global _pattern_changes_pending
+    with _pattern_matcher_lock:
+        _pattern_changes_pending = False
+
+
+def match_autocase(autocase_id):
+    """
+    Return lists of linkages and autocase failures whose pattern matches the autocase id.
+    """
+    keys = matched_pattern_keys([autocase_id])
+    return tuple(
+        [link for link in model.objects.filter(pk__in=[pk for model_, pk in keys if model_ is model])
+         if is_pattern_match(link.autocase_pattern, autocase_id)]
+        for model in (Linkage, AutoCaseFailure))
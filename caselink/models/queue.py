@@ -0,0 +1,220 @@
+"""
+Deferred autolink and error checking.
+
+Saving or deleting a object only queues it (or the objects related to a
+deleted one), the queue is drained in batches by a celery task, so a
+object touched many times is only checked once.
+
+In bulk mode objects are recorded in memory instead, and checked in one
+batch when the block exits.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from caselink.utils.helpers import chunked
+from .error import PendingErrorCheck, ErrorCheckModel
+from .models import WorkItem, AutoCase, Linkage, AutolinkDelta
+from .checks import check_workitems, check_autocases, check_linkages
+from .version import coalesce_version_bumps
+from .listing import coalesce_listing_refresh
+
+
+LOGGER = logging.getLogger(__name__)
+
+# Queued objects are drained by a task scheduled at most once in a such window
+FLUSH_DELAY = 5
+FLUSH_SCHEDULED_KEY = 'caselink-error-check-flush-scheduled'
+
+_CHECKS = {
+    WorkItem: check_workitems,
+    AutoCase: check_autocases,
+    Linkage: check_linkages,
+}
+
+
+_bulk = threading.local()
+
+
+def _bulk_state():
+    return getattr(_bulk, 'state', None)
+
+
+def is_deferred():
+    """
+    Whether saved / deleted objects should be passed to enqueue_error_check
+    instead of being checked in place.
+    """
+    return _bulk_state() is not None or settings.CASELINK.get('DEFER_ERROR_CHECK', False)
+
+
+def is_discarded():
+    """
+    Whether changes are not recorded at all, in bulk mode without reconciling.
+    """
+    state = _bulk_state()
+    return state is not None and not state['reconcile']
+
+
+def enqueue_error_check(instances):
+    """
+    Queue instances for autolink and error checking,
+    in bulk mode they are recorded for the batch check on exiting.
+    """
+    state = _bulk_state()
+    for instance in instances:
+        if instance is None or instance.pk is None:
+            continue
+        if state is None:
+            PendingErrorCheck.objects.get_or_create(
+                model=instance._meta.model_name, object_id=str(instance.pk))
+        elif state['reconcile']:
+            state['touched'][(instance._meta.model_name, str(instance.pk))] = True
+    if state is None:
+        _schedule_flush()
+
+
+def _schedule_flush():
+    transaction.on_commit(_start_flush_task)
+
+
+def _start_flush_task():
+    # A shared cache backend is needed for the window to hold across processes,
+    # a extra run finds the queue empty
+    if not cache.add(FLUSH_SCHEDULED_KEY, True, FLUSH_DELAY):
+        return
+    thread = threading.Thread(target=_send_flush_task)
+    thread.daemon = True
+    thread.start()
+
+
+def _send_flush_task():
+    """
+    Send the flush task without retrying, if the broker is not reachable the
+    queue is left for the next flush or celery beat.
+    """
+    from caselink.tasks.common import check_queued_errors
+    try:
+        check_queued_errors.apply_async(countdown=FLUSH_DELAY, retry=False)
+    except Exception:
+        cache.delete(FLUSH_SCHEDULED_KEY)
+        LOGGER.warning("Failed to schedule queued error checking", exc_info=True)
+
+
+def _load(entries):
+    """
+    Load queued objects, objects already deleted are skipped.
+    """
+    pks = {}
+    for model_name, object_id in entries:
+        pks.setdefault(apps.get_model('caselink', model_name), []).append(object_id)
+    instances = []
+    for model, object_ids in pks.items():
+        for chunk in chunked(object_ids, 500):
+            instances.extend(model.objects.filter(pk__in=chunk))
+    return instances
+
+
+def _check(instances):
+    """
+    Check errors of instances, each only once, in bulk for models
+    supported by the set based checks.
+    """
+    pks, checked = {}, set()
+    for instance in instances:
+        if instance is None or instance.pk is None:
+            continue
+        key = (type(instance), instance.pk)
+        if key in checked:
+            continue
+        checked.add(key)
+        if type(instance) in _CHECKS:
+            pks.setdefault(type(instance), []).append(instance.pk)
+        elif isinstance(instance, ErrorCheckModel):
+            instance.error_check(depth=0)
+    for model, model_pks in pks.items():
+        _CHECKS[model](model_pks)
+
+
+def check_instances(instances):
+    """
+    Autolink instances, then check errors for them and their related objects,
+    same as error_check(depth=1) on each of them, but every object is only checked once.
+    """
+    related = []
+    for instance in instances:
+        delta = instance.autolink() if hasattr(instance, 'autolink') else None
+        if instance.pk is None or not isinstance(instance, ErrorCheckModel):
+            continue  # Deleted by autolink
+        if isinstance(delta, AutolinkDelta) and isinstance(instance, Linkage):
+            # Only autocases whose linkage changed need rechecking
+            related.extend(instance.get_error_related(delta.changed))
+        else:
+            related.extend(instance.get_error_related())
+
+    _check(list(instances) + related)
+
+
+def flush_error_check_queue(batch_size=500):
+    """
+    Synchronously autolink and check errors for all queued objects,
+    return the number of objects processed.
+    """
+    processed = 0
+    while True:
+        with transaction.atomic():
+            entries = list(PendingErrorCheck.objects.order_by('id')
+                           .values_list('id', 'model', 'object_id')[:batch_size])
+            if not entries:
+                return processed
+            # Objects queued again while processing get a new entry
+            PendingErrorCheck.objects.filter(id__in=[entry[0] for entry in entries]).delete()
+            check_instances(_load([entry[1:] for entry in entries]))
+        processed += len(entries)
+
+
+def _reconcile(state):
+    # Autolinking may touch more objects, each object is only processed once
+    done = set()
+    while state['touched']:
+        entries = [entry for entry in state['touched'] if entry not in done]
+        state['touched'] = OrderedDict()
+        done.update(entries)
+        for chunk in chunked(entries, 500):
+            with transaction.atomic():
+                check_instances(_load(chunk))
+
+
+@contextmanager
+def bulk_mode(reconcile=True):
+    """
+    Suspend per object autolink and error checking of the signal handlers,
+    objects saved or deleted in the block are autolinked and checked in one
+    batch when the outermost block exits, or not at all if reconcile is
+    False (eg. a full relink and error check will follow). Listing rows
+    are refreshed once for the block as well.
+    """
+    if _bulk_state() is not None:
+        yield
+        return
+    state = _bulk.state = {'reconcile': reconcile, 'touched': OrderedDict()}
+    try:
+        # Version bumps are merged first, into the single refresh of listing rows
+        with coalesce_listing_refresh(), coalesce_version_bumps():
+            try:
+                yield
+            except Exception:
+                # Changes made out of a transaction are kept, still check them
+                if transaction.get_autocommit():
+                    _reconcile(state)
+                raise
+            else:
+                _reconcile(state)
+    finally:
+        _bulk.state = None
@@ -0,0 +1,79 @@
+"""
+Bulk upsert of the complete autocase list of a framework.
+
+New autocases are inserted in bulk, autocases missing from the list are
+flagged with AUTOCASE_DELETED_IN_PR instead of being deleted, so their
+linkages are kept for review. Only patterns matching the new autocases
+are relinked and checked, in one batch. Listed autocases belonging to
+another framework are left alone and reported.
+"""
+from django.db import transaction
+
+from caselink.utils.helpers import chunked
+from caselink.utils.sql import insert_rows
+from .models import AutoCase, AutoCaseSegment, matched_pattern_keys
+from .checks import check_autocases, write_m2m_rows
+from .version import bump_data_version
+from .listing import mark_listings_dirty
+from .queue import bulk_mode, enqueue_error_check
+
+
+DELETED_ERROR = 'AUTOCASE_DELETED_IN_PR'
+
+
+def _linked_patterns(case_ids):
+    """
+    Return Linkages and AutoCaseFailures with a pattern matching any of the autocases.
+    """
+    pks = {}
+    for model, pk in matched_pattern_keys(case_ids):
+        pks.setdefault(model, []).append(pk)
+    return [link for model, model_pks in pks.items()
+            for chunk in chunked(model_pks, 500)
+            for link in model.objects.filter(pk__in=chunk)]
+
+
+@transaction.atomic
+def upsert_autocases(framework, case_ids):
+    """
+    Make the autocases of a framework match the given ids. Return a dict
+    of numbers of autocases 'added' to the framework (or listed again
+    after being flagged as deleted), 'removed' (flagged as deleted) and
+    'unchanged', and ids 'skipped' as they belong to other frameworks.
+    """
+    case_ids = set(case_ids)
+    current = set(AutoCase.objects.filter(framework=framework).values_list('id', flat=True))
+    others = set(case_id for chunk in chunked(case_ids - current, 500)
+                 for case_id in AutoCase.objects.filter(id__in=chunk).values_list('id', flat=True))
+    flagged = set(case_id for chunk in chunked(current, 500)
+                  for case_id in AutoCase.errors.through.objects.filter(
+                      autocase__in=chunk, error=DELETED_ERROR).values_list('autocase_id', flat=True))
+    created = case_ids - current - others
+    removed = current - case_ids
+
+    with bulk_mode():
+        # Version is stamped when the listing rows are refreshed
+        insert_rows(AutoCase._meta.db_table, ('id', 'framework_id', 'version'),
+                    [(case_id, framework.pk, 0) for case_id in created])
+        AutoCaseSegment.index(created)
+
+        if created:
+            bump_data_version()
+            mark_listings_dirty(AutoCase, created)
+
+        # Deleted flag is set on missing ones, and cleared on listed ones
+        write_m2m_rows(AutoCase, 'errors', current,
+                       set((case_id, DELETED_ERROR) for case_id in removed), (DELETED_ERROR,))
+
+        # Patterns are relinked and checked when the block exits
+        enqueue_error_check(_linked_patterns(created))
+
+    # Including new autocases not linked at all
+    check_autocases(created)
+
+    return {
+        'added': len(created) + len(case_ids & flagged),
+        'removed': len(removed - flagged),
+        'unchanged': len((case_ids & current) - flagged),
+        'skipped': sorted(others),
+    }
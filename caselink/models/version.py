@@ -0,0 +1,103 @@
+"""
+A counter of data changes, bumped whenever caselink data is written, so
+responses built from the data can be cached and validated by version.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db import models, transaction
+from django.db.models import F
+
+
+class DataVersion(models.Model):
+    """
+    Single row holding the current data version.
+    """
+    version = models.BigIntegerField(default=0)
+    # Bumped when a Linkage or AutoCaseFailure pattern is added, changed or deleted
+    patterns = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return str(self.version)
+
+
+_deferred = threading.local()
+
+
+def current_data_version():
+    """
+    Return the current data version.
+    """
+    return DataVersion.objects.values_list('version', flat=True).filter(pk=1).first() or 0
+
+
+def bump_data_version():
+    """
+    Mark the data changed, the data version is increased once when current
+    transaction commits, in the pass refreshing dirty listing rows. Bumps
+    inside coalesce_version_bumps are merged into one.
+    """
+    if getattr(_deferred, 'depth', 0):
+        _deferred.changed = True
+        return
+    _deferred.pending = True
+    # The listing module imports this one
+    from .listing import refresh_dirty_listings
+    # Every bump registers a callback, rolled back ones are dropped,
+    # the first one committed increases the version
+    transaction.on_commit(refresh_dirty_listings)
+
+
+def data_version_pending():
+    """
+    Return True if the data changed since the data version was last increased.
+    """
+    return getattr(_deferred, 'pending', False)
+
+
+def _increase(field='version'):
+    if DataVersion.objects.filter(pk=1).update(**{field: F(field) + 1}):
+        return
+    _, created = DataVersion.objects.get_or_create(pk=1, defaults={field: 1})
+    if not created:
+        DataVersion.objects.filter(pk=1).update(**{field: F(field) + 1})
+
+
+def current_pattern_version():
+    """
+    Return the current version of patterns.
+    """
+    return DataVersion.objects.values_list('patterns', flat=True).filter(pk=1).first() or 0
+
+
+def bump_pattern_version():
+    """
+    Increase the version of patterns, right away.
+    """
+    _increase('patterns')
+
+
+def next_data_version():
+    """
+    Increase the data version right away, even in coalesce_version_bumps,
+    return the new version. Call it in a transaction, so the version is
+    visible together with the changes tagged with it.
+    """
+    _deferred.pending = False
+    _increase()
+    return current_data_version()
+
+
+@contextmanager
+def coalesce_version_bumps():
+    """
+    Bump the data version at most once for all changes made in the block.
+    """
+    _deferred.depth = getattr(_deferred, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _deferred.depth -= 1
+        if not _deferred.depth and getattr(_deferred, 'changed', False):
+            _deferred.changed = False
+            bump_data_version()
@@ -1,12 +1,176 @@
+from collections import OrderedDict
+
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from django.utils.translation import ugettext as _
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ObjectDoesNotExist, FieldDoesNotExist
 from django.conf import settings
 from .models import *
+from .utils.helpers import chunked
+
+
+def _query_names(request, param):
+    """
+    Return names given as ?<param>=a,b to read, or None if not given.
+    """
+    if request is None or request.method != 'GET' or param not in request.query_params:
+        return None
+    return set(name.strip() for name in request.query_params[param].split(',') if name.strip())
+
+
+def requested_fields(request):
+    """
+    Return names of fields requested with ?fields=a,b to read, or None
+    if all fields are wanted.
+    """
+    return _query_names(request, 'fields')
+
+
+def requested_embeds(request):
+    """
+    Return names of related fields requested with ?embed=a,b to be
+    serialized as objects instead of primary keys.
+    """
+    return _query_names(request, 'embed') or set()
+
+
+class SparseFieldsMixin(object):
+    """
+    Only serialize fields requested with ?fields=, other fields are not
+    read at all, so their related objects are never queried.
+    """
+    def __init__(self, *args, **kwargs):
+        super(SparseFieldsMixin, self).__init__(*args, **kwargs)
+        fields = requested_fields(self.context.get('request'))
+        if fields is not None:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
+
+class EmbedMixin(object):
+    """
+    Serialize related fields requested with ?embed= as objects, with
+    the serializers in 'embeddable'.
+    """
+    embeddable = {}
+
+    def __init__(self, *args, **kwargs):
+        super(EmbedMixin, self).__init__(*args, **kwargs)
+        for name in requested_embeds(self.context.get('request')):
+            if name in self.embeddable and name in self.fields:
+                self.fields[name] = self.embeddable[name](many=True, read_only=True)
+
+
+class ValuesSerializer(object):
+    """
+    Serialize rows of values() as a ModelSerializer serializes objects,
+    with the same fields in the same order, read only.
+
+    Related primary keys are read in one query per related field for a
+    whole page, from the through table of many to many fields. No model, field or
+    related object is created per row. Fields of the serializer which
+    can't be read from values make 'supported' False.
+    """
+    # Fields read as is, other fields are converted with to_representation
+    PLAIN_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.BooleanField)
+
+    def __init__(self, serializer):
+        self.model = serializer.Meta.model
+        # Sources of SerializerMethodFields, as (related field, column of related objects)
+        sources = getattr(serializer, 'values_sources', {})
+        self.columns, self.plan = ['pk'], []
+        self.supported = True
+        for name, field in serializer.fields.items():
+            if isinstance(field, serializers.ManyRelatedField):
+                if not isinstance(field.child_relation, serializers.PrimaryKeyRelatedField):
+                    self.supported = False
+                self.plan.append((name, 'related', (field.source, 'pk')))
+            elif isinstance(field, serializers.SerializerMethodField):
+                if name not in sources:
+                    self.supported = False
+                self.plan.append((name, 'related', sources.get(name)))
+            else:
+                model_field = self._model_field(field.source)
+                if model_field is None or model_field.many_to_many or model_field.one_to_many:
+                    self.supported = False
+                    continue
+                self.columns.append(model_field.attname)
+                if isinstance(field, (serializers.PrimaryKeyRelatedField,) + self.PLAIN_FIELDS):
+                    self.plan.append((name, 'plain', model_field.attname))
+                else:
+                    self.plan.append((name, 'convert', (model_field.attname, field.to_representation)))
+
+    def _model_field(self, source):
+        try:
+            return self.model._meta.get_field(source)
+        except FieldDoesNotExist:
+            return None
+
+    def values(self, queryset):
+        """
+        Return the queryset reading values of the serialized columns.
+        """
+        return queryset.prefetch_related(None).values(*self.columns)
+
+    def _related(self, source, columns, pks):
+        """
+        Return dicts of lists of columns of related objects by primary
+        key, one dict per column.
+        """
+        field = self.model._meta.get_field(source)
+        if columns == ['pk'] and field.many_to_many:
+            if field.auto_created:
+                through, own, columns = (field.through, field.field.m2m_reverse_field_name(),
+                                         [field.field.m2m_field_name()])
+            else:
+                through, own, columns = (field.remote_field.through, field.m2m_field_name(),
+                                         [field.m2m_reverse_field_name()])
+            queryset = through.objects.order_by('pk')
+        else:
+            own = field.field.name if field.auto_created else field.related_query_name()
+            queryset = field.related_model.objects.order_by('pk')
+        values = [{} for column in columns]
+        for chunk in chunked(pks, 500):
+            for row in queryset.filter(**{own + '__in': chunk}).values_list(own, *columns):
+                for column_values, value in zip(values, row[1:]):
+                    column_values.setdefault(row[0], []).append(value)
+        return values
+
+    def to_representation(self, rows):
+        rows = list(rows)
+        pks = [row['pk'] for row in rows]
+        # Columns of a related field are read together
+        sources = OrderedDict()
+        for name, kind, source in self.plan:
+            if kind == 'related':
+                sources.setdefault(source[0], []).append((name, source[1]))
+        related = {}
+        for source, names in sources.items():
+            values = self._related(source, [column for name, column in names], pks)
+            related.update(zip([name for name, column in names], values))
+
+        records = []
+        for row in rows:
+            record = OrderedDict()
+            for name, kind, source in self.plan:
+                if kind == 'plain':
+                    record[name] = row[source]
+                elif kind == 'related':
+                    record[name] = related[name].get(row['pk'], [])
+                else:
+                    value = row[source[0]]
+                    record[name] = None if value is None else source[1](value)
+            records.append(record)
+        return records
+
+
+class ErrorSerializer(serializers.ModelSerializer):
+    class Meta:
+        fields = '__all__'
+        model = Error
 
 
-class LinkageSerializer(serializers.ModelSerializer):
+class LinkageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     def validate_autocase_pattern(self, data):
         if settings.CASELINK['401_ON_INVALID_PATTERN']:
             # TODO: avoid creating new instead of deleting old
@@ -18,9 +182,8 @@ class LinkageSerializer(serializers.ModelSerializer):
             if len(linkage) == 1:
                 linkage[0].delete()
 
-            for case in AutoCase.objects.all():
-                if test_pattern_match(data, case.id):
-                    return data
+            if AutoCase.match_pattern(data):
+                return data
             raise serializers.ValidationError("Pattern Invalid.")
         else:
             return data
@@ -30,10 +193,12 @@ class LinkageSerializer(serializers.ModelSerializer):
         model = Linkage
 
 
-class WorkItemSerializer(serializers.ModelSerializer):
+class WorkItemSerializer(EmbedMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    embeddable = {'linkages': LinkageSerializer, 'errors': ErrorSerializer}
     linkages = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
     blacklist_entries = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
     patterns = serializers.SerializerMethodField()
+    values_sources = {'patterns': ('linkages', 'autocase_pattern')}
 
     def get_patterns(self, wi):
         return [link.autocase_pattern for link in wi.linkages.all()]
@@ -43,7 +208,8 @@ class WorkItemSerializer(serializers.ModelSerializer):
         model = WorkItem
 
 
-class AutoCaseSerializer(serializers.ModelSerializer):
+class AutoCaseSerializer(EmbedMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    embeddable = {'linkages': LinkageSerializer, 'errors': ErrorSerializer}
     linkages = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
     autocase_failures = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
     class Meta:
@@ -63,14 +229,14 @@ class BugSerializer(serializers.ModelSerializer):
         model = Bug
 
 
-class AutoCaseFailureSerializer(serializers.ModelSerializer):
+class AutoCaseFailureSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     blacklist_entries = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
     class Meta:
         fields = '__all__'
         model = AutoCaseFailure
 
 
-class BlackListEntrySerializer(serializers.ModelSerializer):
+class BlackListEntrySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         fields = '__all__'
         model = BlackListEntry
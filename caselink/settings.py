@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/1.8/ref/settings/
 
 from __future__ import absolute_import
 
+from datetime import timedelta
 from celery.schedules import crontab
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -99,6 +100,11 @@ WSGI_APPLICATION = 'caselink.wsgi.application'
 
 
 CELERYBEAT_SCHEDULE = {
+    # Drain the error check queue in case a scheduled flush was lost
+    'check-queued-errors': {
+        'task': 'caselink.tasks.common.check_queued_errors',
+        'schedule': timedelta(minutes=10),
+    },
     # crontab(hour=0, minute=0, day_of_week='saturday')
     #'schedule-name': {
     #    'task': 'caselink.tasks.common.test_task',
@@ -149,6 +155,12 @@ REST_FRAMEWORK = {
 
 CASELINK = {
     '401_ON_INVALID_PATTERN': False,
+    # Number of processes used for matching patterns in manualinit, default to CPU count
+    'INIT_WORKERS': None,
+    # Queue saved objects and autolink / check errors in a celery task instead of in the request
+    'DEFER_ERROR_CHECK': False,
+    # Seconds a process uses its pattern matcher before checking if patterns changed elsewhere
+    'PATTERN_VERSION_INTERVAL': 1,
 }
 
 CASELINK_MAITAI = {
@@ -3,6 +3,7 @@ var htmlify = require('./lib/htmlify.js');
 var p = require('./lib/sharedParameters.js');
 var Vue = require('vue');
 var navBar = require('./mixins/nav-bar.js');
+var ServerSelectors = require('./lib/serverSelectors.js');
 
 var vm = new Vue({
   el: "#caselink",
@@ -19,32 +20,9 @@ var vm = new Vue({
     vm.dt = $('#sortable-table').DataSearchTable( {
       BaseTable: [dtMixins.DataTableJumpPageButton],
       "ajax": "/data/a2m/",
+      "serverSide": true,
       "iDisplayLength": 20,
       "bAutoWidth": false,
-      "selectorColumns": [
-        {
-          column: 'Component',
-          render: htmlify,
-          strict: true,
-        },
-        {
-          column: 'Framework',
-          render: htmlify,
-          strict: true,
-        },
-        {
-          column: 'Documents',
-          render: htmlify,
-        },
-        {
-          column: 'PR',
-          render: htmlify,
-        },
-        {
-          column: 'Errors',
-          render: htmlify,
-        }
-      ],
       "columns": [
         { "data": "case" },
         {
@@ -96,5 +74,12 @@ var vm = new Vue({
         }
       }
     });
+    ServerSelectors(vm.dt, '/data/a2m/', [
+      {column: 'Component', data: 'components'},
+      {column: 'Framework', data: 'framework'},
+      {column: 'Documents', data: 'documents'},
+      {column: 'PR', data: 'pr'},
+      {column: 'Errors', data: 'errors'},
+    ]);
   }
 });
@@ -4,6 +4,8 @@ var p = require('./lib/sharedParameters.js');
 var Vue = require('vue');
 var navBar = require('./mixins/nav-bar.js');
 var _api = require('./mixins/api.js');
+var ServerSelection = require('./lib/serverSelection.js');
+var ServerSelectors = require('./lib/serverSelectors.js');
 
 function _cleanEntryData() {
   return {
@@ -115,6 +117,7 @@ var vm = new Vue({
   mixins: [navBar, _api],
   data: {
     dt: null,
+    selection: null,
     editEntryData: {},
   },
   methods: {
@@ -130,15 +133,13 @@ var vm = new Vue({
       let row = this.dt.row(workItemRowSelector);
       if(row.data()) {
         this.getEntryData(id)
-          .then(function(data){
-            row.data(data).draw();
+          .then((data) => {
+            this.selection.update(data);
+            row.data(data).draw(false);
           });
       } else {
-        this.getEntryData(id)
-          .then(data => {
-            this.dt.row.add(data);
-            this.dt.draw();
-          });
+        // New entries are placed by the server
+        this.dt.draw(false);
       }
     },
     editEntryModal: function(status, data){
@@ -163,22 +164,19 @@ var vm = new Vue({
         {
           text: 'Select All Filtered',
           action: function ( e, dt, node, config ) {
-            var filterSet = vm.dt.$('tr', {filter:'applied'});
-            filterSet.each(function(){
-              vm.dt.row(this).select();
-            });
+            vm.selection.selectFiltered();
           }
         },
         {
           text: 'Edit',
           action: function ( e, dt, node, config ) {
-            var filterSet = vm.dt.$('tr', {selected:true});
-            if(filterSet.length > 1){
+            var records = vm.selection.records();
+            if(records.length > 1){
               alert("Linkage edit with multi-select is not supported yet.");
               return;
             }
-            filterSet.each(function(row){
-              vm.editEntryModal('show', vm.dt.row(this).data());
+            records.forEach(function(d){
+              vm.editEntryModal('show', d);
             });
           }
         },
@@ -191,15 +189,14 @@ var vm = new Vue({
         {
           text: 'Delete',
           action: function ( e, dt, node, config ) {
-            var filterSet = vm.dt.$('tr', {selected:true});
-            if(filterSet.length > 0){
-              let check = confirm(`You are going to delete ${filterSet.length} entrys, sure?`);
+            var records = vm.selection.records();
+            if(records.length > 0){
+              let check = confirm(`You are going to delete ${records.length} entrys, sure?`);
               if(check){
-                filterSet.each(function(entry) {
-                  let row = vm.dt.row(this);
-                  vm._restAjax('DELETE', `/blacklist/${row.data().id}/`)
+                records.forEach(function(entry) {
+                  vm._restAjax('DELETE', `/blacklist/${entry.id}/`)
                     .catch(err => alert(`Delete failed with ${err}`))
-                    .then(_ => {row.remove(); vm.dt.draw();});
+                    .then(_ => {vm.selection.remove(entry.id); vm.dt.draw(false);});
                 });
               }
             }
@@ -209,11 +206,9 @@ var vm = new Vue({
       initComplete: function(){
       },
       ajax: "data/bl/",
+      serverSide: true,
       iDisplayLength: 20,
       bAutoWidth: false,
-      selectorColumns: [
-        { column: 'Errors', render: htmlify, },
-      ],
       columns: [
         { data: "status", },
         { data: "description", render: function( data ) { return htmlify(data); } },
@@ -244,6 +239,10 @@ var vm = new Vue({
         });
       },
     });
+    vm.selection = ServerSelection(vm.dt, 'id');
+    ServerSelectors(vm.dt, 'data/bl/', [
+      {column: 'Errors', data: 'errors'},
+    ]);
   },
 });
 
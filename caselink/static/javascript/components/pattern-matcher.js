@@ -6,28 +6,56 @@ module.exports = {
   data: function (){
     return {
       pattern: '',
-      cases: ''
+      cases: '',
+      total: null,
+      next: null,
+      frameworks: {},
+      components: {},
     };
   },
   methods: {
+    queryCases: function(cursor){
+      var params = cursor ? {cursor: cursor} : {};
+      return $.get('pattern-matcher/' + this.pattern, params);
+    },
     fetchCases: _.debounce(function(pattern){
       var that = this;
-      $.get('pattern-matcher/' + this.pattern)
+      this.queryCases()
         .done(function(data){
+          that.total = data.total;
+          that.next = data.next;
+          that.frameworks = data.frameworks;
+          that.components = data.components;
           if(!data.cases || data.cases.length < 1){
             that.cases = 'No matching case founded.';
           }
-          that.cases = data.cases.join("<br>");
+          else{
+            that.cases = data.cases.join("<br>");
+          }
         })
         .fail(function(err){
           that.cases = 'Server Error';
         });
     },
       800),
+    fetchMore: function(){
+      var that = this;
+      this.queryCases(this.next)
+        .done(function(data){
+          that.next = data.next;
+          that.cases += "<br>" + data.cases.join("<br>");
+        })
+        .fail(function(err){
+          that.next = null;
+          that.cases += "<br>Server Error";
+        });
+    },
   },
   watch: {
     pattern: function(){
       this.cases = 'Loading...';
+      this.total = null;
+      this.next = null;
       this.fetchCases(this.pattern);
     }
   },
@@ -0,0 +1,53 @@
+// Selected rows of a server-side DataTable, kept across pages by key.
+// Only rows of the current page are loaded, so the data of selected rows
+// is kept here, and rows of a page are selected again when it's drawn.
+function ServerSelection(dt, key){
+  var selected = {},
+    reloading = false;
+
+  function select(records){
+    records.forEach(function(d){ selected[d[key]] = d; });
+  }
+
+  // Rows of the previous page are dropped on reload, they stay selected
+  dt.on('preXhr.dt', function(){ reloading = true; });
+  dt.on('draw.dt', function(){
+    reloading = false;
+    dt.rows(function(idx, d){ return d[key] in selected; }).select();
+  });
+  dt.on('select.dt', function(e, api, type, indexes){
+    if(type === 'row'){
+      select(dt.rows(indexes).data().toArray());
+    }
+  });
+  dt.on('deselect.dt', function(e, api, type, indexes){
+    if(type === 'row' && !reloading){
+      dt.rows(indexes).data().each(function(d){ delete selected[d[key]]; });
+    }
+  });
+
+  return {
+    // Select every row matching the current search, on all pages
+    selectFiltered: function(){
+      var params = $.extend({}, dt.ajax.params(), {start: 0, length: -1});
+      return $.get(dt.ajax.url(), params).then(function(data){
+        select(data.data);
+        dt.rows(function(idx, d){ return d[key] in selected; }).select();
+      });
+    },
+    records: function(){
+      return Object.keys(selected).map(function(pk){ return selected[pk]; });
+    },
+    // Keep data of a selected row up to date when it's reloaded
+    update: function(record){
+      if(record[key] in selected){
+        selected[record[key]] = record;
+      }
+    },
+    remove: function(pk){
+      delete selected[pk];
+    },
+  };
+}
+
+module.exports = ServerSelection;
@@ -0,0 +1,31 @@
+// Selector filters of a server-side DataTable. Only rows of the current
+// page are loaded, so options are the distinct values of the columns
+// listed by the server, and a selected value filters the column by
+// exact match on the server.
+function escapeRegex(value){
+  return value.replace(/[.*+?^${}()|[\]\\]/g, '\\$&');
+}
+
+// 'columns' is a list of {column: header text, data: data name}
+function ServerSelectors(dt, url, columns){
+  var names = columns.map(function(c){ return c.data; });
+
+  return $.get(url, {values: names.join(',')}).then(function(values){
+    columns.forEach(function(c){
+      var column = dt.column(function(idx, data, node){
+        return $(node).text() == c.column;
+      });
+      var select = $('<select class="form-control input-sm"><option value=""></option></select>');
+      values[c.data].forEach(function(value){
+        select.append($('<option>').val(value).text(value));
+      });
+      select.on('change', function(){
+        var value = $(this).val();
+        column.search(value ? '^' + escapeRegex(value) + '$' : '', true, false).draw();
+      });
+      $(column.footer()).empty().append(select);
+    });
+  });
+}
+
+module.exports = ServerSelectors;
@@ -3,12 +3,15 @@ var htmlify = require('./lib/htmlify.js');
 var p = require('./lib/sharedParameters.js');
 var Vue = require('vue');
 var navBar = require('./mixins/nav-bar.js');
+var ServerSelection = require('./lib/serverSelection.js');
+var ServerSelectors = require('./lib/serverSelectors.js');
 
 var vm = new Vue({
   el: "#caselink",
   mixins: [navBar],
   data: {
     dt: null,
+    selection: null,
   },
   methods: {
     getManualCaseData: function(caseName){
@@ -22,8 +25,9 @@ var vm = new Vue({
       if (row.child())
         row.child().hide();
       this.getManualCaseData(caseName)
-        .then(function(data){
-          row.data(data.data[0]).draw();
+        .then((data) => {
+          this.selection.update(data.data[0]);
+          row.data(data.data[0]).draw(false);
         });
     },
   },
@@ -46,28 +50,19 @@ var vm = new Vue({
 
     linkage_modal.on("click", "#linkage_save", function(){
       var button = $(this);
-      var promises = [];
+      var operations = [];
       var deleted = linkage_modal.data('deleted');
 
       button.prop('disabled', true);
 
       for(var i = 0; i < deleted.length; i++){
-        console.log({method: 'DELETE', url:'/linkage/' + deleted[i].id + "/"});
-        promises.push(
-          $.ajax({method: 'DELETE', url:'/linkage/' + deleted[i].id + "/"})
-        );
+        operations.push({op: 'delete', model: 'linkage', id: deleted[i].id});
       }
 
       var comment = linkage_modal.find('#workitem_comment').val(),
         workitem = linkage_modal.find('#linkage_workitem').val();
 
-      console.log('PUT', '/workitem/' + workitem + "/", JSON.stringify({'id': workitem, 'comment': comment}));
-      promises.push($.ajax({
-        contentType: "application/json; charset=utf-8",
-        method: 'PUT',
-        url:'/workitem/' + workitem + "/",
-        data: JSON.stringify({'id': workitem, 'comment': comment}),
-      }));
+      operations.push({op: 'update', model: 'workitem', id: workitem, data: {'comment': comment}});
 
       var items = linkage_modal.find('.linkage-list-item');
 
@@ -79,26 +74,20 @@ var vm = new Vue({
           framework: ele.find("#linkage_framework").val(),
         };
         if(ele.data('status') == 'exists'){
-          console.log('PUT', '/linkage/' + ele.data('linkage').id + "/", JSON.stringify(data));
-          promises.push($.ajax({
-            contentType: "application/json; charset=utf-8",
-            method: 'PUT',
-            url:'/linkage/' + ele.data('linkage').id + "/",
-            data: JSON.stringify(data),
-          }));
+          operations.push({op: 'update', model: 'linkage', id: ele.data('linkage').id, data: data});
         }
         if(ele.data('status') == 'new'){
-          console.log('POST', '/linkage/', JSON.stringify(data));
-          promises.push($.ajax({
-            contentType: "application/json; charset=utf-8",
-            method: 'POST',
-            url:'/linkage/',
-            data: JSON.stringify(data),
-          }));
+          operations.push({op: 'create', model: 'linkage', data: data});
         }
       }
 
-      $.when.apply($, promises).then(function(schemas) {
+      // All changes are saved in one transaction, or none of them
+      $.ajax({
+        contentType: "application/json; charset=utf-8",
+        method: 'POST',
+        url:'/batch/',
+        data: JSON.stringify({operations: operations}),
+      }).then(function(data) {
         linkage_modal.modal('hide');
       }, function(e) {
         alert("Failed to save the linkage data.");
@@ -165,28 +154,23 @@ var vm = new Vue({
         {
           text: 'Select All Filted',
           action: function ( e, dt, node, config ) {
-            var filterSet = vm.dt.$('tr', {filter:'applied'});
-            filterSet.each(function(){
-              vm.dt.row(this).select();
-            });
+            vm.selection.selectFiltered();
           }
         },
         {
           text: 'Edit',
           action: function ( e, dt, node, config ) {
-            var filterSet = vm.dt.$('tr', {selected:true});
-            if(filterSet.length > 1){
+            var records = vm.selection.records();
+            if(records.length > 1){
               alert("Linkage edit with multi-select is not supported yet.");
               return;
             }
-            filterSet.each(function(){
+            records.forEach(function(d){
               //with select: single, only one row is processed.
-              var d = vm.dt.row(this).data();
               var linkage_list = linkage_modal.find('#linkage_list').empty();
               linkage_modal.data('deleted', []);
-              linkage_modal.data('row', vm.dt.row(this));
-              $.get("/workitem/" + d.polarion + "/link/").done(function(data){
-                $.each(data, function(idx, ele){
+              $.get("/workitem/", {ids: d.polarion, embed: 'linkages', fields: 'id,linkages'}).done(function(data){
+                $.each(data[0].linkages, function(idx, ele){
                   var new_item = linkage_list_item.clone();
                   new_item.find("#comment").val(ele.comment);
                   new_item.find("#linkage_pattern").val(ele.autocase_pattern);
@@ -197,7 +181,10 @@ var vm = new Vue({
                   linkage_list.append(new_item);
                 });
               });
-              linkage_modal.find('#linkage_workitem').val(d.polarion).prop('disabled', true);
+              // Only rows of current page are loaded, add the workitem as an option
+              linkage_modal.find('#linkage_workitem').empty()
+                .append('<option value="' + d.polarion + '">' + d.polarion + '</option>')
+                .val(d.polarion).prop('disabled', true);
               linkage_modal.modal('show');
             });
           }
@@ -205,14 +192,12 @@ var vm = new Vue({
         {
           text: 'Create Automated Request',
           action: function ( e, dt, node, config ) {
-            var filterSet = vm.dt.$('tr', {selected:true});
+            var records = vm.selection.records();
             var checkFlag = true;
             caseInput.val('');
             labelInput.val(labelDefault);
-            var count = filterSet.length;
-            filterSet.each(function(){
-              var row = vm.dt.row(this);
-              var d = row.data();
+            var count = records.length;
+            records.forEach(function(d){
               if(d.automation !== "notautomated"){
                 alert("Create automation request for a " + d.automation + " is not allowed.");
                 checkFlag = false;
@@ -240,13 +225,6 @@ var vm = new Vue({
 
       ],
       initComplete: function(){
-        var wi_select = $('#linkage_workitem');
-        vm.dt.column(function(idx, data, node){
-          return $(node).text() == 'Polarion';
-        }).data().each(function(d, j){
-          wi_select.append('<option value="' + d + '">' + d + '</option>');
-        });
-
         var fr_select = linkage_list_item.find('#linkage_framework');
         $.get("/framework/").done(function(d){
           d = d.results;
@@ -256,23 +234,9 @@ var vm = new Vue({
         });
       },
       "ajax": "/data/m2a/",
+      "serverSide": true,
       "iDisplayLength": 20,
       "bAutoWidth": false,
-      "selectorColumns": [
-        {
-          column: 'Documents',
-          render: htmlify,
-        },
-        {
-          column: 'Automation',
-          render: htmlify,
-          strict: true,
-        },
-        {
-          column: 'Errors',
-          render: htmlify,
-        },
-      ],
       "columns": [
         {
           "data": "polarion",
@@ -343,6 +307,12 @@ var vm = new Vue({
         });
       },
     });
+    vm.selection = ServerSelection(vm.dt, 'polarion');
+    ServerSelectors(vm.dt, '/data/m2a/', [
+      {column: 'Documents', data: 'documents'},
+      {column: 'Automation', data: 'automation'},
+      {column: 'Errors', data: 'errors'},
+    ]);
   },
 });
 
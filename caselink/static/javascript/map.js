@@ -1,85 +1,100 @@
 var d3 = require('d3');
 var scaleLinear = require('d3-scale').scaleLinear;
+var scaleSqrt = require('d3-scale').scaleSqrt;
 var Vue = require('vue');
 var p = require('./lib/sharedParameters.js');
 var navBar = require('./mixins/nav-bar.js');
 
+// Clusters with more nodes than this are drawn as a single bubble
+var COLLAPSE_SIZE = 500;
+
 var vm = new Vue({
   el: "#linkage-map",
   mixins: [navBar],
   data: {},
-  methods: {},
-  watch: {},
-  delimiters: ['${', '}'],
-  mounted: function(){
-    $.get("data/m2a/")
-      .done(function(data){
-        let workitems = data.data.filter((a) => {return a.cases.length > 0;}),
-          autoDict = workitems.reduce((a, b) => {(b.cases.reduce((x, y) => {return a[y]?a[y].count += 1: a[y] = {case: y, count: 1};}, null)); return a;}, {}),
-          wiDict = workitems.reduce(function(a, b){a[b.polarion] = b; return a;}, {}),
-          autocases = d3.values(autoDict);
+  methods: {
+    draw: function(data){
+      let workitems = data.workitems,
+        autocases = data.autocases,
+        collapsed = data.clusters.filter((c) => {return c.collapsed;});
+
+      let svg = d3.select("#linkage-map-svg"),
+        width = +svg.attr("width"),
+        height = +svg.attr("height");
+      svg.selectAll("*").remove();
+
+      let g = svg.append("g"),
+        maxLength = Math.max(workitems.length, autocases.length, 1),
+        mScaleX = scaleLinear().range([0, width]).domain([0, Math.max(workitems.length, 1)]),
+        aScaleX = scaleLinear().range([0, width]).domain([0, maxLength]),
+        cScaleX = scaleLinear().range([0, width]).domain([0, Math.max(collapsed.length, 1)]),
+        cScaleR = scaleSqrt().range([4, 40]).domain([0, d3.max(collapsed, (c) => {return c.workitems + c.autocases;}) || 1]);
 
-        let svg = d3.select("#linkage-map-svg"),
-          width = +svg.attr("width"),
-          height = +svg.attr("height"),
-          g = svg.append("g"),
-          maxLength = Math.max(workitems.length, autocases.length),
-          mRatio = workitems.length / maxLength,
-          aRatio = autocases.length / maxLength,
-          mScaleX = scaleLinear().range([0, width]).domain([0, workitems.length]),
-          aScaleX = scaleLinear().range([0, width]).domain([0, maxLength]);
+      workitems.forEach((d, i) => {d.x = mScaleX(i); d.y = 100;});
+      autocases.forEach((d, i) => {d.x = aScaleX(i); d.y = 700;});
 
-        var wiG = g.append("g"),
-          wi = wiG.selectAll('circle')
-          .data(workitems)
-          .enter()
-          .append("circle")
-          .attr("cy",function(d,i){d.y = 100; return d.y;})
-          .attr("cx",function(d,i){d.x = mScaleX(i); return d.x;})
-          .attr("fill","blue").attr("stroke","black")
-          .attr("r",2);
+      var color = {
+          'm2m': 'red',
+          's2s': 'black',
+          's2m': 'blue',
+          'm2s': 'green',
+        },
+        opacity = {
+          'm2m': 0.25,
+          's2s': 0.5,
+          's2m': 0.25,
+          'm2s': 0.75,
+        };
 
-        var autoG = g.append("g"),
-          auto = autoG.selectAll('rect')
-          .data(autocases)
-          .enter()
-          .append("circle")
-          .attr("cy",function(d,i){d.y = 700; return d.y;})
-          .attr("cx",function(d,i){d.x = aScaleX(i); return d.x;})
-          .attr("fill","pink").attr("stroke","black")
-          .attr("r",2);
+      g.append("g").selectAll('line')
+        .data(data.edges)
+        .enter()
+        .append("line")
+        .style("stroke", function(d){return color[d[2]];})
+        .style("stroke-opacity", function(d){return opacity[d[2]];})
+        .attr("x1",function(d){return workitems[d[0]].x;})
+        .attr("y1",function(d){return workitems[d[0]].y;})
+        .attr("x2",function(d){return autocases[d[1]].x;})
+        .attr("y2",function(d){return autocases[d[1]].y;});
 
-        var links = workitems.reduce((a, b) => { return a.concat(b.cases.reduce((x,y) => {x.push(
-          [b.polarion, y,
-            (autoDict[y].count == 1 && wiDict[b.polarion].cases.length == 1)?'s2s':
-            (autoDict[y].count == 1)?'s2m':
-            (wiDict[b.polarion].cases.length == 1)?'m2s':
-            'm2m']
-        ); return x;}, [])); }, []),
-          color = {
-            'm2m': 'red',
-            's2s': 'black',
-            's2m': 'blue',
-            'm2s': 'green',
-          },
-          opacity = {
-            'm2m': 0.25,
-            's2s': 0.5,
-            's2m': 0.25,
-            'm2s': 0.75,
-          };
-        var lineG = g.append("g"),
-          line = lineG.selectAll('line')
-          .data(links)
-          .enter()
-          .append("line")
-          .style("stroke", function(d){return color[d[2]];})
-          .style("stroke-opacity", function(d){return opacity[d[2]];})
-          .attr("x1",function(d){return wiDict[d[0]].x;})
-          .attr("y1",function(d){return wiDict[d[0]].y;})
-          .attr("x2",function(d){return autoDict[d[1]].x;})
-          .attr("y2",function(d){return autoDict[d[1]].y;});
-      });
+      g.append("g").selectAll('circle')
+        .data(workitems)
+        .enter()
+        .append("circle")
+        .attr("cy",function(d){return d.y;})
+        .attr("cx",function(d){return d.x;})
+        .attr("fill","blue").attr("stroke","black")
+        .attr("r",2);
+
+      g.append("g").selectAll('circle')
+        .data(autocases)
+        .enter()
+        .append("circle")
+        .attr("cy",function(d){return d.y;})
+        .attr("cx",function(d){return d.x;})
+        .attr("fill","pink").attr("stroke","black")
+        .attr("r",2);
+
+      // Collapsed clusters, click to show only the cluster
+      g.append("g").selectAll('circle')
+        .data(collapsed)
+        .enter()
+        .append("circle")
+        .attr("cy", 400)
+        .attr("cx",function(d,i){return cScaleX(i + 0.5);})
+        .attr("fill","orange").attr("stroke","black")
+        .attr("r",function(d){return cScaleR(d.workitems + d.autocases);})
+        .on("click", function(d){vm.load({cluster: d.id});})
+        .append("title")
+        .text(function(d){return `${d.id}: ${d.workitems} workitems, ${d.autocases} autocases, ${d.edges} links`;});
+    },
+    load: function(params){
+      $.get("data/graph/", params).done((data) => {this.draw(data);});
+    },
+  },
+  watch: {},
+  delimiters: ['${', '}'],
+  mounted: function(){
+    this.load({collapse: COLLAPSE_SIZE});
   }
 });
-
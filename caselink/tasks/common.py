@@ -1,4 +1,7 @@
+import time
 import datetime
+from collections import OrderedDict
+from django.conf import settings
 from django.core import serializers
 from django.db import transaction
 from celery import shared_task, current_task
@@ -12,23 +15,85 @@ except ImportError:
 
 from caselink.models import (
     Framework, Project, Document, Component, Arch,
-    WorkItem, AutoCase, Linkage, Bug, AutoCaseFailure)
+    WorkItem, AutoCase, Linkage, Bug, AutoCaseFailure,
+    PendingErrorCheck, flush_error_check_queue, bulk_mode, bump_data_version, rebuild_listings)
+from caselink.models.checks import check_workitems, check_autocases, check_linkages, check_in_chunks
+from caselink.utils.batch import parallel_match_matrix
+from caselink.utils.helpers import chunked
 
 
 BACKUP_DIR = 'caselink/backups'
 
 
 @transaction.atomic
-def init_linkage():
-    """Link cases according by pattern"""
-    for case in AutoCase.objects.all():
-        case.autolink()
-        case.save()
+def init_linkage(workers=None):
+    """
+    Link cases according by pattern, all patterns are matched against all
+    autocases in one batch by a pool of processes, then the m2m tables are
+    rewritten in bulk. Return time spent in each phase.
+    """
+    timings = OrderedDict()
+    started = time.time()
+
+    case_ids = list(AutoCase.objects.values_list('id', flat=True))
+    links = [(model, pk, pattern)
+             for model in (Linkage, AutoCaseFailure)
+             for pk, pattern in model.objects.values_list('id', 'autocase_pattern')]
+    timings['load'], started = time.time() - started, time.time()
+
+    pattern_idx, case_idx = parallel_match_matrix(
+        case_ids, [pattern for _, _, pattern in links],
+        workers or settings.CASELINK.get('INIT_WORKERS'))
+    timings['match'], started = time.time() - started, time.time()
+
+    for model in (Linkage, AutoCaseFailure):
+        through = model.autocases.through
+        source = '%s_id' % model.autocases.field.m2m_field_name()
+        through.objects.all().delete()
+        through.objects.bulk_create([
+            through(**{source: links[p_idx][1], 'autocase_id': case_ids[c_idx]})
+            for p_idx, c_idx in zip(pattern_idx, case_idx)
+            if links[p_idx][0] is model
+        ], batch_size=500)
+    timings['write'], started = time.time() - started, time.time()
+
+    _prune_linkages()
+    bump_data_version()
+    timings['prune'], started = time.time() - started, time.time()
+
+    rebuild_listings()
+    timings['listing'] = time.time() - started
+    return timings
+
+
+def _prune_linkages():
+    """
+    Same as Linkage.autolink does, delete linkages whose autocases are
+    a strict subset of another linkage's of the same workitem.
+    """
+    linkage_cases = {}
+    for linkage_id, case_id in Linkage.autocases.through.objects.values_list('linkage_id', 'autocase_id'):
+        linkage_cases.setdefault(linkage_id, set()).add(case_id)
+    workitem_linkages = {}
+    for linkage_id, workitem_id in Linkage.objects.filter(workitem__isnull=False).values_list('id', 'workitem_id'):
+        workitem_linkages.setdefault(workitem_id, []).append(linkage_id)
+
+    redundant = set()
+    for linkages in workitem_linkages.values():
+        for linkage_id in linkages:
+            cases = linkage_cases.get(linkage_id, set())
+            if any(cases < linkage_cases.get(other, set()) for other in linkages):
+                redundant.add(linkage_id)
+    for chunk in chunked(redundant, 500):
+        for linkage in Linkage.objects.filter(id__in=chunk):
+            linkage.delete()
 
 
 @transaction.atomic
 def init_error_checking():
     """Check for error."""
+    # Queued objects are covered by the full check
+    PendingErrorCheck.objects.all().delete()
     update_workitem_error()
     update_autocase_error()
     update_linkage_error()
@@ -37,37 +102,46 @@ def init_error_checking():
 @shared_task
 @transaction.atomic
 def clean_and_restore(filename):
-    clean_all_db()
-    restore_all_db(filename)
+    # Everything is relinked and checked after restoring
+    with bulk_mode(reconcile=False):
+        clean_all_db()
+        restore_all_db(filename)
     init_linkage()
     init_error_checking()
 
 
+@shared_task
+def check_queued_errors():
+    """Autolink and check errors for queued objects"""
+    return "Objects checked: %s" % flush_error_check_queue()
+
+
+def _report_progress(current, total):
+    update_task_info('PROGRESS', meta={'current': current, 'total': total})
+
+
 @shared_task
 def update_linkage_error(links=None):
     """Check for errors in linkage"""
-    links = links or Linkage.objects.all()
-    for idx, link in enumerate(links):
-        link.error_check(depth=0)
-        update_task_info('PROGRESS', meta={'current': idx, 'total': len(links)})
+    added, removed = check_in_chunks(
+        check_linkages, Linkage, [link.pk for link in links] if links else None, _report_progress)
+    return "Errors added: %s, removed: %s" % (added, removed)
 
 
 @shared_task
 def update_workitem_error(cases=None):
     """Check for errors in workitems"""
-    cases = cases or WorkItem.objects.all()
-    for idx, case in enumerate(cases):
-        case.error_check(depth=0)
-        update_task_info(state='PROGRESS', meta={'current': idx, 'total': len(cases)})
+    added, removed = check_in_chunks(
+        check_workitems, WorkItem, [case.pk for case in cases] if cases else None, _report_progress)
+    return "Errors added: %s, removed: %s" % (added, removed)
 
 
 @shared_task
 def update_autocase_error(cases=None):
     """Check for errors in auto cases"""
-    cases = cases or AutoCase.objects.all()
-    for idx, case in enumerate(cases):
-        case.error_check(depth=0)
-        update_task_info(state='PROGRESS', meta={'current': idx, 'total': len(cases)})
+    added, removed = check_in_chunks(
+        check_autocases, AutoCase, [case.pk for case in cases] if cases else None, _report_progress)
+    return "Errors added: %s, removed: %s" % (added, removed)
 
 
 @shared_task
@@ -86,8 +160,9 @@ def backup_all_db():
 def restore_all_db(filename):
     with open(filename) as fl:
         data = fl.read()
-        for obj in serializers.deserialize("yaml", data):
-            obj.save()
+        with bulk_mode():
+            for obj in serializers.deserialize("yaml", data):
+                obj.save()
 
 
 @shared_task
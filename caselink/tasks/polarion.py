@@ -44,8 +44,6 @@ def create_workitem(wi):
                     error.id = error_message
                     error.workitems.add(workitem)
                     error.save()
-        workitem.error_check()
-        workitem.save()
     return True
 
 
@@ -108,10 +106,8 @@ def delete_workitem(wi_id):
     wi = models.WorkItem.objects.get(id=wi_id)
     if not any([getattr(wi, data) for data in wi._user_data]):
         if not wi.linkages.exists():
-            related_wis = wi.error_related.all()
+            # Duplicates of it are rechecked by the delete signal handler
             wi.delete()
-            for wi_r in related_wis:
-                wi_r.error_check()
             return
     wi.mark_deleted()
     wi.save()
@@ -127,6 +123,12 @@ def sync_with_polarion():
     if not settings.CASELINK_POLARION['ENABLE']:
         return settings.CASELINK_POLARION['REASON']
 
+    # Workitems are checked in one batch after syncing
+    with models.bulk_mode():
+        return _sync_with_polarion()
+
+
+def _sync_with_polarion():
     deleted_wi_ids = set()
     updated_wi_ids = set()
     skipped_wi_ids = set()
@@ -1,3 +1,1395 @@
-from django.test import TestCase
+import json
+import zlib
+from unittest import skipUnless
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
-# Create your tests here.
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models.signals import pre_save
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from caselink.models import (
+    WorkItem, AutoCase, Linkage, Bug, BlackListEntry, AutoCaseFailure,
+    Framework, Component, Arch, Document, Error, WorkItemListing, AutoCaseListing,
+    match_autocase, bulk_mode, flush_error_check_queue, rebuild_listings, changed_rows)
+from caselink.models import queue
+from caselink.models.checks import (
+    check_workitems, check_autocases, check_linkages, check_in_chunks,
+    WORKITEM_ERRORS, AUTOCASE_ERRORS, LINKAGE_ERRORS)
+from caselink.models.listing import autocase_records, listing_changes, CHANGES_SAFETY_WINDOW
+from caselink.models.models import get_pattern_matcher
+from caselink.models.version import bump_pattern_version, current_pattern_version, current_data_version
+from caselink.utils.helpers import is_pattern_match
+from caselink.utils.matcher import PatternMatcher
+from caselink.utils.graph import LinkageGraph, UnionFind
+from caselink.utils.batch import match_matrix, parallel_match_matrix, _match_matrix_fallback
+from caselink.tasks.common import init_linkage
+
+
+def streamed_json(response):
+    return json.loads(b''.join(response.streaming_content).decode('utf-8'))
+
+
+class RestQueryBudgetTest(TestCase):
+    """
+    Listing or retrieving objects with the REST API costs a fixed number of
+    queries, however many objects and related objects there are.
+    """
+
+    # Workitems created, each has two linkages and two autocases
+    SIZE = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        framework = Framework.objects.create(name='framework')
+        component = Component.objects.create(name='component')
+        arch = Arch.objects.create(name='x86_64')
+        document = Document.objects.create(id='document', title='Document')
+        error = Error.objects.create(id='ERROR', message='Error')
+
+        # Errors are set by hand, objects are not linked or checked
+        with bulk_mode(reconcile=False):
+            for idx in range(cls.SIZE):
+                workitem = WorkItem.objects.create(id='WI-%s' % idx, title='Workitem %s' % idx)
+                workitem.archs.add(arch)
+                workitem.documents.add(document)
+                workitem.errors.add(error)
+                failure = AutoCaseFailure.objects.create(
+                    framework=framework, autocase_pattern='case.%s' % idx, failure_regex='failed')
+                failure.errors.add(error)
+                entry = BlackListEntry.objects.create(status='bug', description='Entry %s' % idx)
+                entry.bugs.add(Bug.objects.create(id='BUG-%s' % idx))
+                entry.workitems.add(workitem)
+                entry.autocase_failures.add(failure)
+                entry.errors.add(error)
+                for sub_idx in range(2):
+                    autocase = AutoCase.objects.create(id='case.%s.%s' % (idx, sub_idx), framework=framework)
+                    autocase.archs.add(arch)
+                    autocase.components.add(component)
+                    autocase.errors.add(error)
+                    failure.autocases.add(autocase)
+                    linkage = Linkage.objects.create(
+                        workitem=workitem, framework=framework, autocase_pattern='case.%s.%s' % (idx, sub_idx))
+                    linkage.autocases.add(autocase)
+                    linkage.errors.add(error)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def assertQueryBudget(self, url, budget, **params):
+        with self.assertNumQueries(budget):
+            response = self.client.get(url, dict(params, format='json'))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_workitem_list(self):
+        # count, page, archs, documents, errors, linkages, blacklist entries
+        response = self.assertQueryBudget('/workitem/', 7)
+        self.assertEqual(len(response.data['results']), self.SIZE)
+        self.assertEqual(len(response.data['results'][0]['patterns']), 2)
+
+    def test_workitem_detail(self):
+        # validators, workitem, archs, documents, errors, linkages, blacklist entries
+        self.assertQueryBudget('/workitem/WI-0/', 7)
+
+    def test_autocase_list(self):
+        response = self.assertQueryBudget('/autocase/', 7)
+        self.assertEqual(len(response.data['results']), self.SIZE * 2)
+
+    def test_autocase_detail(self):
+        self.assertQueryBudget('/autocase/case.0.0/', 7)
+
+    def test_linkage_list(self):
+        response = self.assertQueryBudget('/linkage/', 4)
+        self.assertEqual(len(response.data['results']), self.SIZE * 2)
+
+    def test_linkage_detail(self):
+        self.assertQueryBudget('/linkage/%s/' % Linkage.objects.first().pk, 4)
+
+    def test_autocase_failure_list(self):
+        response = self.assertQueryBudget('/autocase_failure/', 5)
+        self.assertEqual(len(response.data['results']), self.SIZE)
+
+    def test_autocase_failure_detail(self):
+        self.assertQueryBudget('/autocase_failure/%s/' % AutoCaseFailure.objects.first().pk, 4)
+
+    def test_blacklist_list(self):
+        response = self.assertQueryBudget('/blacklist/', 6)
+        self.assertEqual(len(response.data['results']), self.SIZE)
+
+    def test_blacklist_detail(self):
+        self.assertQueryBudget('/blacklist/%s/' % BlackListEntry.objects.first().pk, 5)
+
+    def test_sparse_fields(self):
+        # count, page, linkages for patterns
+        response = self.assertQueryBudget('/workitem/', 3, fields='id,patterns')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'patterns'})
+        response = self.assertQueryBudget('/autocase/case.0.0/', 2, fields='id,framework')
+        self.assertEqual(response.data, {'id': 'case.0.0', 'framework': 'framework'})
+
+    def test_keyset_pagination(self):
+        ids, url = [], '/autocase/?after=&limit=3&fields=id&format=json'
+        while url:
+            # Next links carry the query string
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            ids.extend(autocase['id'] for autocase in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(ids, sorted(AutoCase.objects.values_list('id', flat=True)))
+        response = self.client.get('/linkage/', {'after': 'invalid', 'format': 'json'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_offset_pagination(self):
+        response = self.assertQueryBudget('/linkage/', 4, offset=2, limit=2)
+        self.assertEqual(response.data['count'], self.SIZE * 2)
+        # Without 'after' lists keep the limit / offset response
+        response = self.assertQueryBudget('/autocase/', 2, fields='id', limit=3)
+        self.assertEqual(list(response.data), ['count', 'next', 'previous', 'results'])
+        self.assertIn('offset=3', response.data['next'])
+
+    def test_multi_get(self):
+        # workitems, archs, documents, errors, linkages, blacklist entries,
+        # autocases and errors of linkages
+        for size in (1, self.SIZE):
+            ids = ','.join('WI-%s' % idx for idx in range(size))
+            response = self.assertQueryBudget('/workitem/', 8, ids=ids, embed='linkages,errors')
+            self.assertEqual(len(response.data), size)
+        linkage = response.data[0]['linkages'][0]
+        self.assertEqual(linkage['autocases'], ['case.0.0'])
+        self.assertEqual(response.data[0]['errors'], [{'id': 'ERROR', 'message': 'Error'}])
+
+        # autocases, linkages, autocases and errors of linkages
+        response = self.assertQueryBudget('/autocase/', 4, ids='case.0.0,case.0.1,unknown',
+                                          fields='id,linkages', embed='linkages')
+        self.assertEqual([autocase['id'] for autocase in response.data], ['case.0.0', 'case.0.1'])
+        self.assertEqual(response.data[0]['linkages'][0]['autocase_pattern'], 'case.0.0')
+
+    def test_fast_format(self):
+        # count, page, archs, documents, errors, linkages with patterns, blacklist
+        # entries, a keyset page has no count
+        for url, budget, params in (('/workitem/', 7, {}), ('/autocase/', 7, {}),
+                                    ('/workitem/', 3, {'fields': 'id,patterns,updated'}),
+                                    ('/autocase/', 2, {'ids': 'case.0.0,case.1.1', 'fields': 'id,linkages'}),
+                                    ('/autocase/', 6, {'limit': 3, 'after': 'case.0.1'})):
+            expected = self.client.get(url, dict(params, format='json')).data
+            with self.assertNumQueries(budget):
+                response = self.client.get(url, dict(params, format='fast'))
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            if 'results' in expected:
+                next_link = expected['next'] and expected['next'].replace('format=json', 'format=fast')
+                self.assertEqual(data['next'], next_link)
+                expected, data = expected['results'], data['results']
+            self.assertEqual(data, expected)
+        # Embedded objects are serialized as usual
+        response = self.client.get('/workitem/', {'format': 'fast', 'embed': 'linkages'})
+        self.assertEqual(response.json()['results'][0]['linkages'][0]['workitem'], 'WI-0')
+
+    def test_workitem_linkage_list(self):
+        # workitem, linkages, autocases, errors
+        self.assertQueryBudget('/workitem/WI-0/linkage/', 4)
+
+
+class ConditionalRequestTest(TransactionTestCase):
+    """
+    Detail endpoints are validated with the row version and modified time.
+    """
+
+    # Rows are stamped when changes commit
+    def setUp(self):
+        framework = Framework.objects.create(name='framework')
+        self.workitem = WorkItem.objects.create(id='WI-0', title='Workitem')
+        AutoCase.objects.create(id='case.0', framework=framework)
+        self.linkage = Linkage.objects.create(
+            workitem=self.workitem, framework=framework, autocase_pattern='case.0')
+        self.client = APIClient()
+
+    def test_not_modified(self):
+        for url in ('/workitem/WI-0/', '/autocase/case.0/', '/linkage/%s/' % self.linkage.pk):
+            response = self.client.get(url, {'format': 'json'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['ETag'], '"%s"' % response.data['version'])
+            with self.assertNumQueries(1):
+                cached = self.client.get(url, {'format': 'json'}, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(cached.status_code, 304)
+            cached = self.client.get(url, {'format': 'json'}, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(cached.status_code, 304)
+
+    def test_changed(self):
+        etag = self.client.get('/workitem/WI-0/', {'format': 'json'})['ETag']
+        # Changing a linkage changes the workitem it belongs to
+        self.linkage.autocase_pattern = 'case.1'
+        self.linkage.save()
+        response = self.client.get('/workitem/WI-0/', {'format': 'json'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['patterns'], ['case.1'])
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_match(self):
+        etag = self.client.get('/workitem/WI-0/', {'format': 'json'})['ETag']
+        response = self.client.patch('/workitem/WI-0/', {'comment': 'First'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        # Another client still has the old version
+        response = self.client.patch('/workitem/WI-0/', {'comment': 'Second'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(WorkItem.objects.get(pk='WI-0').comment, 'First')
+
+    def test_concurrent_if_match(self):
+        url = '/workitem/WI-0/'
+        etag = self.client.get(url, {'format': 'json'})['ETag']
+        interleaved = []
+
+        def write_again(sender, instance, **kwargs):
+            # A second write of the same version, checked before the first commits
+            if not interleaved:
+                interleaved.append(None)
+                interleaved[0] = self.client.patch(url, {'comment': 'Second'}, format='json', HTTP_IF_MATCH=etag)
+
+        pre_save.connect(write_again, sender=WorkItem)
+        try:
+            response = self.client.patch(url, {'comment': 'First'}, format='json', HTTP_IF_MATCH=etag)
+        finally:
+            pre_save.disconnect(write_again, sender=WorkItem)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(interleaved[0].status_code, 412)
+        self.assertEqual(WorkItem.objects.get(pk='WI-0').comment, 'First')
+
+    def test_one_version_per_write(self):
+        etag = self.client.get('/workitem/WI-0/', {'format': 'json'})['ETag']
+        for if_match in (False, True):
+            headers = {'HTTP_IF_MATCH': etag} if if_match else {}
+            version = current_data_version()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.patch('/workitem/WI-0/', {'comment': 'Changed'}, format='json', **headers)
+            self.assertEqual(response.status_code, 200)
+            bumps = [query for query in queries.captured_queries
+                     if query['sql'].startswith('UPDATE "caselink_dataversion"')]
+            self.assertEqual(len(bumps), 1)
+            self.assertEqual(current_data_version(), version + 1)
+            etag = response['ETag']
+            self.assertEqual(etag, '"%s"' % (version + 1))
+
+
+class DataCacheTest(TransactionTestCase):
+    """
+    Data listings are cached gzipped per data version and validated with ETag.
+    """
+
+    URLS = ('/data/m2a/', '/data/a2m/', '/data/bl/')
+
+    # Listings are refreshed when changes commit
+    def setUp(self):
+        cache.clear()
+        framework = Framework.objects.create(name='framework')
+        self.workitem = WorkItem.objects.create(id='WI-0', title='Workitem')
+        AutoCase.objects.create(id='case.0', framework=framework)
+        Linkage.objects.create(workitem=self.workitem, framework=framework, autocase_pattern='case.0')
+        BlackListEntry.objects.create(status='bug', description='Entry')
+
+    def test_not_modified(self):
+        for url in self.URLS:
+            response = self.client.get(url)
+            data = streamed_json(response)
+            self.assertEqual(response['ETag'], '"%s-%s"' % (url.split('/')[2], data['version']))
+            with self.assertNumQueries(1):
+                cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(cached.status_code, 304)
+            self.assertEqual(cached['ETag'], response['ETag'])
+
+    def test_changed(self):
+        etag = self.client.get('/data/m2a/')['ETag']
+        self.workitem.title = 'Changed'
+        self.workitem.save()
+        response = self.client.get('/data/m2a/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(streamed_json(response)['data'][0]['title'], 'Changed')
+
+    def test_gzip(self):
+        for url in self.URLS:
+            expected = streamed_json(self.client.get(url))
+            # Served from the cache, only the data version is read
+            with self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+                payload = b''.join(response.streaming_content)
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(json.loads(zlib.decompress(payload, 16 + zlib.MAX_WBITS).decode('utf-8')), expected)
+
+
+class DataStreamTest(TestCase):
+    """
+    Data listings are streamed in chunks while records are read, memory
+    used doesn't grow with the listing.
+    """
+
+    SIZE = 2000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.add_rows(0)
+
+    @classmethod
+    def add_rows(cls, start):
+        WorkItemListing.objects.bulk_create(
+            WorkItemListing(polarion='WI-%05d' % idx, title='Workitem %s' % idx, automation='automated',
+                            patterns='["case.%s"]' % idx, cases='["case.%s"]' % idx)
+            for idx in range(start, start + cls.SIZE))
+
+    def stream(self, **headers):
+        """
+        Return size of the streamed response, its largest chunk and peak memory used.
+        """
+        with mock.patch('caselink.views.views.GZIP_CHUNK_SIZE', 1024):
+            response = self.client.get('/data/m2a/', **headers)
+            self.assertTrue(response.streaming)
+            size = largest = peak = 0
+            if tracemalloc:
+                tracemalloc.start()
+            for chunk in response.streaming_content:
+                size, largest = size + len(chunk), max(largest, len(chunk))
+            if tracemalloc:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        return size, largest, peak
+
+    def test_chunks(self):
+        for headers in ({}, {'HTTP_ACCEPT_ENCODING': 'gzip'}):
+            cache.clear()
+            # Streamed on cache miss, then from the cache
+            for _ in range(2):
+                size, largest, _ = self.stream(**headers)
+                self.assertLess(largest, size / 10)
+
+    @skipUnless(tracemalloc, "Needs tracemalloc")
+    def test_memory(self):
+        streams = ({}, {'HTTP_ACCEPT_ENCODING': 'gzip'})
+        cache.clear()
+        small = [self.stream(**headers) for headers in streams for _ in range(2)]
+        self.add_rows(self.SIZE)
+        cache.clear()
+        large = [self.stream(**headers) for headers in streams for _ in range(2)]
+        for (size, _, peak), (large_size, _, large_peak) in zip(small, large):
+            self.assertGreater(large_size, size * 1.5)
+            # Only the cached gzipped payload grows
+            self.assertLess(large_peak - peak, (large_size - size) / 4)
+
+    def test_single(self):
+        data = self.client.get('/data/m2a/WI-00001/').json()['data']
+        self.assertEqual([record['polarion'] for record in data], ['WI-00001'])
+
+
+class PatternMatcherViewTest(TestCase):
+    """
+    Autocases matching a pattern are listed in pages.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        framework = Framework.objects.create(name='framework')
+        for idx in range(3):
+            AutoCase.objects.create(id='case.%s' % idx, framework=framework)
+
+    def test_pages(self):
+        response = self.client.get('/pattern-matcher/case', {'limit': 2})
+        self.assertEqual(response.json()['cases'], ['case.0', 'case.1'])
+        self.assertEqual(response.json()['next'], 'case.1')
+        response = self.client.get('/pattern-matcher/case', {'limit': 2, 'cursor': 'case.1'})
+        self.assertEqual(response.json()['cases'], ['case.2'])
+        self.assertIsNone(response.json()['next'])
+
+    def test_summary(self):
+        cache.clear()
+        response = self.client.get('/pattern-matcher/case', {'limit': 1})
+        self.assertEqual(response.json()['total'], 3)
+        self.assertEqual(response.json()['frameworks'], {'framework': 3})
+        # Summary of the data version is cached, a page only reads its own rows
+        with self.assertNumQueries(2):
+            response = self.client.get('/pattern-matcher/case', {'limit': 1, 'cursor': 'case.1'})
+        self.assertEqual(response.json()['cases'], ['case.2'])
+        self.assertEqual(response.json()['total'], 3)
+
+    def test_invalid_limit(self):
+        for limit in ('0', '-1', 'many'):
+            response = self.client.get('/pattern-matcher/case', {'limit': limit})
+            self.assertEqual(response.status_code, 400)
+
+
+class BatchWriteTest(TestCase):
+    """
+    Operations posted to the batch API are applied all together or not at all.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.framework = Framework.objects.create(name='framework')
+        cls.workitem = WorkItem.objects.create(id='WI-0', title='Workitem')
+        AutoCase.objects.create(id='case.0', framework=cls.framework)
+        cls.linkage = Linkage.objects.create(
+            workitem=cls.workitem, framework=cls.framework, autocase_pattern='case.1')
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def post(self, *operations):
+        return self.client.post('/batch/', {'operations': operations}, format='json')
+
+    def test_commit(self):
+        response = self.post(
+            {'op': 'delete', 'model': 'linkage', 'id': self.linkage.pk},
+            {'op': 'update', 'model': 'workitem', 'id': 'WI-0', 'data': {'comment': 'Updated'}},
+            {'op': 'create', 'model': 'linkage',
+             'data': {'workitem': 'WI-0', 'autocase_pattern': 'case.0', 'framework': 'framework'}})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['results']], [204, 200, 201])
+        # Autolinked before the results are represented
+        self.assertEqual(response.data['results'][2]['data']['autocases'], ['case.0'])
+        self.assertFalse(Linkage.objects.filter(pk=self.linkage.pk).exists())
+        self.assertEqual(WorkItem.objects.get(pk='WI-0').comment, 'Updated')
+
+    def test_rollback(self):
+        response = self.post(
+            {'op': 'update', 'model': 'workitem', 'id': 'WI-0', 'data': {'comment': 'Updated'}},
+            {'op': 'delete', 'model': 'linkage', 'id': self.linkage.pk + 1})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.data['committed'])
+        self.assertEqual([result['status'] for result in response.data['results']], [424, 404])
+        self.assertIsNone(WorkItem.objects.get(pk='WI-0').comment)
+
+
+class AutoCaseUpsertTest(TestCase):
+    """
+    Uploading the autocase list of a framework adds, flags and relinks autocases.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        framework = Framework.objects.create(name='framework')
+        Error.objects.create(id='AUTOCASE_DELETED_IN_PR', message='Deleted')
+        for error in ('NO_LINKAGE', 'MULTIPLE_WORKITEM', 'PATTERN_INVALID'):
+            Error.objects.create(id=error, message=error)
+        workitem = WorkItem.objects.create(id='WI-0', title='Workitem', automation='automated')
+        Linkage.objects.create(workitem=workitem, framework=framework, autocase_pattern='case.new')
+        AutoCase.objects.create(id='case.kept', framework=framework)
+        AutoCase.objects.create(id='case.gone', framework=framework)
+        AutoCase.objects.create(id='case.elsewhere', framework=Framework.objects.create(name='other'))
+
+    def upload(self, *case_ids):
+        return APIClient().post('/autocase/upsert/framework/', '\n'.join(case_ids) + '\n',
+                                content_type='text/plain')
+
+    def errors(self, case_id):
+        return set(AutoCase.objects.get(id=case_id).errors.values_list('id', flat=True))
+
+    def test_upsert(self):
+        response = self.upload('case.kept', 'case.new.1', 'case.other')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'framework': 'framework', 'added': 2, 'removed': 1,
+                                         'unchanged': 1, 'skipped': []})
+        self.assertEqual(self.errors('case.gone'), {'AUTOCASE_DELETED_IN_PR', 'NO_LINKAGE'})
+        self.assertEqual(self.errors('case.other'), {'NO_LINKAGE'})
+        self.assertEqual(self.errors('case.new.1'), set())
+        self.assertEqual(list(Linkage.objects.get().autocases.values_list('id', flat=True)), ['case.new.1'])
+        self.assertEqual(list(AutoCase.match_pattern('case.other')), ['case.other'])
+
+        # Still missing, it's flagged already
+        response = self.upload('case.kept', 'case.new.1', 'case.other')
+        self.assertEqual((response.data['added'], response.data['removed'], response.data['unchanged']), (0, 0, 3))
+
+        # Listed again, the flag is cleared
+        response = self.upload('case.kept', 'case.gone', 'case.new.1', 'case.other')
+        self.assertEqual((response.data['added'], response.data['removed'], response.data['unchanged']), (1, 0, 3))
+        self.assertEqual(self.errors('case.gone'), {'NO_LINKAGE'})
+
+    def test_other_framework(self):
+        response = self.upload('case.kept', 'case.gone', 'case.elsewhere')
+        self.assertEqual(response.data['skipped'], ['case.elsewhere'])
+        self.assertEqual(response.data['unchanged'], 2)
+        self.assertEqual(AutoCase.objects.get(id='case.elsewhere').framework_id, 'other')
+
+    def test_empty(self):
+        self.assertEqual(self.upload().status_code, 400)
+        self.assertNotIn('AUTOCASE_DELETED_IN_PR', self.errors('case.gone'))
+
+    def test_not_utf8(self):
+        response = APIClient().post('/autocase/upsert/framework/', b'case.kept\n\xff\xfe\n',
+                                    content_type='text/plain')
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('AUTOCASE_DELETED_IN_PR', self.errors('case.gone'))
+
+
+class ListingRecordsTest(TestCase):
+    """
+    Listing records of many objects are built in chunks, each query binds
+    fewer variables than older SQLite allows.
+    """
+
+    SIZE = 400
+
+    @classmethod
+    def setUpTestData(cls):
+        framework = Framework.objects.create(name='framework')
+        error = Error.objects.create(id='ERROR', message='Error')
+        case_ids = ['case.%03d' % idx for idx in range(cls.SIZE)]
+        AutoCase.objects.bulk_create([AutoCase(id=case_id, framework=framework) for case_id in case_ids])
+        AutoCase.errors.through.objects.bulk_create([
+            AutoCase.errors.through(autocase_id=case_id, error_id=error.pk) for case_id in case_ids])
+
+    def test_chunked_records(self):
+        # 6 lists and pks bound 6 times, 166 autocases a query
+        with self.assertNumQueries(3):
+            records = list(autocase_records(['case.%03d' % idx for idx in range(self.SIZE)]))
+        self.assertEqual(records, list(autocase_records()))
+        self.assertEqual(len(records), self.SIZE)
+        self.assertEqual(records[-1]['errors'], ['Error'])
+
+
+class ListingSearchTest(TransactionTestCase):
+    """
+    List columns of the listings are searched by their items, and rows
+    follow changes of the errors they list.
+    """
+
+    # Listing rows are refreshed when changes commit
+    def setUp(self):
+        framework = Framework.objects.create(name='framework')
+        self.error = Error.objects.create(id='ERROR', message='Fehler für Übersetzung')
+        for idx in range(2):
+            workitem = WorkItem.objects.create(id='WI-%s' % idx, title='Workitem %s' % idx)
+            autocase = AutoCase.objects.create(id='case.%s' % idx, framework=framework)
+            linkage = Linkage.objects.create(
+                workitem=workitem, framework=framework, autocase_pattern='case.%s' % idx)
+            linkage.autocases.add(autocase)
+        WorkItem.objects.get(pk='WI-0').errors.add(self.error)
+
+    def search(self, url, column, value, regex=False):
+        response = self.client.get(url, {
+            'draw': 1, 'start': 0, 'length': 10,
+            'columns[0][data]': column, 'columns[0][search][value]': value,
+            'columns[0][search][regex]': 'true' if regex else 'false'})
+        self.assertEqual(response.status_code, 200)
+        return sorted(record['polarion'] if url == '/data/m2a/' else record['case']
+                      for record in response.json()['data'])
+
+    def test_search_items(self):
+        self.assertEqual(self.search('/data/m2a/', 'errors', 'für'), ['WI-0'])
+        self.assertEqual(self.search('/data/m2a/', 'patterns', '^case.1$', regex=True), ['WI-1'])
+        self.assertEqual(self.search('/data/m2a/', 'cases', '"'), [])
+        self.assertEqual(self.search('/data/a2m/', 'polarion', '^WI-0$', regex=True), ['case.0'])
+        self.assertEqual(self.search('/data/a2m/', 'title', 'workitem'), ['case.0', 'case.1'])
+
+    def test_unsafe_regex(self):
+        # Matched as a substring instead
+        self.assertEqual(self.search('/data/m2a/', 'title', '(W+)+', regex=True), [])
+        self.assertEqual(self.search('/data/m2a/', 'title', 'Workitem [', regex=True), [])
+        WorkItem.objects.filter(pk='WI-1').update(title='(W+)+')
+        WorkItem.objects.get(pk='WI-1').save()
+        self.assertEqual(self.search('/data/m2a/', 'title', '(W+)+', regex=True), ['WI-1'])
+
+    def test_column_values(self):
+        response = self.client.get('/data/m2a/', {'values': 'errors,automation,documents'})
+        self.assertEqual(response.json(), {
+            'errors': ['Fehler für Übersetzung'], 'automation': ['notautomated'], 'documents': []})
+        response = self.client.get('/data/a2m/', {'values': 'framework,polarion'})
+        self.assertEqual(response.json(), {'framework': ['framework'], 'polarion': ['WI-0', 'WI-1']})
+        response = self.client.get('/data/bl/', {'values': 'errors'})
+        self.assertEqual(response.json(), {'errors': []})
+        self.assertEqual(self.client.get('/data/m2a/', {'values': 'need_automation'}).status_code, 400)
+
+    def test_error_message(self):
+        self.error.message = 'Renamed'
+        self.error.save()
+        self.assertEqual(WorkItemListing.objects.get(pk='WI-0').errors, '["Renamed"]')
+        self.assertEqual(self.search('/data/m2a/', 'errors', 'renamed'), ['WI-0'])
+        self.assertEqual(self.search('/data/m2a/', 'errors', 'für'), [])
+
+    def test_relate_error(self):
+        # Relating an error only refreshes rows of the related objects
+        self.error.autocases.add('case.1')
+        self.assertEqual(self.search('/data/a2m/', 'errors', 'für'), ['case.1'])
+        self.assertEqual(self.search('/data/m2a/', 'errors', 'für'), ['WI-0'])
+
+
+class ChangeFeedTest(TransactionTestCase):
+    """
+    Rows changed after a version are listed, and rows changed shortly before
+    it too, as a transaction may commit late.
+    """
+
+    # Changes are logged when they commit
+    def setUp(self):
+        self.workitem = WorkItem.objects.create(id='WI-0', title='Workitem')
+        WorkItem.objects.create(id='WI-1', title='Workitem')
+
+    def test_window(self):
+        self.workitem.title = 'Changed'
+        self.workitem.save()
+        self.assertEqual(listing_changes('m2a', current_data_version())[1], {'WI-0', 'WI-1'})
+        for _ in range(CHANGES_SAFETY_WINDOW):
+            WorkItem.objects.get(pk='WI-1').save()
+        self.assertEqual(listing_changes('m2a', current_data_version())[1], {'WI-1'})
+
+    def test_reset(self):
+        version = current_data_version()
+        rebuild_listings()
+        self.assertIsNone(listing_changes('m2a', version)[1])
+        # Loaded after the rebuild, not reset again
+        self.assertEqual(listing_changes('m2a', current_data_version())[1], set())
+        response = self.client.get('/data/m2a/', {'since': version})
+        self.assertTrue(response.json()['reset'])
+
+
+class PatternMatcherCacheTest(TransactionTestCase):
+    """
+    The pattern matcher of a process follows patterns changed by others.
+    """
+
+    # Matchers built in a transaction are checked until it commits
+    def setUp(self):
+        framework = Framework.objects.create(name='framework')
+        workitem = WorkItem.objects.create(id='WI-0', title='Workitem')
+        self.linkage = Linkage.objects.create(workitem=workitem, framework=framework, autocase_pattern='case.a')
+
+    def test_changed_elsewhere(self):
+        self.assertEqual(get_pattern_matcher().match('case.a'), {(Linkage, self.linkage.pk)})
+        # As saved by another process, count and ids of patterns are unchanged
+        Linkage.objects.filter(pk=self.linkage.pk).update(autocase_pattern='case.b')
+        bump_pattern_version()
+        # Version is only read again after the interval
+        with self.assertNumQueries(0):
+            self.assertEqual(get_pattern_matcher().match('case.a'), {(Linkage, self.linkage.pk)})
+        with override_settings(CASELINK=dict(settings.CASELINK, PATTERN_VERSION_INTERVAL=0)):
+            self.assertEqual(get_pattern_matcher().match('case.a'), set())
+            self.assertEqual(get_pattern_matcher().match('case.b'), {(Linkage, self.linkage.pk)})
+
+    def test_bumped_in_between(self):
+        get_pattern_matcher()
+        other = Linkage.objects.create(
+            workitem=self.linkage.workitem, framework=self.linkage.framework, autocase_pattern='case.c')
+        Linkage.objects.filter(pk=self.linkage.pk).update(autocase_pattern='case.b')
+
+        def bump_twice():
+            # Another process bumps between reading and bumping the version
+            bump_pattern_version()
+            bump_pattern_version()
+
+        with mock.patch('caselink.models.models.bump_pattern_version', bump_twice):
+            other.autocase_pattern = 'case.d'
+            other.save()
+        self.assertEqual(get_pattern_matcher().match('case.b'), {(Linkage, self.linkage.pk)})
+        self.assertEqual(get_pattern_matcher().match('case.d'), {(Linkage, other.pk)})
+
+    def test_rolled_back(self):
+        get_pattern_matcher()
+        with transaction.atomic():
+            Linkage.objects.get(pk=self.linkage.pk).delete()
+            self.assertEqual(get_pattern_matcher().match('case.a'), set())
+            transaction.set_rollback(True)
+        self.assertEqual(get_pattern_matcher().match('case.a'), {(Linkage, self.linkage.pk)})
+
+    def test_match_autocase(self):
+        failure = AutoCaseFailure.objects.create(
+            framework=self.linkage.framework, autocase_pattern='case..a', failure_regex='failed')
+        self.assertEqual(match_autocase('case.a'), ([self.linkage], [failure]))
+        self.assertEqual(match_autocase('case.x.a'), ([], [failure]))
+        failure.delete()
+        self.assertEqual(match_autocase('case.x.a'), ([], []))
+        self.assertEqual(match_autocase('case'), ([], []))
+
+    def test_version(self):
+        linkage = Linkage.objects.get(pk=self.linkage.pk)
+        version = current_pattern_version()
+        linkage.save()
+        self.assertEqual(current_pattern_version(), version)
+        linkage.autocase_pattern = 'case.b'
+        linkage.save()
+        self.assertEqual(current_pattern_version(), version + 1)
+        self.assertEqual(get_pattern_matcher().match('case.b'), {(Linkage, linkage.pk)})
+
+
+class PatternMatcherTest(SimpleTestCase):
+    """
+    Matching all patterns in one pass finds the same patterns as testing
+    each of them with is_pattern_match.
+    """
+
+    PATTERNS = {
+        'exact': 'a.b',
+        'gap': 'a..c',
+        'item': 'b',
+        'gaps': 'a..b..d',
+    }
+
+    def assertMatches(self, matcher, patterns, case_id, expected):
+        self.assertEqual(matcher.match(case_id), expected, case_id)
+        self.assertEqual(set(key for key, pattern in patterns.items() if is_pattern_match(pattern, case_id)),
+                         expected, case_id)
+
+    def test_match(self):
+        matcher = PatternMatcher(self.PATTERNS.items())
+        for case_id, expected in (
+                ('a.b', {'exact', 'item'}),
+                # Patterns match anywhere in the id
+                ('x.a.b.y', {'exact', 'item'}),
+                ('a.x.a.b', {'exact', 'item'}),
+                # A gap skips any number of items, none too
+                ('a.c', {'gap'}),
+                ('a.x.y.c', {'gap'}),
+                ('a.b.x.d', {'exact', 'item', 'gaps'}),
+                # Items of a segment are adjacent
+                ('a.d.b', {'item'}),
+                # Items are compared whole
+                ('ab.c', set()),
+                ('a.bc', set()),
+                ('', set())):
+            self.assertMatches(matcher, self.PATTERNS, case_id, expected)
+
+    def test_add_remove(self):
+        patterns = dict(self.PATTERNS, same='a.b')
+        matcher = PatternMatcher(patterns.items())
+        self.assertMatches(matcher, patterns, 'a.b', {'exact', 'item', 'same'})
+        # A pattern shared by another key is kept
+        matcher.remove('exact')
+        del patterns['exact']
+        self.assertMatches(matcher, patterns, 'a.b', {'item', 'same'})
+        # Replaced, the old pattern doesn't match any more
+        matcher.add('gap', 'x..y')
+        patterns['gap'] = 'x..y'
+        self.assertMatches(matcher, patterns, 'a.c', set())
+        self.assertMatches(matcher, patterns, 'x.c.y', {'gap'})
+        matcher.remove('unknown')
+        self.assertEqual(len(matcher), 4)
+        self.assertNotIn('exact', matcher)
+
+    def test_pruned(self):
+        matcher = PatternMatcher([('long', 'a.b..c'), ('short', 'a')])
+        matcher.remove('long')
+        self.assertEqual(matcher._root.children['a'].children, {})
+        matcher.remove('short')
+        self.assertEqual(matcher._root.children, {})
+        self.assertEqual(matcher.match('a.b.c'), set())
+
+
+class MatchMatrixTest(TestCase):
+    """
+    Patterns are evaluated against all autocase ids at once, and a full
+    relink writes the matched pairs.
+    """
+
+    CASE_IDS = ['a.b.c', 'a.b.d', 'x.a.a.b', 'b.a', 'x']
+
+    def pairs(self, result):
+        return set(zip([int(idx) for idx in result[0]], [int(idx) for idx in result[1]]))
+
+    def test_match_matrix(self):
+        patterns = [
+            'a.b',
+            # Items of segments in order, the gap may be empty
+            'a..d', 'b..a', 'a..b',
+            # Repeated items, an unknown item, longer than every id
+            'a.a', 'a.e', 'x.a.a.b.c',
+        ]
+        expected = {(0, 0), (0, 1), (0, 2), (1, 1), (2, 3), (3, 0), (3, 1), (3, 2), (4, 2)}
+        for match in (match_matrix, _match_matrix_fallback):
+            self.assertEqual(self.pairs(match(self.CASE_IDS, patterns)), expected, match.__name__)
+            self.assertEqual(self.pairs(match([], patterns)), set(), match.__name__)
+            self.assertEqual(self.pairs(match(self.CASE_IDS, [])), set(), match.__name__)
+
+    def test_without_numpy(self):
+        with mock.patch('caselink.utils.batch.NUMPY_INSTALLED', False), \
+                mock.patch('caselink.utils.batch._match_matrix_numpy') as numpy_match, \
+                self.assertLogs('caselink.utils.batch', 'WARNING'):
+            result = match_matrix(self.CASE_IDS, ['a..d'])
+        self.assertFalse(numpy_match.called)
+        self.assertEqual(self.pairs(result), {(0, 1)})
+
+    def test_parallel_match_matrix(self):
+        # Chunks of 1000 autocase ids at least are matched by each worker,
+        # indexes of later chunks are offset
+        case_ids = ['case.%s' % idx for idx in range(2500)]
+        result = parallel_match_matrix(case_ids, ['case.0', 'case.1999', '2400', 'none'], workers=2)
+        self.assertEqual(self.pairs(result), {(0, 0), (1, 1999), (2, 2400)})
+
+    def test_init_linkage(self):
+        framework = Framework.objects.create(name='framework')
+        with bulk_mode(reconcile=False):
+            AutoCase.objects.bulk_create([AutoCase(id=case_id, framework=framework) for case_id in self.CASE_IDS])
+            workitem = WorkItem.objects.create(id='WI-0', title='Workitem')
+            other = WorkItem.objects.create(id='WI-1', title='Other')
+            broad = Linkage.objects.create(workitem=workitem, framework=framework, autocase_pattern='a.b')
+            narrow = Linkage.objects.create(workitem=workitem, framework=framework, autocase_pattern='a.b.c')
+            stale = Linkage.objects.create(workitem=other, framework=framework, autocase_pattern='x')
+            unmatched = Linkage.objects.create(workitem=other, framework=framework, autocase_pattern='none')
+            failure = AutoCaseFailure.objects.create(
+                framework=framework, autocase_pattern='b..a', failure_regex='failed')
+            stale.autocases.add(AutoCase.objects.get(id='b.a'))
+        init_linkage(workers=1)
+
+        def linked(link):
+            return set(link.autocases.values_list('id', flat=True))
+
+        self.assertEqual(linked(broad), {'a.b.c', 'a.b.d', 'x.a.a.b'})
+        self.assertEqual(linked(stale), {'x', 'x.a.a.b'})
+        self.assertEqual(linked(failure), {'b.a'})
+        # Linkages matching a strict subset of another's autocases are pruned
+        self.assertFalse(Linkage.objects.filter(pk__in=[narrow.pk, unmatched.pk]).exists())
+
+
+class ErrorDiffTest(TestCase):
+    """
+    Error checking only writes rows of errors that changed.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        for error in WORKITEM_ERRORS + ('WORKITEM_DELETED', ):
+            Error.objects.create(id=error, message=error.lower())
+        cls.workitem = WorkItem.objects.create(id='WI-0', title='Workitem', comment='Comment')
+        cls.workitem.errors.add('WORKITEM_DELETED')
+
+    def assertWrites(self, count, check):
+        changed_rows(reset=True)
+        with CaptureQueriesContext(connection) as queries:
+            check()
+        self.assertEqual(changed_rows(), count)
+        writes = [query['sql'] for query in queries if not query['sql'].startswith('SELECT')]
+        self.assertEqual(len(writes) > 0, count > 0, writes)
+
+    def errors(self):
+        return set(self.workitem.errors.values_list('id', flat=True))
+
+    def test_unchanged(self):
+        self.assertWrites(0, lambda: self.workitem.error_check(depth=0))
+        self.assertWrites(0, lambda: check_workitems(['WI-0']))
+        self.assertEqual(self.errors(), {'WORKITEM_DELETED', 'WORKITEM_HAS_COMMENT'})
+
+    def test_changed(self):
+        self.workitem.comment = ''
+        # Only the cleared error is removed, sticky errors are kept
+        self.assertWrites(1, lambda: self.workitem.error_check(depth=0))
+        self.assertEqual(self.errors(), {'WORKITEM_DELETED'})
+        self.workitem.comment = 'Comment'
+        self.assertWrites(1, lambda: self.workitem.error_check(depth=0))
+
+
+class SaveErrorCheckTest(TestCase):
+    """
+    Errors are checked every time a object is saved.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Error.objects.create(id='WORKITEM_HAS_COMMENT', message='Comment')
+
+    def test_saved_again(self):
+        workitem = WorkItem.objects.create(id='WI-0', title='Workitem')
+        for comment, errors in (('Comment', ['WORKITEM_HAS_COMMENT']), ('', [])):
+            workitem.comment = comment
+            workitem.save()
+            self.assertEqual(list(workitem.errors.values_list('id', flat=True)), errors)
+
+
+class DuplicateGroupTest(TestCase):
+    """
+    Workitems with the same title, ignoring whitespaces, form a duplicate group.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Error.objects.create(id='WORKITEM_TITLE_DUPLICATE', message='Duplicate')
+        WorkItem.objects.create(id='WI-0', title='Same title')
+        WorkItem.objects.create(id='WI-1', title='  Same \t title ')
+        WorkItem.objects.create(id='WI-2', title='Other title')
+
+    def duplicated(self):
+        return sorted(WorkItem.objects.filter(errors='WORKITEM_TITLE_DUPLICATE').values_list('id', flat=True))
+
+    def test_whitespaces(self):
+        self.assertEqual(list(WorkItem.objects.get(pk='WI-0').get_duplicates()), [WorkItem.objects.get(pk='WI-1')])
+        self.assertFalse(WorkItem.objects.get(pk='WI-2').get_duplicates().exists())
+        self.assertEqual(self.duplicated(), ['WI-0', 'WI-1'])
+
+    def test_empty_titles(self):
+        WorkItem.objects.create(id='WI-3', title='')
+        WorkItem.objects.create(id='WI-4', title=' ')
+        self.assertEqual(self.duplicated(), ['WI-0', 'WI-1', 'WI-3', 'WI-4'])
+
+    def test_moved(self):
+        workitem = WorkItem.objects.get(pk='WI-1')
+        self.assertEqual(workitem.get_previous_duplicates(), [])
+        workitem.title = 'Other title'
+        workitem.update_hash()
+        self.assertEqual(workitem.get_previous_duplicates(), [WorkItem.objects.get(pk='WI-0')])
+        # The group it left is rechecked too
+        workitem.save()
+        self.assertEqual(self.duplicated(), ['WI-1', 'WI-2'])
+
+    def test_not_loaded(self):
+        workitem = WorkItem(id='WI-3', title='Other title')
+        workitem.update_hash()
+        self.assertEqual(workitem.get_previous_duplicates(), [])
+        self.assertEqual(list(workitem.get_duplicates()), [WorkItem.objects.get(pk='WI-2')])
+
+
+class SetErrorCheckTest(TestCase):
+    """
+    Set based checks compute each error flag from aggregates, other errors
+    (eg. WORKITEM_DELETED) are kept.
+    """
+
+    MODELS = (
+        (WorkItem, WORKITEM_ERRORS + ('WORKITEM_DELETED', ), check_workitems),
+        (AutoCase, AUTOCASE_ERRORS + ('AUTOCASE_PR_NOT_MERGED', ), check_autocases),
+        (Linkage, LINKAGE_ERRORS, check_linkages),
+    )
+
+    EXPECTED = {
+        (WorkItem, 'WI-auto'): {'WORKITEM_AUTOMATED_NO_LINKAGE'},
+        (WorkItem, 'WI-clean'): set(),
+        (WorkItem, 'WI-dup-1'): {'WORKITEM_TITLE_DUPLICATE'},
+        (WorkItem, 'WI-dup-2'): {'WORKITEM_TITLE_DUPLICATE', 'WORKITEM_HAS_COMMENT'},
+        (WorkItem, 'WI-multi'): {'WORKITEM_MULTI_PATTERN'},
+        (WorkItem, 'WI-notauto'): {'WORKITEM_NOTAUTOMATED_WITH_LINKAGE', 'WORKITEM_CHANGED'},
+        (AutoCase, 'case.a'): {'MULTIPLE_WORKITEM'},
+        (AutoCase, 'case.e'): {'NO_LINKAGE'},
+        (AutoCase, 'case.f'): set(),
+        (Linkage, 'multi-a'): {'PATTERN_DUPLICATE'},
+        (Linkage, 'multi-e'): {'PATTERN_INVALID'},
+        (Linkage, 'notauto'): {'PATTERN_DUPLICATE'},
+        (Linkage, 'clean'): set(),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        framework = Framework.objects.create(name='framework')
+        for model, errors, check in cls.MODELS:
+            for error in errors:
+                Error.objects.get_or_create(id=error, message=error.lower())
+        with bulk_mode(reconcile=False):
+            autocases = dict((case_id, AutoCase.objects.create(id=case_id, framework=framework))
+                             for case_id in ('case.a', 'case.e', 'case.f'))
+            workitems = {}
+            for pk, title, automation, extra in (
+                    ('WI-auto', 'Auto', 'automated', {}),
+                    ('WI-clean', 'Clean', 'automated', {}),
+                    ('WI-dup-1', 'Same', 'manualonly', {}),
+                    ('WI-dup-2', 'Same', 'notautomated', {'comment': 'Comment'}),
+                    ('WI-multi', 'Multi', 'automated', {}),
+                    ('WI-notauto', 'Not automated', 'noautomation', {'changes': 'Changed'})):
+                workitems[pk] = WorkItem.objects.create(id=pk, title=title, automation=automation, **extra)
+            cls.linkages = {}
+            for name, workitem, pattern, case_ids in (
+                    ('multi-a', 'WI-multi', 'case.a', ['case.a']),
+                    ('multi-e', 'WI-multi', 'case.e', []),
+                    ('notauto', 'WI-notauto', 'case.a', ['case.a']),
+                    ('clean', 'WI-clean', 'case.f', ['case.f'])):
+                linkage = cls.linkages[name] = Linkage.objects.create(
+                    workitem=workitems[workitem], framework=framework, autocase_pattern=pattern)
+                linkage.autocases.add(*[autocases[case_id] for case_id in case_ids])
+            # Sticky errors to keep, stale ones to remove
+            workitems['WI-clean'].errors.add('WORKITEM_DELETED')
+            workitems['WI-auto'].errors.add('WORKITEM_HAS_COMMENT')
+            autocases['case.f'].errors.add('AUTOCASE_PR_NOT_MERGED', 'NO_LINKAGE')
+
+    def errors(self, model, pk):
+        if model is Linkage:
+            pk = self.linkages[pk].pk
+        return set(model.objects.get(pk=pk).errors.values_list('id', flat=True))
+
+    def test_checks(self):
+        self.assertEqual(check_workitems(), (7, 1))
+        self.assertEqual(check_autocases(), (2, 1))
+        self.assertEqual(check_linkages(), (3, 0))
+        for (model, pk), errors in self.EXPECTED.items():
+            sticky = {'WI-clean': {'WORKITEM_DELETED'}, 'case.f': {'AUTOCASE_PR_NOT_MERGED'}}.get(pk, set())
+            self.assertEqual(self.errors(model, pk), errors | sticky, pk)
+        # Nothing to change on another pass
+        self.assertEqual(check_workitems(), (0, 0))
+
+    def test_same_as_error_check(self):
+        for model, _, _ in self.MODELS:
+            for instance in model.objects.all():
+                instance.error_check(depth=0)
+        expected = dict((key, self.errors(*key)) for key in self.EXPECTED)
+        for model, _, check in self.MODELS:
+            check()
+        self.assertEqual(dict((key, self.errors(*key)) for key in self.EXPECTED), expected)
+
+    def test_some(self):
+        # Duplicates are looked up among all objects, unknown ids are ignored
+        check_workitems(['WI-dup-1', 'WI-unknown'])
+        self.assertEqual(self.errors(WorkItem, 'WI-dup-1'), {'WORKITEM_TITLE_DUPLICATE'})
+        self.assertEqual(self.errors(WorkItem, 'WI-dup-2'), set())
+        self.assertEqual(self.errors(WorkItem, 'WI-auto'), {'WORKITEM_HAS_COMMENT'})
+        check_linkages([self.linkages['notauto'].pk])
+        self.assertEqual(self.errors(Linkage, 'notauto'), {'PATTERN_DUPLICATE'})
+        self.assertEqual(self.errors(Linkage, 'multi-a'), set())
+        self.assertEqual(check_autocases([]), (0, 0))
+
+    def test_chunks(self):
+        progress = []
+        with mock.patch('caselink.models.checks.CHECK_CHUNK_SIZE', 4):
+            result = check_in_chunks(check_workitems, WorkItem, progress=lambda *args: progress.append(args))
+        self.assertEqual(result, (7, 1))
+        self.assertEqual(progress, [(0, 6), (4, 6)])
+        self.assertEqual(self.errors(WorkItem, 'WI-dup-2'), self.EXPECTED[(WorkItem, 'WI-dup-2')])
+
+
+@override_settings(CASELINK=dict(settings.CASELINK, DEFER_ERROR_CHECK=True))
+class FlushScheduleTest(TransactionTestCase):
+    """
+    A flush of the queue is sent once committed, at most once in a window.
+    """
+
+    def setUp(self):
+        cache.delete(queue.FLUSH_SCHEDULED_KEY)
+
+    def test_rolled_back(self):
+        with mock.patch('caselink.models.queue.threading.Thread') as thread:
+            with transaction.atomic():
+                WorkItem.objects.create(id='WI-0', title='Workitem')
+                transaction.set_rollback(True)
+            self.assertIsNone(cache.get(queue.FLUSH_SCHEDULED_KEY))
+            WorkItem.objects.create(id='WI-0', title='Workitem')
+            WorkItem.objects.create(id='WI-1', title='Workitem')
+        self.assertEqual(thread.return_value.start.call_count, 1)
+
+    def test_no_broker(self):
+        cache.add(queue.FLUSH_SCHEDULED_KEY, True)
+        with mock.patch('caselink.tasks.common.check_queued_errors.apply_async', side_effect=IOError):
+            queue._send_flush_task()
+        # Sent again on next change
+        self.assertIsNone(cache.get(queue.FLUSH_SCHEDULED_KEY))
+
+
+class BulkModeTest(TestCase):
+    """
+    Objects saved in bulk mode, or queued, are autolinked and checked in
+    one batch with their related objects.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.framework = Framework.objects.create(name='framework')
+        for error in WORKITEM_ERRORS + AUTOCASE_ERRORS + LINKAGE_ERRORS:
+            Error.objects.create(id=error, message=error.lower())
+
+    def errors(self, instance):
+        return set(type(instance).objects.get(pk=instance.pk).errors.values_list('id', flat=True))
+
+    def linked(self, linkage):
+        return set(Linkage.objects.get(pk=linkage.pk).autocases.values_list('id', flat=True))
+
+    def create(self):
+        for case_id in ('case.a', 'case.b'):
+            AutoCase.objects.create(id=case_id, framework=self.framework)
+        workitem = WorkItem.objects.create(id='WI-0', title='Workitem', automation='automated')
+        return workitem, Linkage.objects.create(
+            workitem=workitem, framework=self.framework, autocase_pattern='case.a')
+
+    def test_reconciled_once(self):
+        with mock.patch('caselink.models.queue.check_instances', wraps=queue.check_instances) as check:
+            with bulk_mode():
+                workitem, linkage = self.create()
+                self.assertEqual(self.linked(linkage), set())
+                self.assertEqual(self.errors(workitem), set())
+            self.assertEqual(check.call_count, 1)
+        self.assertEqual(self.linked(linkage), {'case.a'})
+        self.assertEqual(self.errors(AutoCase(pk='case.b')), {'NO_LINKAGE'})
+        self.assertEqual(self.errors(AutoCase(pk='case.a')), set())
+        self.assertEqual(self.errors(workitem), set())
+
+    def test_related(self):
+        with bulk_mode():
+            workitem, linkage = self.create()
+        other = WorkItem.objects.create(id='WI-1', title='Other', automation='notautomated')
+        with bulk_mode():
+            # Checked as related objects of the changed ones
+            AutoCase.objects.get(pk='case.a').delete()
+            other.title = 'Workitem'
+            other.save()
+        self.assertEqual(self.linked(linkage), set())
+        self.assertEqual(self.errors(linkage), {'PATTERN_INVALID'})
+        self.assertEqual(self.errors(workitem), {'WORKITEM_TITLE_DUPLICATE'})
+        self.assertEqual(self.errors(other), {'WORKITEM_TITLE_DUPLICATE'})
+
+        with bulk_mode():
+            linkage.autocase_pattern = 'case.b'
+            linkage.save()
+        self.assertEqual(self.linked(linkage), {'case.b'})
+        self.assertEqual(self.errors(linkage), set())
+        self.assertEqual(self.errors(AutoCase(pk='case.b')), set())
+
+    def test_nested(self):
+        with bulk_mode():
+            with bulk_mode():
+                _, linkage = self.create()
+            self.assertEqual(self.linked(linkage), set())
+        self.assertEqual(self.linked(linkage), {'case.a'})
+
+    def test_not_reconciled(self):
+        with bulk_mode(reconcile=False):
+            workitem, linkage = self.create()
+        self.assertEqual(self.linked(linkage), set())
+        self.assertEqual(self.errors(AutoCase(pk='case.b')), set())
+
+    def test_failed(self):
+        # Changes of the transaction are rolled back, nothing to check
+        with mock.patch('caselink.models.queue.check_instances') as check:
+            with self.assertRaises(ValueError):
+                with transaction.atomic(), bulk_mode():
+                    self.create()
+                    raise ValueError()
+        self.assertFalse(check.called)
+        self.assertFalse(WorkItem.objects.exists())
+
+    def test_queued(self):
+        with override_settings(CASELINK=dict(settings.CASELINK, DEFER_ERROR_CHECK=True)):
+            workitem, linkage = self.create()
+        self.assertEqual(self.linked(linkage), set())
+        self.assertEqual(flush_error_check_queue(), 4)
+        self.assertEqual(self.linked(linkage), {'case.a'})
+        self.assertEqual(self.errors(AutoCase(pk='case.b')), {'NO_LINKAGE'})
+        self.assertEqual(flush_error_check_queue(), 0)
+
+
+class ListingRefreshTest(TransactionTestCase):
+    """
+    Listing rows affected by a change are refreshed when it commits, the
+    same as rebuilt from scratch, and clients following the ?since= change
+    feed keep the same rows as a full reload.
+    """
+
+    # Listing rows are refreshed when changes commit
+    def setUp(self):
+        # Responses are cached by data version, which restarts in every test
+        cache.clear()
+        self.framework = Framework.objects.create(name='framework')
+        self.error = Error.objects.create(id='ERROR', message='Error')
+        component = Component.objects.create(name='component')
+        document = Document.objects.create(id='document', title='Document')
+        Document.objects.create(id='other', title='Other')
+        with bulk_mode(reconcile=False):
+            for case_id in ('a.b', 'a.c', 'x.y'):
+                AutoCase.objects.create(id=case_id, framework=self.framework)
+            AutoCase.objects.get(pk='a.c').components.add(component)
+            for idx, pattern in enumerate(('a', 'x.y', None)):
+                workitem = WorkItem.objects.create(id='WI-%s' % idx, title='Workitem %s' % idx)
+                if pattern:
+                    linkage = Linkage.objects.create(
+                        workitem=workitem, framework=self.framework, autocase_pattern=pattern)
+                    linkage.autocases.add(*AutoCase.objects.filter(pk__startswith=pattern))
+            WorkItem.objects.get(pk='WI-0').documents.add(document)
+        # Not refreshed for objects written without reconciling
+        rebuild_listings()
+
+    def m2a(self, pk):
+        return dict((record['polarion'], record) for record in WorkItemListing.records()).get(pk)
+
+    def a2m(self, pk):
+        return dict((record['case'], record) for record in AutoCaseListing.records()).get(pk)
+
+    def assertRebuilt(self):
+        refreshed = list(WorkItemListing.records()), list(AutoCaseListing.records())
+        rebuild_listings()
+        self.assertEqual((list(WorkItemListing.records()), list(AutoCaseListing.records())), refreshed)
+
+    def test_created(self):
+        self.assertEqual(self.m2a('WI-0')['cases'], ['a.b', 'a.c'])
+        self.assertEqual(self.a2m('a.c')['documents'], ['document'])
+        AutoCase.objects.create(id='x.z', framework=self.framework)
+        workitem = WorkItem.objects.create(id='WI-3', title='Workitem 3')
+        Linkage.objects.create(workitem=workitem, framework=self.framework, autocase_pattern='x')
+        self.assertEqual(self.m2a('WI-3')['cases'], ['x.y', 'x.z'])
+        self.assertEqual(self.a2m('x.y')['polarion'], ['WI-1', 'WI-3'])
+        self.assertEqual(self.a2m('x.z')['title'], ['Workitem 3'])
+        self.assertRebuilt()
+
+    def test_related(self):
+        # Rows of related objects list the changed values
+        workitem = WorkItem.objects.get(pk='WI-0')
+        workitem.title = 'Renamed'
+        workitem.save()
+        self.assertEqual(self.a2m('a.b')['title'], ['Renamed'])
+        workitem.documents.add('other')
+        self.assertEqual(self.a2m('a.c')['documents'], ['document', 'other'])
+        AutoCase.objects.get(pk='x.y').errors.add(self.error)
+        self.error.message = 'Renamed error'
+        self.error.save()
+        self.assertIn('Renamed error', self.a2m('x.y')['errors'])
+        self.assertRebuilt()
+
+    def test_relinked(self):
+        with bulk_mode():
+            linkage = Linkage.objects.get(workitem='WI-0')
+            linkage.autocase_pattern = 'a.c'
+            linkage.save()
+        self.assertEqual(self.m2a('WI-0')['patterns'], ['a.c'])
+        self.assertEqual(self.m2a('WI-0')['cases'], ['a.c'])
+        self.assertEqual(self.a2m('a.b')['polarion'], [])
+        self.assertRebuilt()
+
+    def test_deleted(self):
+        AutoCase.objects.get(pk='a.b').delete()
+        self.assertIsNone(self.a2m('a.b'))
+        self.assertEqual(self.m2a('WI-0')['cases'], ['a.c'])
+        Linkage.objects.filter(workitem='WI-1').delete()
+        WorkItem.objects.get(pk='WI-1').delete()
+        self.assertIsNone(self.m2a('WI-1'))
+        self.assertEqual(self.a2m('x.y')['polarion'], [])
+        # Headings are not listed
+        WorkItem.objects.create(id='WI-heading', type='heading', title='Heading')
+        self.assertIsNone(self.m2a('WI-heading'))
+        self.assertRebuilt()
+
+    def test_since(self):
+        data = streamed_json(self.client.get('/data/m2a/'))
+        rows = dict((record['polarion'], record) for record in data['data'])
+        workitem = WorkItem.objects.get(pk='WI-0')
+        workitem.title = 'Renamed'
+        workitem.save()
+        WorkItem.objects.get(pk='WI-2').delete()
+        changes = self.client.get('/data/m2a/', {'since': data['version']}).json()
+        self.assertFalse(changes['reset'])
+        self.assertEqual(changes['deleted'], ['WI-2'])
+        self.assertIn({'polarion': 'WI-0', 'title': 'Renamed'},
+                      [{'polarion': record['polarion'], 'title': record['title']} for record in changes['data']])
+        rows.update((record['polarion'], record) for record in changes['data'])
+        for deleted in changes['deleted']:
+            rows.pop(deleted)
+        data = streamed_json(self.client.get('/data/m2a/'))
+        self.assertEqual(changes['version'], data['version'])
+        self.assertEqual(rows, dict((record['polarion'], record) for record in data['data']))
+
+
+def graph_edges(graph):
+    workitems, autocases = graph['workitems'], graph['autocases']
+    return dict(((workitems[w_idx]['id'], autocases[a_idx]['id']), kind)
+                for w_idx, a_idx, kind in graph['edges'])
+
+
+class LinkageGraphTest(SimpleTestCase):
+    """
+    Edges of the graph are kinded by the degree of their nodes, clusters
+    are connected workitems and autocases.
+    """
+
+    EDGES = [
+        ('WI-1', 'a'),
+        ('WI-2', 'b'), ('WI-2', 'c'),
+        ('WI-3', 'd'), ('WI-4', 'd'),
+        ('WI-6', 'e'), ('WI-5', 'e'), ('WI-5', 'f'), ('WI-6', 'f'),
+    ]
+
+    def test_union_find(self):
+        sets = UnionFind(4)
+        self.assertEqual(sets.union(0, 1), 0)
+        # The smaller set is merged into the larger one
+        self.assertEqual(sets.union(2, 1), 0)
+        self.assertEqual(sets.union(1, 2), 0)
+        self.assertEqual(sets.size[0], 3)
+        self.assertEqual(sets.add(), 4)
+        self.assertEqual(sets.union(4, 3), 4)
+        self.assertEqual([sets.find(item) for item in range(5)], [0, 0, 0, 4, 4])
+
+    def test_kinds(self):
+        graph = LinkageGraph(self.EDGES).as_dict()
+        self.assertEqual(graph_edges(graph), {
+            ('WI-1', 'a'): 's2s',
+            ('WI-2', 'b'): 's2m', ('WI-2', 'c'): 's2m',
+            ('WI-3', 'd'): 'm2s', ('WI-4', 'd'): 'm2s',
+            ('WI-6', 'e'): 'm2m', ('WI-5', 'e'): 'm2m', ('WI-5', 'f'): 'm2m', ('WI-6', 'f'): 'm2m',
+        })
+        self.assertEqual([node['degree'] for node in graph['autocases']], [1, 1, 1, 2, 2, 2])
+
+    def test_clusters(self):
+        graph = LinkageGraph(self.EDGES).as_dict()
+        # Largest first, named by the smallest workitem id
+        self.assertEqual(graph['clusters'], [
+            {'id': 'WI-5', 'workitems': 2, 'autocases': 2, 'edges': 4, 'collapsed': False},
+            {'id': 'WI-2', 'workitems': 1, 'autocases': 2, 'edges': 2, 'collapsed': False},
+            {'id': 'WI-3', 'workitems': 2, 'autocases': 1, 'edges': 2, 'collapsed': False},
+            {'id': 'WI-1', 'workitems': 1, 'autocases': 1, 'edges': 1, 'collapsed': False},
+        ])
+        self.assertEqual(set(node['cluster'] for node in graph['autocases'] if node['id'] in ('e', 'f')), {'WI-5'})
+
+    def test_collapse(self):
+        graph = LinkageGraph(self.EDGES).as_dict(collapse=2)
+        self.assertEqual(graph_edges(graph), {('WI-1', 'a'): 's2s'})
+        self.assertEqual([summary['collapsed'] for summary in graph['clusters']], [True, True, True, False])
+        # Edges refer to the shown nodes only
+        graph = LinkageGraph(self.EDGES).as_dict(cluster='WI-5')
+        self.assertEqual([node['id'] for node in graph['workitems']], ['WI-6', 'WI-5'])
+        self.assertEqual(set(graph_edges(graph).values()), {'m2m'})
+        self.assertEqual(LinkageGraph().as_dict(), {'workitems': [], 'autocases': [], 'edges': [], 'clusters': []})
+
+
+class GraphViewTest(TestCase):
+    """
+    The graph endpoint lists linked workitems and autocases, filtered by
+    document, component or framework.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        framework = Framework.objects.create(name='framework')
+        other = Framework.objects.create(name='other')
+        component = Component.objects.create(name='component')
+        document = Document.objects.create(id='document', title='Document')
+        with bulk_mode(reconcile=False):
+            autocases = dict((case_id, AutoCase.objects.create(id=case_id, framework=framework))
+                             for case_id in ('a', 'b'))
+            autocases['c'] = AutoCase.objects.create(id='c', framework=other)
+            autocases['a'].components.add(component)
+            for workitem_id, case_ids, extra in (
+                    ('WI-1', 'ab', {}),
+                    ('WI-2', 'b', {}),
+                    ('WI-3', 'c', {}),
+                    ('WI-heading', 'c', {'type': 'heading'}),
+                    (None, 'c', {})):
+                workitem = workitem_id and WorkItem.objects.create(id=workitem_id, title=workitem_id, **extra)
+                linkage = Linkage.objects.create(
+                    workitem=workitem, framework=framework, autocase_pattern=case_ids)
+                linkage.autocases.add(*[autocases[case_id] for case_id in case_ids])
+            WorkItem.objects.get(pk='WI-1').documents.add(document)
+
+    def setUp(self):
+        # Responses are cached by data version, which is rolled back after every test
+        cache.clear()
+
+    def graph(self, **params):
+        return streamed_json(self.client.get('/data/graph/', params))
+
+    def test_graph(self):
+        # Headings and linkages without a workitem are left out
+        graph = self.graph()
+        self.assertEqual(graph_edges(graph), {
+            ('WI-1', 'a'): 's2m', ('WI-1', 'b'): 'm2m', ('WI-2', 'b'): 'm2s', ('WI-3', 'c'): 's2s'})
+        self.assertEqual([summary['id'] for summary in graph['clusters']], ['WI-1', 'WI-3'])
+        self.assertEqual(graph['version'], current_data_version())
+
+    def test_filters(self):
+        self.assertEqual(graph_edges(self.graph(document='document')),
+                         {('WI-1', 'a'): 's2m', ('WI-1', 'b'): 's2m'})
+        self.assertEqual(graph_edges(self.graph(component='component')), {('WI-1', 'a'): 's2s'})
+        self.assertEqual(graph_edges(self.graph(framework='other')), {('WI-3', 'c'): 's2s'})
+        self.assertEqual(graph_edges(self.graph(framework='unknown')), {})
+
+    def test_collapse(self):
+        graph = self.graph(collapse=2)
+        self.assertEqual(graph_edges(graph), {('WI-3', 'c'): 's2s'})
+        self.assertTrue(graph['clusters'][0]['collapsed'])
+        self.assertEqual(set(graph_edges(self.graph(cluster='WI-1'))),
+                         {('WI-1', 'a'), ('WI-1', 'b'), ('WI-2', 'b')})
+        self.assertEqual(self.client.get('/data/graph/', {'collapse': 'many'}).status_code, 400)
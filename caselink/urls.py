@@ -28,7 +28,9 @@ urlpatterns = [
     url(r'^data/m2a/((?P<pk>[a-zA-Z0-9\-]+)/)?$', views.m2a_data, name='m2a_data'),
     url(r'^data/a2m/$', views.a2m_data, name='a2m_data'),
     url(r'^data/bl/((?P<pk>[a-zA-Z0-9\-]+)/)?', views.bl_data, name='bl_data'),
+    url(r'^data/graph/$', views.graph_data, name='graph_data'),
     url(r'^pattern-matcher/(?P<pattern>[a-zA-Z0-9\-\._]+)$', views.pattern_matcher, name='pattern-matcher'),
+    url(r'^pattern-coverage/(?P<autocase>[a-zA-Z0-9\-\._]+)$', views.pattern_coverage, name='pattern-coverage'),
 
     #RESTful APIs
     url(r'^(manual|workitem)/$', restful.WorkItemList.as_view(), name='workitem'),
@@ -38,6 +40,7 @@ urlpatterns = [
 
     url(r'^(auto|autocase)/$', restful.AutoCaseList.as_view(), name='auto'),
     url(r'^(auto|autocase)/(?P<pk>[a-zA-Z0-9\-\._]+)/$', restful.AutoCaseDetail.as_view(), name='auto_detail'),
+    url(r'^(auto|autocase)/upsert/(?P<framework>[a-zA-Z0-9\-\._]+)/$', restful.AutoCaseUpsert.as_view(), name='auto_upsert'),
 
     url(r'^autocase_failure/$', restful.AutoCaseFailureList.as_view(), name='auto_failure_list'),
     url(r'^autocase_failure/(?P<pk>[a-zA-Z0-9\-\._]+)/$', restful.AutoCaseFailureDetail.as_view(), name='auto_failure_detail'),
@@ -60,6 +63,8 @@ urlpatterns = [
     url(r'^arch/$', restful.ArchList.as_view(), name='arch'),
     url(r'^arch/(?P<pk>[a-zA-Z0-9\-\._]+)/$', restful.ArchDetail.as_view(), name='arch_detail'),
 
+    url(r'^batch/$', restful.Batch.as_view(), name='batch'),
+
     # API for get/start tasks, backup/restore
     url(r'^control/$', control.overview, name='task_overview'),
     url(r'^control/task/$', control.task, name='task_list'),
@@ -0,0 +1,147 @@
+"""
+Evaluate many patterns against many autocase ids at once, for full relinking.
+
+Autocase ids are encoded as a matrix of integer item tokens, every pattern
+is evaluated on the rows containing all of its items with vectorized
+comparisons. numpy is required, without it the slower PatternMatcher is
+used and a warning logged.
+"""
+import logging
+import multiprocessing
+
+from caselink.utils.matcher import PatternMatcher
+
+LOGGER = logging.getLogger(__name__)
+
+NUMPY_INSTALLED = True
+try:
+    import numpy
+except ImportError:
+    NUMPY_INSTALLED = False
+
+
+def match_matrix(case_ids, patterns):
+    """
+    Match every pattern against every autocase id, return the sparse match
+    matrix in coordinate format, as a pair of sequences:
+    (indexes of patterns, indexes of autocase ids).
+    """
+    if not NUMPY_INSTALLED:
+        LOGGER.warning("numpy is not installed, matching %s patterns with PatternMatcher", len(patterns))
+        return _match_matrix_fallback(case_ids, patterns)
+    return _match_matrix_numpy(case_ids, patterns)
+
+
+def parallel_match_matrix(case_ids, patterns, workers=None):
+    """
+    Same as match_matrix, but autocase ids are split into chunks and
+    matched by a pool of worker processes, default to one per CPU.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    chunk_size = max(1000, len(case_ids) // (workers * 4) + 1)
+    offsets = range(0, len(case_ids), chunk_size)
+    # Daemonic processes (eg. celery workers) are not allowed to have children
+    if workers < 2 or len(offsets) < 2 or multiprocessing.current_process().daemon:
+        return match_matrix(case_ids, patterns)
+
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(patterns,))
+    try:
+        results = pool.map(_match_chunk, [case_ids[offset:offset + chunk_size] for offset in offsets])
+    finally:
+        pool.close()
+        pool.join()
+
+    pattern_idx, case_idx = [], []
+    for offset, (chunk_pattern_idx, chunk_case_idx) in zip(offsets, results):
+        pattern_idx.extend(chunk_pattern_idx)
+        case_idx.extend(offset + idx for idx in chunk_case_idx)
+    return pattern_idx, case_idx
+
+
+_worker_patterns = None
+
+
+def _init_worker(patterns):
+    global _worker_patterns
+    _worker_patterns = patterns
+
+
+def _match_chunk(case_ids):
+    return match_matrix(case_ids, _worker_patterns)
+
+
+def _match_matrix_fallback(case_ids, patterns):
+    matcher = PatternMatcher(enumerate(patterns))
+    pattern_idx, case_idx = [], []
+    for idx, case_id in enumerate(case_ids):
+        for matched in matcher.match(case_id):
+            pattern_idx.append(matched)
+            case_idx.append(idx)
+    return pattern_idx, case_idx
+
+
+def _match_matrix_numpy(case_ids, patterns):
+    vocabulary = {}
+    rows = [[vocabulary.setdefault(item, len(vocabulary) + 1) for item in case_id.split('.')]
+            for case_id in case_ids]
+    width = max([len(row) for row in rows] or [0])
+
+    # Token 0 is padding, never equals to any item
+    cases = numpy.zeros((len(rows), width), dtype=numpy.int32)
+    for idx, row in enumerate(rows):
+        cases[idx, :len(row)] = row
+
+    # Inverted index from token to rows containing it
+    lengths = numpy.array([len(row) for row in rows], dtype=numpy.int64)
+    flat_rows = numpy.repeat(numpy.arange(len(rows)), lengths)
+    flat_tokens = cases[cases > 0]
+    order = numpy.lexsort((flat_rows, flat_tokens))
+    flat_rows, flat_tokens = flat_rows[order], flat_tokens[order]
+    bounds = numpy.searchsorted(flat_tokens, numpy.arange(len(vocabulary) + 2))
+    postings = [numpy.unique(flat_rows[bounds[token]:bounds[token + 1]])
+                for token in range(len(vocabulary) + 1)]
+
+    pattern_idx, case_idx = [], []
+    for idx, pattern in enumerate(patterns):
+        segments = [[vocabulary.get(item) for item in segment.split('.')]
+                    for segment in pattern.split('..')]
+        tokens = set(token for segment in segments for token in segment)
+        if None in tokens:
+            continue
+
+        candidates = None
+        for posting in sorted((postings[token] for token in tokens), key=len):
+            candidates = posting if candidates is None else numpy.intersect1d(
+                candidates, posting, assume_unique=True)
+            if not len(candidates):
+                break
+        if not len(candidates):
+            continue
+
+        matched = _match_segments(cases[candidates], segments, width)
+        pattern_idx.append(numpy.full(matched.sum(), idx, dtype=numpy.int64))
+        case_idx.append(candidates[matched])
+
+    if not pattern_idx:
+        return numpy.array([], dtype=numpy.int64), numpy.array([], dtype=numpy.int64)
+    return numpy.concatenate(pattern_idx), numpy.concatenate(case_idx)
+
+
+def _match_segments(cases, segments, width):
+    """
+    Return a boolean array marking rows containing all segments in order,
+    each segment is placed at its leftmost position after the previous one.
+    """
+    matched = numpy.ones(len(cases), dtype=bool)
+    start = numpy.zeros(len(cases), dtype=numpy.int64)
+    for segment in segments:
+        positions = width - len(segment) + 1
+        if positions < 1:
+            return numpy.zeros(len(cases), dtype=bool)
+        found = numpy.ones((len(cases), positions), dtype=bool)
+        for offset, token in enumerate(segment):
+            found &= cases[:, offset:offset + positions] == token
+        found &= numpy.arange(positions)[None, :] >= start[:, None]
+        matched &= found.any(axis=1)
+        start = found.argmax(axis=1) + len(segment)
+    return matched
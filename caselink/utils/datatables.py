@@ -0,0 +1,194 @@
+"""
+Server-side processing for DataTables, filter, order and page a queryset
+with the parameters sent by DataTables, so only the visible page is
+queried and serialized. See https://datatables.net/manual/server-side
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+
+# Longer regex searches are matched as substrings
+MAX_REGEX_LENGTH = 100
+
+
+class _InSQL(RawSQL):
+    """
+    Raw subquery for an __in lookup, which puts it in parentheses itself,
+    SQLite reads "in ((select ...))" as a list of the first selected value.
+    """
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+class ListSearch(object):
+    """
+    Search a list column by its items, in the rows of a query selecting
+    "pk" and "value" of the list, instead of the encoded column. Rows with
+    any item matching are found.
+    """
+
+    def __init__(self, sql):
+        self.sql = sql
+
+    def query(self, value, regex):
+        lookup = 'iregex' if regex else 'icontains'
+        if not regex:
+            value = '%%%s%%' % connection.ops.prep_for_like_query(value)
+        condition = '%s %s' % (connection.ops.lookup_cast(lookup) % 'value',
+                               connection.operators[lookup] % '%s')
+        return Q(pk__in=_InSQL(
+            'select pk from (%s) as list_values where %s' % (self.sql, condition), [value]))
+
+    def values(self):
+        """
+        Return distinct items of the list column.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('select distinct value from (%s) as list_values' % self.sql)
+            return [row[0] for row in cursor.fetchall()]
+
+
+def safe_regex(value):
+    """
+    Whether a regex searched by the database can't take exponential time:
+    it's short and valid, without backreferences, and no repeated group
+    contains a repetition or alternation, like "(a+)+" or "(a|a)*".
+    """
+    if len(value) > MAX_REGEX_LENGTH or re.search(r'\\[1-9]|\(\?P=', value):
+        return False
+    try:
+        re.compile(value)
+    except re.error:
+        return False
+    # Whether each open group repeats or alternates inside
+    groups, idx = [False], 0
+    while idx < len(value):
+        char = value[idx]
+        if char == '\\':
+            idx += 1
+        elif char == '[':
+            # Skip the class, "]" first in it is a item
+            idx += 2 if value[idx + 1] == '^' else 1
+            if value[idx] == ']':
+                idx += 1
+            while value[idx] != ']':
+                idx += 2 if value[idx] == '\\' else 1
+        elif char == '(':
+            groups.append(False)
+        elif char == ')':
+            risky = groups.pop()
+            if risky and value[idx + 1:idx + 2] in ('*', '+', '{'):
+                return False
+            groups[-1] = groups[-1] or risky
+        elif char in '*+{|':
+            groups[-1] = True
+        idx += 1
+    return True
+
+
+def _columns(params):
+    columns, idx = [], 0
+    while 'columns[%d][data]' % idx in params:
+        prefix = 'columns[%d]' % idx
+        columns.append({
+            'data': params.get(prefix + '[data]'),
+            'searchable': params.get(prefix + '[searchable]', 'true') == 'true',
+            'orderable': params.get(prefix + '[orderable]', 'true') == 'true',
+            'search': params.get(prefix + '[search][value]', ''),
+            'regex': params.get(prefix + '[search][regex]', 'false') == 'true',
+        })
+        idx += 1
+    return columns
+
+
+def _search(lookups, value, regex):
+    regex = regex and safe_regex(value)
+    query = Q()
+    for lookup in lookups:
+        if isinstance(lookup, ListSearch):
+            query |= lookup.query(value, regex)
+        else:
+            query |= Q(**{'%s__%s' % (lookup, 'iregex' if regex else 'icontains'): value})
+    return query
+
+
+def column_values(queryset, search_fields, names):
+    """
+    Return a dict of distinct values of each column in 'names', sorted, for
+    filtering the columns by a selector. List columns give their items.
+    Raise ValueError on columns not searchable.
+    """
+    values = {}
+    for name in names:
+        if name not in search_fields:
+            raise ValueError("Invalid column %s" % name)
+        items = set()
+        for lookup in search_fields[name]:
+            if isinstance(lookup, ListSearch):
+                items.update(lookup.values())
+            else:
+                items.update(queryset.order_by().values_list(lookup, flat=True).distinct())
+        values[name] = sorted(item for item in items if item is not None)
+    return values
+
+
+def _joins(search_fields):
+    return any('__' in lookup for lookups in search_fields.values() for lookup in lookups
+               if not isinstance(lookup, ListSearch))
+
+
+def datatables_page(params, queryset, search_fields, order_fields):
+    """
+    Return (draw, total count, filtered count, pks of the requested page).
+
+    'search_fields' maps data name of a column to the lookups searched for it,
+    or ListSearch of its items,
+    'order_fields' maps data name of a column to the field ordered by,
+    columns not in them are not searchable / orderable.
+    Raise ValueError on invalid parameters.
+    """
+    draw = int(params.get('draw', 0))
+    start = int(params.get('start', 0))
+    length = int(params.get('length', -1))
+    columns = _columns(params)
+
+    query = Q()
+    searchable = [column for column in columns
+                  if column['searchable'] and column['data'] in search_fields]
+    # Every word of the global search must match any searchable column
+    regex = params.get('search[regex]', 'false') == 'true'
+    value = params.get('search[value]', '')
+    for term in ([value] if regex else value.split()) if value else []:
+        term_query = Q()
+        for column in searchable:
+            term_query |= _search(search_fields[column['data']], term, regex)
+        query &= term_query
+    for column in searchable:
+        if column['search']:
+            query &= _search(search_fields[column['data']], column['search'], column['regex'])
+
+    filtered = queryset
+    if query and _joins(search_fields):
+        # Filtering on m2m lookups may return duplicated rows
+        filtered = queryset.filter(pk__in=queryset.filter(query).values('pk'))
+    elif query:
+        filtered = queryset.filter(query)
+
+    ordering, idx = [], 0
+    while 'order[%d][column]' % idx in params:
+        column_idx = int(params['order[%d][column]' % idx])
+        if not 0 <= column_idx < len(columns):
+            raise ValueError("Invalid order column %s" % column_idx)
+        column = columns[column_idx]
+        if column['orderable'] and column['data'] in order_fields:
+            direction = '-' if params.get('order[%d][dir]' % idx) == 'desc' else ''
+            ordering.append(direction + order_fields[column['data']])
+        idx += 1
+    filtered = filtered.order_by(*(ordering + ['pk']))
+
+    pks = filtered.values_list('pk', flat=True)
+    pks = list(pks[start:] if length < 0 else pks[start:start + length])
+    return draw, queryset.count(), filtered.count(), pks
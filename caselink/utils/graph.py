@@ -0,0 +1,159 @@
+"""
+Bipartite graph of workitems and autocases linked to them.
+
+Connected components (clusters) are found with a union-find over the
+edges, union by size with path halving, so building the graph of 100k
+edges is near linear. Large clusters can be collapsed into a single
+summary, so a client only draws the parts of the graph it can show.
+"""
+
+
+class UnionFind(object):
+    """
+    Disjoint sets of integers 0..n-1.
+    """
+
+    def __init__(self, size=0):
+        self.parent = list(range(size))
+        self.size = [1] * size
+
+    def add(self):
+        """
+        Add a new single element set, return the element.
+        """
+        self.parent.append(len(self.parent))
+        self.size.append(1)
+        return len(self.parent) - 1
+
+    def find(self, item):
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, item, other):
+        """
+        Merge the sets of two elements, return the root of the merged set.
+        """
+        root, other = self.find(item), self.find(other)
+        if root == other:
+            return root
+        if self.size[root] < self.size[other]:
+            root, other = other, root
+        self.parent[other] = root
+        self.size[root] += self.size[other]
+        return root
+
+
+# Kind of a edge, by whether its workitem / autocase has a single edge
+_KINDS = {
+    (True, True): 's2s',
+    (False, True): 's2m',
+    (True, False): 'm2s',
+    (False, False): 'm2m',
+}
+
+
+class LinkageGraph(object):
+    """
+    Graph of (workitem, autocase) edges, nodes are numbered in the order
+    they are first seen, workitems and autocases separately.
+    """
+
+    def __init__(self, edges=()):
+        self.workitems, self.autocases = [], []
+        self._workitem_idx, self._autocase_idx = {}, {}
+        self.edges = []
+        # Workitems are elements 2 * idx, autocases 2 * idx + 1 of the sets
+        self._sets = UnionFind()
+        for workitem, autocase in edges:
+            self.add_edge(workitem, autocase)
+
+    def _node(self, nodes, index, node, offset):
+        idx = index.get(node)
+        if idx is None:
+            idx = index[node] = len(nodes)
+            nodes.append(node)
+            while len(self._sets.parent) <= 2 * idx + offset:
+                self._sets.add()
+        return idx
+
+    def add_edge(self, workitem, autocase):
+        w_idx = self._node(self.workitems, self._workitem_idx, workitem, 0)
+        a_idx = self._node(self.autocases, self._autocase_idx, autocase, 1)
+        self.edges.append((w_idx, a_idx))
+        self._sets.union(2 * w_idx, 2 * a_idx + 1)
+
+    def clusters(self):
+        """
+        Return cluster of every workitem and every autocase, as two lists
+        of cluster numbers, clusters are numbered by their first workitem.
+        """
+        numbers = {}
+        workitems = [numbers.setdefault(self._sets.find(2 * idx), len(numbers))
+                     for idx in range(len(self.workitems))]
+        autocases = [numbers[self._sets.find(2 * idx + 1)] for idx in range(len(self.autocases))]
+        return workitems, autocases
+
+    def as_dict(self, collapse=None, cluster=None):
+        """
+        Return the graph as a JSON serializable dict.
+
+        Clusters with more than 'collapse' nodes only appear in 'clusters'
+        with 'collapsed' set, their nodes and edges are left out. Given
+        'cluster' (id of a cluster, the smallest workitem id in it), only
+        nodes and edges of that cluster are included.
+        """
+        w_clusters, a_clusters = self.clusters()
+        w_degree, a_degree = [0] * len(self.workitems), [0] * len(self.autocases)
+        for w_idx, a_idx in self.edges:
+            w_degree[w_idx] += 1
+            a_degree[a_idx] += 1
+
+        clusters = []
+        for w_idx, number in enumerate(w_clusters):
+            if number == len(clusters):
+                clusters.append({'id': self.workitems[w_idx], 'workitems': 0, 'autocases': 0, 'edges': 0})
+            summary = clusters[number]
+            summary['workitems'] += 1
+            summary['id'] = min(summary['id'], self.workitems[w_idx])
+        for number in a_clusters:
+            clusters[number]['autocases'] += 1
+        for w_idx, _ in self.edges:
+            clusters[w_clusters[w_idx]]['edges'] += 1
+
+        shown = []
+        for summary in clusters:
+            size = summary['workitems'] + summary['autocases']
+            if cluster is not None:
+                summary['collapsed'] = summary['id'] != cluster
+            else:
+                summary['collapsed'] = collapse is not None and size > collapse
+            shown.append(not summary['collapsed'])
+
+        # Shown nodes are renumbered, edges refer to them by position
+        w_pos, a_pos = {}, {}
+        workitems, autocases, edges = [], [], []
+        for w_idx, workitem in enumerate(self.workitems):
+            if shown[w_clusters[w_idx]]:
+                w_pos[w_idx] = len(workitems)
+                workitems.append({'id': workitem, 'degree': w_degree[w_idx],
+                                  'cluster': clusters[w_clusters[w_idx]]['id']})
+        for a_idx, autocase in enumerate(self.autocases):
+            if shown[a_clusters[a_idx]]:
+                a_pos[a_idx] = len(autocases)
+                autocases.append({'id': autocase, 'degree': a_degree[a_idx],
+                                  'cluster': clusters[a_clusters[a_idx]]['id']})
+        for w_idx, a_idx in self.edges:
+            if w_idx in w_pos:
+                edges.append([w_pos[w_idx], a_pos[a_idx],
+                              _KINDS[(w_degree[w_idx] == 1, a_degree[a_idx] == 1)]])
+
+        return {
+            'workitems': workitems,
+            'autocases': autocases,
+            'edges': edges,
+            'clusters': sorted(clusters, key=lambda summary: (
+                -(summary['workitems'] + summary['autocases']), summary['id'])),
+        }
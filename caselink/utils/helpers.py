@@ -1,3 +1,6 @@
+import hashlib
+
+
 def is_pattern_match(pattern, casename):
     """
     Test if a autocase match with the name pattern.
@@ -18,3 +21,37 @@ def is_pattern_match(pattern, casename):
         except ValueError:
             return False
     return True
+
+
+def pattern_segments(pattern):
+    """
+    Return the set of dot-separated items in a pattern,
+    a autocase can only match the pattern if its id contains all of them.
+    """
+    items = set()
+    for segment in pattern.split('..'):
+        items.update(segment.split('.'))
+    return items
+
+
+def chunked(iterable, size):
+    """
+    Split a iterable into lists of given size, for keeping the number of
+    SQL variables in a query under the database limit.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def normalized_hash(text):
+    """
+    Hash of a text with surrounding and repeated whitespaces ignored,
+    texts only differ in whitespaces are considered duplicated.
+    """
+    return hashlib.sha1(' '.join((text or '').split()).encode('utf-8')).hexdigest()
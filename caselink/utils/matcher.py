@@ -0,0 +1,115 @@
+"""
+Match a autocase id against many patterns in one pass.
+
+Patterns are compiled into a trie of their dot-separated items, '..' in a
+pattern becomes a gap node which can skip any number of items, so the trie
+is walked like a NFA with every item of the autocase id only read once.
+Result is the same as testing each pattern with is_pattern_match.
+"""
+
+_GAP = None
+
+
+class _Node(object):
+    __slots__ = ('children', 'gap', 'keys')
+
+    def __init__(self, gap=False):
+        self.children = {}
+        self.gap = gap
+        self.keys = set()
+
+
+def _tokenize(pattern):
+    tokens = []
+    for segment in pattern.split('..'):
+        if tokens:
+            tokens.append(_GAP)
+        tokens.extend(segment.split('.'))
+    return tokens
+
+
+class PatternMatcher(object):
+    """
+    A trie of patterns, each pattern is stored with a hashable key,
+    matching a autocase id returns keys of all patterns it matches.
+    """
+
+    def __init__(self, patterns=None):
+        self._root = _Node(gap=True)
+        self._patterns = {}
+        for key, pattern in patterns or []:
+            self.add(key, pattern)
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def __contains__(self, key):
+        return key in self._patterns
+
+    def add(self, key, pattern):
+        """
+        Add or replace the pattern of a key.
+        """
+        if key in self._patterns:
+            if self._patterns[key] == pattern:
+                return
+            self.remove(key)
+        node = self._root
+        for token in _tokenize(pattern):
+            child = node.children.get(token)
+            if child is None:
+                child = node.children[token] = _Node(gap=token is _GAP)
+            node = child
+        node.keys.add(key)
+        self._patterns[key] = pattern
+
+    def remove(self, key):
+        """
+        Remove the pattern of a key, branches left empty are pruned.
+        """
+        pattern = self._patterns.pop(key, None)
+        if pattern is None:
+            return
+        tokens = _tokenize(pattern)
+        path = [self._root]
+        for token in tokens:
+            path.append(path[-1].children[token])
+        path[-1].keys.discard(key)
+        for depth in range(len(tokens), 0, -1):
+            if path[depth].keys or path[depth].children:
+                break
+            del path[depth - 1].children[tokens[depth - 1]]
+
+    def match(self, casename):
+        """
+        Return keys of all patterns matching the autocase id.
+        """
+        matched = set()
+        active = self._expand([self._root], matched)
+        for item in casename.split('.'):
+            reached = []
+            for node in active:
+                if node.gap:
+                    reached.append(node)
+                child = node.children.get(item)
+                if child is not None:
+                    reached.append(child)
+            if not reached:
+                break
+            active = self._expand(reached, matched)
+        return matched
+
+    @staticmethod
+    def _expand(nodes, matched):
+        """
+        Follow the gap edges, collect keys of reached pattern ends,
+        and remove duplicated nodes.
+        """
+        expanded, seen = [], set()
+        for node in nodes:
+            while node is not None and id(node) not in seen:
+                seen.add(id(node))
+                expanded.append(node)
+                matched.update(node.keys)
+                node = node.children.get(_GAP)
+        return expanded
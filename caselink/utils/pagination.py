@@ -0,0 +1,64 @@
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(LimitOffsetPagination):
+    """
+    Paginate in order of primary key with ?after=<pk>&limit=<n>, an empty
+    'after' starts from the first key.
+
+    A page starts after the last key of the previous page, looked up with
+    the primary key index instead of scanning and skipping 'offset' rows,
+    so walking a large table costs the same for every page. The 'next'
+    link carries the last key of the page, there is no 'count'.
+
+    Requests without 'after' are paginated by limit and offset as before.
+    Pages of values() rows need the 'pk' in the values.
+    """
+    after_query_param = 'after'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.after_query_param in request.query_params
+        if not self.keyset:
+            return super(KeysetPagination, self).paginate_queryset(queryset, request, view)
+
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.request = request
+
+        queryset = queryset.order_by('pk')
+        after = request.query_params[self.after_query_param]
+        if after:
+            try:
+                queryset = queryset.filter(pk__gt=after)
+            except (ValueError, TypeError, DjangoValidationError):
+                raise ValidationError({self.after_query_param: ["Invalid key."]})
+
+        results = list(queryset[:self.limit + 1])
+        self.page = results[:self.limit]
+        self.has_next = len(results) > self.limit
+        return self.page
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super(KeysetPagination, self).get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super(KeysetPagination, self).get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        last = self.page[-1]
+        return replace_query_param(url, self.after_query_param,
+                                   last['pk'] if isinstance(last, dict) else last.pk)
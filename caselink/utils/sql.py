@@ -0,0 +1,178 @@
+"""
+Helpers for building records from raw SQL queries, and writing rows in bulk.
+"""
+from django.db import connection
+
+from caselink.utils.helpers import chunked
+
+
+# Separators of values in lists aggregated by SQLite, and of fields in a value
+LIST_SEPARATOR = '\x1f'
+FIELD_SEPARATOR = '\x1e'
+
+# Most variables in a query, the limit of older SQLite
+MAX_PARAMS = 999
+
+
+def pk_filter(sql, column, pks=None):
+    """
+    Fill the '%s' placeholder in sql with a condition limiting column to pks,
+    return the sql and params.
+    """
+    if pks is None:
+        return sql % "", []
+    return sql % ("and %s in (%s)" % (column, ', '.join(['%s'] * len(pks)))), list(pks)
+
+
+def iter_rows(sql, params=None, size=1000):
+    """
+    Yield rows of a query as dict, fetched in chunks, with a server side
+    cursor if the database supports it.
+    """
+    cursor = connection.chunked_cursor()
+    try:
+        cursor.execute(sql, params or [])
+        columns = None
+        while True:
+            rows = cursor.fetchmany(size)
+            if not rows:
+                break
+            # Server side cursors only have description after fetching
+            columns = columns or [col[0] for col in cursor.description]
+            for row in rows:
+                yield dict(zip(columns, row))
+    finally:
+        cursor.close()
+
+
+def insert_rows(table, columns, rows):
+    """
+    Insert rows, sequences of values of columns, with multi-row inserts.
+    Unlike bulk_create no model instance is built nor SQL compiled for each
+    row, values are passed to the database as they are, no signals are sent.
+    """
+    quote = connection.ops.quote_name
+    sql = "insert into %s (%s) values " % (quote(table), ', '.join(quote(column) for column in columns))
+    row_sql = "(%s)" % ', '.join(['%s'] * len(columns))
+    with connection.cursor() as cursor:
+        for chunk in chunked(rows, max(1, MAX_PARAMS // len(columns))):
+            cursor.execute(sql + ', '.join([row_sql] * len(chunk)), [value for row in chunk for value in row])
+
+
+def merge_rows(pk, records, joined_rows, keys=[]):
+    """
+    Extend records with unique pk using rows with duplicated pk, for handling m2m in raw sql,
+    both should be ordered by pk, yield extended records one by one.
+    All attrs will be extended should be list.
+    """
+    joined_rows = iter(joined_rows)
+    entry = next(joined_rows, None)
+    for record in records:
+        while entry is not None and entry[pk] == record[pk]:
+            for key in keys:
+                record.get(key).append(entry[key])
+            entry = next(joined_rows, None)
+        yield record
+
+
+def concat_fields(*exprs):
+    """
+    Return a SQL expression joining exprs with FIELD_SEPARATOR.
+    """
+    separator = 'char(30)' if connection.vendor == 'sqlite' else 'chr(30)'
+    return (' || %s || ' % separator).join(exprs)
+
+
+def _list_aggregate():
+    """
+    Return the aggregate expression collecting 'value' into a list, None if
+    the database has none.
+    """
+    if connection.vendor == 'postgresql':
+        return 'array_agg(value order by value)'
+    if connection.vendor == 'sqlite':
+        return 'group_concat(value, char(31))'
+    return None
+
+
+def _decode_list(value):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return value.split(LIST_SEPARATOR)
+
+
+def _list_sql(sql, pks):
+    return pk_filter("""
+    select distinct pk, value from (%s) as list_values
+    where value is not null %%s
+    order by pk, value
+    """ % sql, "pk", pks)
+
+
+def aggregated_rows(sql, pk, column, lists, pks=None):
+    """
+    Yield rows of a query as dict, with list columns aggregated by the
+    database, in one query.
+
+    'sql' selects the columns of rows ordered by 'pk', its '%s' placeholder
+    is filled with the condition limiting 'column' to pks. 'lists' is a
+    sequence of (name, sql), the sql selects "pk" and "value" of a list,
+    distinct not null values of it are the list column 'name', sorted.
+
+    Databases without a list aggregate take a query per list instead.
+
+    Every list binds the pks again, so given pks are queried in chunks
+    keeping the variables of a query under MAX_PARAMS.
+    """
+    if pks is None:
+        return _aggregated_rows(sql, pk, column, lists, None)
+    size = max(1, MAX_PARAMS // (1 + len(lists)))
+    return (row for chunk in chunked(sorted(pks), size)
+            for row in _aggregated_rows(sql, pk, column, lists, chunk))
+
+
+def _aggregated_rows(sql, pk, column, lists, pks):
+    sql, params = pk_filter(sql, column, pks)
+    aggregate = _list_aggregate()
+    if aggregate is None:
+        return _merged_rows(sql, params, pk, lists, pks)
+
+    columns, joins = ['base_rows.*'], []
+    for name, list_sql in lists:
+        list_sql, list_params = _list_sql(list_sql, pks)
+        columns.append('list_%s.value AS "%s"' % (name, name))
+        joins.append("""
+        left join (
+        select pk, %s AS value from (%s) as list_values group by pk
+        ) as list_%s on list_%s.pk = base_rows."%s"
+        """ % (aggregate, list_sql, name, name, pk))
+        params += list_params
+    sql = 'select %s from (%s) as base_rows %s order by base_rows."%s"' % (
+        ', '.join(columns), sql, ''.join(joins), pk)
+    return _decoded_rows(iter_rows(sql, params), [name for name, _ in lists])
+
+
+def _decoded_rows(rows, names):
+    for row in rows:
+        for name in names:
+            row[name] = _decode_list(row[name])
+        yield row
+
+
+def _merged_rows(sql, params, pk, lists, pks):
+    records = _with_lists(iter_rows(sql, params), [name for name, _ in lists])
+    for name, list_sql in lists:
+        list_sql, list_params = _list_sql(list_sql, pks)
+        list_sql = 'select pk AS "%s", value AS "%s" from (%s) as list_values order by 1, 2' % (
+            pk, name, list_sql)
+        records = merge_rows(pk, records, iter_rows(list_sql, list_params), [name])
+    return records
+
+
+def _with_lists(rows, names):
+    for row in rows:
+        for name in names:
+            row[name] = []
+        yield row
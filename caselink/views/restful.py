@@ -1,105 +1,343 @@
 import logging
+from calendar import timegm
 from rest_framework import filters
-from django.http import Http404
+from django.db import transaction
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags
 
 from rest_framework import generics, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
 from caselink.models import (
     WorkItem, AutoCase, Linkage, Bug, Arch, BlackListEntry, AutoCaseFailure,
-    Framework, Component)
+    Framework, Component, bulk_mode, upsert_autocases)
 from caselink.serializers import (
     WorkItemSerializer, AutoCaseSerializer, LinkageSerializer,
     BugSerializer, ArchSerializer, BlackListEntrySerializer,
     AutoCaseFailureSerializer, WorkItemLinkageSerializer,
-    FrameworkSerializer, ComponentSerializer)
+    FrameworkSerializer, ComponentSerializer, ValuesSerializer,
+    requested_fields, requested_embeds)
 from caselink.utils.jira import Jira
+from caselink.utils.pagination import KeysetPagination
 
 
 LOGGER = logging.getLogger(__name__)
 
+# Related objects serialized with each object, prefetched so a page costs a
+# fixed number of queries. Foreign keys are serialized as pk, no join needed.
+WORKITEM_RELATED = ('archs', 'documents', 'errors', 'linkages', 'blacklist_entries')
+AUTOCASE_RELATED = ('archs', 'components', 'errors', 'linkages', 'autocase_failures')
+LINKAGE_RELATED = ('autocases', 'errors')
+AUTOCASE_FAILURE_RELATED = ('autocases', 'errors', 'blacklist_entries')
+BLACKLIST_ENTRY_RELATED = ('bugs', 'workitems', 'autocase_failures', 'errors')
+# Related objects of fields which can be embedded with ?embed=
+EMBEDDED_RELATED = {
+    'linkages': tuple('linkages__' + lookup for lookup in LINKAGE_RELATED),
+}
+
+# Most objects to get with ?ids= at once
+MAX_IDS = 500
+
+
+class PrefetchFieldsMixin(object):
+    """
+    Only prefetch related objects of fields requested with ?fields=.
+    """
+    # Prefetched lookups, named as the fields they are serialized as
+    related = ()
+    # Other fields serialized from a prefetched lookup
+    related_fields = {}
+
+    def get_queryset(self):
+        queryset = super(PrefetchFieldsMixin, self).get_queryset()
+        fields = requested_fields(self.request)
+        if fields is None:
+            lookups = list(self.related)
+        else:
+            fields |= set(self.related_fields[name] for name in fields if name in self.related_fields)
+            lookups = [lookup for lookup in self.related if lookup in fields]
+        for name in requested_embeds(self.request):
+            if name in lookups:
+                lookups.extend(EMBEDDED_RELATED.get(name, ()))
+        return queryset.prefetch_related(*lookups)
+
+
+class MultiGetMixin(object):
+    """
+    Get the objects with primary keys given as ?ids=a,b,c, all of them in
+    one unpaginated list, in a fixed number of queries.
+    """
+    def get_ids(self):
+        if 'ids' not in self.request.query_params:
+            return None
+        ids = set(pk.strip() for pk in self.request.query_params['ids'].split(',') if pk.strip())
+        if len(ids) > MAX_IDS:
+            raise ValidationError({'ids': ["At most %s ids are allowed." % MAX_IDS]})
+        return ids
+
+    def get_queryset(self):
+        queryset = super(MultiGetMixin, self).get_queryset()
+        ids = self.get_ids()
+        if ids is not None:
+            queryset = queryset.filter(pk__in=ids).order_by('pk')
+        return queryset
+
+    def paginate_queryset(self, queryset):
+        if self.get_ids() is not None:
+            return None
+        return super(MultiGetMixin, self).paginate_queryset(queryset)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSON selected with ?format=fast, for lists serialized from values.
+    """
+    format = 'fast'
+
+
+class FastListMixin(object):
+    """
+    List objects requested with ?format=fast from values() with a
+    ValuesSerializer, in the same JSON as the serializer of the view.
+    Requests it can't serve, eg. with ?embed=, are serialized as usual.
+    """
+    renderer_classes = tuple(api_settings.DEFAULT_RENDERER_CLASSES) + (FastJSONRenderer,)
+
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format != FastJSONRenderer.format:
+            return super(FastListMixin, self).list(request, *args, **kwargs)
+        serializer = ValuesSerializer(self.get_serializer())
+        if not serializer.supported:
+            return super(FastListMixin, self).list(request, *args, **kwargs)
+
+        queryset = serializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation(page))
+        return Response(serializer.to_representation(queryset))
+
+
+class AtomicWriteMixin(object):
+    """
+    Write an object and its relations in one transaction, so the data
+    version is bumped and listing rows are refreshed once, on commit.
+    """
+
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            super(AtomicWriteMixin, self).perform_create(serializer)
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            super(AtomicWriteMixin, self).perform_update(serializer)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            super(AtomicWriteMixin, self).perform_destroy(instance)
+
+
+class ConditionalMixin(object):
+    """
+    Validate requests of a object with ETag of its row version and
+    Last-Modified of its modified time, before loading or serializing it.
+    A matching If-None-Match or If-Modified-Since is answered with 304, a
+    write with a stale If-Match fails with 412. A write with If-Match claims
+    the object with a conditional update in its transaction, so concurrent
+    writes of the same version can't both pass.
+    """
+
+    # Field of another last modified time of the object, eg. synced from elsewhere
+    modified_field = None
+
+    def get_validators(self):
+        """
+        Return (ETag, Last-Modified timestamp) of the object, or None if it doesn't exist.
+        """
+        fields = ('version', 'modified') + ((self.modified_field,) if self.modified_field else ())
+        try:
+            row = self.queryset.model.objects.filter(pk=self.kwargs['pk']).values_list(*fields).first()
+        except (ValueError, TypeError):
+            return None
+        if row is None:
+            return None
+        stamps = [stamp for stamp in row[1:] if stamp]
+        return '"%s"' % row[0], timegm(max(stamps).utctimetuple()) if stamps else None
+
+    def claim_version(self, request):
+        """
+        Take the object off a version given in If-Match, in the transaction
+        of the write, it's stamped with the new data version on commit.
+        Return False if it isn't at the version, eg. a concurrent write of
+        the same version claimed it first.
+        """
+        etags = parse_etags(request.META['HTTP_IF_MATCH'])
+        if etags == ['*']:
+            return True
+        versions = [etag.strip('"') for etag in etags if not etag.startswith('W/')]
+        versions = [int(version) for version in versions if version.isdigit()]
+        # Until stamped, the object matches no ETag
+        return bool(versions) and self.queryset.model.objects.filter(
+            pk=self.kwargs['pk'], version__in=versions).update(version=-1) > 0
+
+    def _conditional(self, handler, request, *args, **kwargs):
+        if request.method == 'GET' or 'HTTP_IF_MATCH' not in request.META:
+            validators, response = self._validated(handler, request, *args, **kwargs)
+        else:
+            # Checked and written in one transaction, so of concurrent
+            # writes of the same version only the first claims the object
+            with transaction.atomic():
+                validators, response = self._validated(handler, request, *args, **kwargs)
+                if response.status_code >= 300:
+                    transaction.set_rollback(True)
+        if request.method != 'DELETE' and 200 <= response.status_code < 300:
+            # Writes are stamped on commit, the object is at a new version
+            validators = validators if request.method == 'GET' else self.get_validators()
+            if validators is not None:
+                etag, last_modified = validators
+                response['ETag'] = etag
+                if last_modified is not None:
+                    response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def _validated(self, handler, request, *args, **kwargs):
+        validators = self.get_validators()
+        if validators is not None:
+            response = get_conditional_response(request, *validators)
+            if response is None and request.method != 'GET' and 'HTTP_IF_MATCH' in request.META:
+                if not self.claim_version(request):
+                    response = HttpResponse(status=412)
+            if response is not None:
+                return validators, response
+        return validators, handler(request, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        return self._conditional(super(ConditionalMixin, self).get, request, *args, **kwargs)
+
+    def put(self, request, *args, **kwargs):
+        return self._conditional(super(ConditionalMixin, self).put, request, *args, **kwargs)
+
+    def patch(self, request, *args, **kwargs):
+        return self._conditional(super(ConditionalMixin, self).patch, request, *args, **kwargs)
+
+    def delete(self, request, *args, **kwargs):
+        return self._conditional(super(ConditionalMixin, self).delete, request, *args, **kwargs)
+
 
 # Standard RESTful APIs
-class WorkItemList(generics.ListCreateAPIView):
+class WorkItemList(AtomicWriteMixin, FastListMixin, MultiGetMixin, PrefetchFieldsMixin,
+                   generics.ListCreateAPIView):
     queryset = WorkItem.objects.all()
+    pagination_class = KeysetPagination
+    related = WORKITEM_RELATED
+    related_fields = {'patterns': 'linkages'}
     serializer_class = WorkItemSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filter_fields = ('title', 'linkages', 'type', 'automation', 'project', 'archs', 'errors')
 
 
-class WorkItemDetail(generics.RetrieveUpdateDestroyAPIView):
+class WorkItemDetail(AtomicWriteMixin, ConditionalMixin, PrefetchFieldsMixin,
+                     generics.RetrieveUpdateDestroyAPIView):
     queryset = WorkItem.objects.all()
+    related = WORKITEM_RELATED
+    related_fields = {'patterns': 'linkages'}
+    modified_field = 'updated'
     serializer_class = WorkItemSerializer
 
     def perform_update(self, serializer):
-        instance = serializer.save()
-        instance.save()
-        if instance.changes and instance.jira_id:
-            try:
-                if Jira().add_jira_comment(instance.jira_id, instance.changes):
-                    instance.changes = None
-                    instance.save()
-            except Exception:
-                LOGGER.error("Failed to add comment for WI %s, Jira task %s",
-                             instance.id, instance.jira_id)
+        with transaction.atomic():
+            instance = serializer.save()
+            instance.save()
+        _comment_on_jira(instance)
+
+
+def _comment_on_jira(instance):
+    """
+    Add pending changes of a workitem as a comment of its Jira task.
+    """
+    if instance.changes and instance.jira_id:
+        try:
+            if Jira().add_jira_comment(instance.jira_id, instance.changes):
+                instance.changes = None
+                instance.save()
+        except Exception:
+            LOGGER.error("Failed to add comment for WI %s, Jira task %s",
+                         instance.id, instance.jira_id)
 
 
-class AutoCaseList(generics.ListCreateAPIView):
+class AutoCaseList(AtomicWriteMixin, FastListMixin, MultiGetMixin, PrefetchFieldsMixin,
+                   generics.ListCreateAPIView):
     queryset = AutoCase.objects.all()
+    pagination_class = KeysetPagination
+    related = AUTOCASE_RELATED
     serializer_class = AutoCaseSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filter_fields = ('linkages', 'autocase_failures', 'framework', 'errors', 'pr')
 
 
-class AutoCaseDetail(generics.RetrieveUpdateDestroyAPIView):
+class AutoCaseDetail(AtomicWriteMixin, ConditionalMixin, PrefetchFieldsMixin,
+                     generics.RetrieveUpdateDestroyAPIView):
     queryset = AutoCase.objects.all()
+    related = AUTOCASE_RELATED
     serializer_class = AutoCaseSerializer
 
 
-class LinkageList(generics.ListCreateAPIView):
+class LinkageList(AtomicWriteMixin, PrefetchFieldsMixin, generics.ListCreateAPIView):
     queryset = Linkage.objects.all()
+    pagination_class = KeysetPagination
+    related = LINKAGE_RELATED
     serializer_class = LinkageSerializer
     filter_backends = (filters.DjangoFilterBackend,)
 
 
-class LinkageDetail(generics.RetrieveUpdateDestroyAPIView):
+class LinkageDetail(AtomicWriteMixin, ConditionalMixin, PrefetchFieldsMixin,
+                    generics.RetrieveUpdateDestroyAPIView):
     queryset = Linkage.objects.all()
+    related = LINKAGE_RELATED
     serializer_class = LinkageSerializer
 
 
-class AutoCaseFailureList(generics.ListCreateAPIView):
+class AutoCaseFailureList(AtomicWriteMixin, PrefetchFieldsMixin, generics.ListCreateAPIView):
     queryset = AutoCaseFailure.objects.all()
+    related = AUTOCASE_FAILURE_RELATED
     serializer_class = AutoCaseFailureSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filter_fields = ('autocases', 'failure_regex', 'autocase_pattern', 'errors')
 
 
-class AutoCaseFailureDetail(generics.RetrieveUpdateDestroyAPIView):
+class AutoCaseFailureDetail(AtomicWriteMixin, PrefetchFieldsMixin,
+                            generics.RetrieveUpdateDestroyAPIView):
     queryset = AutoCaseFailure.objects.all()
+    related = AUTOCASE_FAILURE_RELATED
     serializer_class = AutoCaseFailureSerializer
 
 
-class BugList(generics.ListCreateAPIView):
+class BugList(AtomicWriteMixin, generics.ListCreateAPIView):
     queryset = Bug.objects.all()
     serializer_class = BugSerializer
     filter_backends = (filters.DjangoFilterBackend,)
 
 
-class BugDetail(generics.RetrieveUpdateDestroyAPIView):
+class BugDetail(AtomicWriteMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Bug.objects.all()
     serializer_class = BugSerializer
 
 
-class BlackList(generics.ListCreateAPIView):
+class BlackList(AtomicWriteMixin, PrefetchFieldsMixin, generics.ListCreateAPIView):
     queryset = BlackListEntry.objects.all()
+    related = BLACKLIST_ENTRY_RELATED
     serializer_class = BlackListEntrySerializer
     filter_backends = (filters.DjangoFilterBackend,)
 
 
-class BlackListDetail(generics.RetrieveUpdateDestroyAPIView):
+class BlackListDetail(AtomicWriteMixin, PrefetchFieldsMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = BlackListEntry.objects.all()
+    related = BLACKLIST_ENTRY_RELATED
     serializer_class = BlackListEntrySerializer
 
 
@@ -116,7 +354,7 @@ class WorkItemLinkageList(APIView):
     def get_objects(self, workitem):
         wi = get_object_or_404(WorkItem, id=workitem)
         try:
-            return Linkage.objects.filter(workitem=wi)
+            return Linkage.objects.filter(workitem=wi).prefetch_related(*LINKAGE_RELATED)
         except Linkage.DoesNotExist:
             raise Http404
 
@@ -129,7 +367,8 @@ class WorkItemLinkageList(APIView):
         request.data['workitem'] = workitem
         serializer = LinkageSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -158,7 +397,8 @@ class WorkItemLinkageDetail(APIView):
         caselink = self.get_object(workitem, pattern)
         serializer = LinkageSerializer(caselink, data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -168,6 +408,35 @@ class WorkItemLinkageDetail(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class AutoCaseUpsert(APIView):
+    """
+    Replace the autocase list of a framework with a newline-delimited list
+    of autocase ids in the request body, read as a stream. Autocases not
+    listed are flagged as deleted, new ones are relinked and checked in one
+    batch. Respond with numbers of autocases added, removed and unchanged,
+    and ids skipped as they belong to other frameworks.
+    """
+
+    def post(self, request, framework, format=None):
+        framework = get_object_or_404(Framework, name=framework)
+        stream = request.stream
+        case_ids = set()
+        try:
+            for line in stream if stream is not None else []:
+                case_id = line.decode('utf-8').strip()
+                if case_id:
+                    case_ids.add(case_id)
+        except UnicodeDecodeError:
+            return Response({'detail': "Autocase ids are not UTF-8 encoded."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not case_ids:
+            # Most likely a broken upload, don't flag everything as deleted
+            return Response({'detail': "No autocase ids given."}, status=status.HTTP_400_BAD_REQUEST)
+        summary = upsert_autocases(framework, case_ids)
+        summary['framework'] = framework.name
+        return Response(summary)
+
+
 class AutoLinkageageList(APIView):
     """
     Retrieve, update or delete a caselink instance of a autocase.
@@ -179,7 +448,7 @@ class AutoLinkageageList(APIView):
     def get_objects(self, autocase):
         case = get_object_or_404(AutoCase, id=autocase)
         try:
-            return case.linkages.all()
+            return case.linkages.prefetch_related(*LINKAGE_RELATED)
         except Linkage.DoesNotExist:
             raise Http404
 
@@ -189,35 +458,118 @@ class AutoLinkageageList(APIView):
         return Response(serializer.data for serializer in serializers)
 
 
+# Models writable with the batch API
+BATCH_MODELS = {
+    'linkage': (Linkage, LinkageSerializer),
+    'workitem': (WorkItem, WorkItemSerializer),
+}
+
+
+class _BatchFailed(Exception):
+    def __init__(self, status, errors):
+        super(_BatchFailed, self).__init__(errors)
+        self.status = status
+        self.errors = errors
+
+
+class Batch(APIView):
+    """
+    Apply create, update and delete operations of linkages and workitems
+    in one transaction, autolink and error check once for all of them.
+
+    Request is {"operations": [{"op": "create" | "update" | "delete",
+    "model": "linkage" | "workitem", "id": <pk to update or delete>,
+    "data": {<fields to create or update>}}, ...]}, updates are partial.
+    Respond with {"committed": <bool>, "results": [{"status": <HTTP status>,
+    "data": <object> | "errors": <errors>}, ...]} in order of operations,
+    nothing is committed if any operation fails.
+    """
+
+    def post(self, request, format=None):
+        operations = request.data.get('operations') if isinstance(request.data, dict) else None
+        if not isinstance(operations, list):
+            return Response({'operations': ["A list of operations is required."]},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        applied = []
+        try:
+            with transaction.atomic():
+                with bulk_mode():
+                    for operation in operations:
+                        applied.append(self._apply(operation))
+                # Represented after autolink and error check of the block
+                results = [{'status': status_, 'data': serializer.data} if serializer else {'status': status_}
+                           for status_, serializer in applied]
+        except _BatchFailed as failed:
+            results = [{'status': status.HTTP_424_FAILED_DEPENDENCY, 'errors': ["Batch not committed."]}
+                       for _ in operations]
+            results[len(applied)] = {'status': failed.status, 'errors': failed.errors}
+            return Response({'committed': False, 'results': results}, status=status.HTTP_400_BAD_REQUEST)
+
+        for _, serializer in applied:
+            if serializer and isinstance(serializer.instance, WorkItem):
+                _comment_on_jira(serializer.instance)
+        return Response({'committed': True, 'results': results})
+
+    def _apply(self, operation):
+        """
+        Apply a operation, return (status, serializer or None if deleted).
+        """
+        if not isinstance(operation, dict):
+            raise _BatchFailed(status.HTTP_400_BAD_REQUEST, ["Invalid operation."])
+        op = operation.get('op')
+        if op not in ('create', 'update', 'delete') or operation.get('model') not in BATCH_MODELS:
+            raise _BatchFailed(status.HTTP_400_BAD_REQUEST, ["Invalid op or model."])
+        model, serializer_class = BATCH_MODELS[operation['model']]
+        data = operation.get('data') or {}
+
+        if op == 'create':
+            serializer = serializer_class(data=data)
+        else:
+            try:
+                instance = model.objects.get(pk=operation.get('id'))
+            except (model.DoesNotExist, ValueError, TypeError):
+                raise _BatchFailed(status.HTTP_404_NOT_FOUND, ["Not found."])
+            if op == 'delete':
+                instance.delete()
+                return status.HTTP_204_NO_CONTENT, None
+            serializer = serializer_class(instance, data=data, partial=True)
+
+        if not serializer.is_valid():
+            raise _BatchFailed(status.HTTP_400_BAD_REQUEST, serializer.errors)
+        serializer.save()
+        return (status.HTTP_201_CREATED if op == 'create' else status.HTTP_200_OK), serializer
+
+
 # RESTful APIs for meta class
-class FrameworkList(generics.ListCreateAPIView):
+class FrameworkList(AtomicWriteMixin, generics.ListCreateAPIView):
     queryset = Framework.objects.all()
     serializer_class = FrameworkSerializer
     filter_backends = (filters.DjangoFilterBackend,)
 
 
-class FrameworkDetail(generics.RetrieveUpdateDestroyAPIView):
+class FrameworkDetail(AtomicWriteMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Framework.objects.all()
     serializer_class = FrameworkSerializer
 
 
-class ComponentList(generics.ListCreateAPIView):
+class ComponentList(AtomicWriteMixin, generics.ListCreateAPIView):
     queryset = Component.objects.all()
     serializer_class = ComponentSerializer
     filter_backends = (filters.DjangoFilterBackend,)
 
 
-class ComponentDetail(generics.RetrieveUpdateDestroyAPIView):
+class ComponentDetail(AtomicWriteMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Component.objects.all()
     serializer_class = ComponentSerializer
 
 
-class ArchList(generics.ListCreateAPIView):
+class ArchList(AtomicWriteMixin, generics.ListCreateAPIView):
     queryset = Arch.objects.all()
     serializer_class = ArchSerializer
     filter_backends = (filters.DjangoFilterBackend,)
 
 
-class ArchDetail(generics.RetrieveUpdateDestroyAPIView):
+class ArchDetail(AtomicWriteMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Arch.objects.all()
     serializer_class = ArchSerializer
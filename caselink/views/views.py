@@ -1,10 +1,89 @@
-from django.http import JsonResponse
+import re
+import json
+import zlib
+import hashlib
+from collections import Counter
+
+from django.http import (
+    JsonResponse, HttpResponse, HttpResponseBadRequest, HttpResponseNotModified, StreamingHttpResponse)
+from django.core.cache import cache
 from django.shortcuts import render
-from django.db import connection
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.http import urlencode
 
 from caselink.form import MaitaiAutomationRequest
-from caselink.models import AutoCase
-from caselink.utils.helpers import is_pattern_match
+from caselink.models import (
+    AutoCase, AutoCaseSegment, Linkage, BlackListEntry, WorkItemListing, AutoCaseListing,
+    match_autocase, current_data_version, listing_changes)
+from caselink.utils.helpers import is_pattern_match, chunked
+from caselink.utils.sql import aggregated_rows, concat_fields, FIELD_SEPARATOR
+from caselink.models.listing import WORKITEM_LISTS, AUTOCASE_LISTS
+from caselink.utils.datatables import datatables_page, column_values, ListSearch
+from caselink.utils.graph import LinkageGraph
+
+
+# Cached payloads are replaced by ones of newer data version, expire the rest
+DATA_CACHE_TIMEOUT = 24 * 60 * 60
+
+_accepts_gzip = re.compile(r'\bgzip\b')
+
+_WORKITEM_LISTS, _AUTOCASE_LISTS = dict(WORKITEM_LISTS), dict(AUTOCASE_LISTS)
+
+# Lookups searched and fields ordered by for each column of the DataTables,
+# m2a and a2m list columns are JSON text of the listing tables, searched
+# by their items
+M2A_SEARCH_FIELDS = {
+    'polarion': ('polarion', ),
+    'title': ('title', ),
+    'documents': (ListSearch(_WORKITEM_LISTS['documents']), ),
+    'automation': ('automation', ),
+    'errors': (ListSearch(_WORKITEM_LISTS['errors']), ),
+    'cases': (ListSearch(_WORKITEM_LISTS['cases']), ),
+    'patterns': (ListSearch(_WORKITEM_LISTS['patterns']), ),
+    'maitai_id': ('maitai_id', ),
+    'comment': ('comment', ),
+}
+M2A_ORDER_FIELDS = {
+    'polarion': 'polarion',
+    'title': 'title',
+    'automation': 'automation',
+    'maitai_id': 'maitai_id',
+    'need_automation': 'need_automation',
+    'comment': 'comment',
+}
+A2M_SEARCH_FIELDS = {
+    'case': ('case', ),
+    'polarion': (ListSearch(_AUTOCASE_LISTS['polarion']), ),
+    'title': (ListSearch(_AUTOCASE_LISTS['title']), ),
+    'documents': (ListSearch(_AUTOCASE_LISTS['documents']), ),
+    'components': (ListSearch(_AUTOCASE_LISTS['components']), ),
+    'framework': ('framework', ),
+    'pr': ('pr', ),
+    'errors': (ListSearch(_AUTOCASE_LISTS['errors']), ),
+}
+A2M_ORDER_FIELDS = {
+    'case': 'case',
+    'framework': 'framework',
+    'pr': 'pr',
+}
+# Lookups of linkage autocase rows for each filter of the graph
+GRAPH_FILTERS = {
+    'document': 'linkage__workitem__documents__in',
+    'component': 'autocase__components__in',
+    'framework': 'autocase__framework__in',
+}
+BL_SEARCH_FIELDS = {
+    'status': ('status', ),
+    'description': ('description', ),
+    'bugs': ('bugs__id', ),
+    'workitems': ('workitems__id', ),
+    'autocase_failures': ('autocase_failures__autocases__id', ),
+    'errors': ('errors__message', ),
+}
+BL_ORDER_FIELDS = {
+    'status': 'status',
+    'description': 'description',
+}
 
 
 def a2m(request):
@@ -29,319 +108,386 @@ def index(request):
 
 
 def pattern_matcher(request, pattern=''):
-    ret = []
-
-    def _collect_case(test_case):
-        if is_pattern_match(pattern, test_case.id):
-            ret.append(test_case.id)
-            if len(ret) > 100:
-                return False
-        return True
-
-    for offset in xrange(0, AutoCase.objects.all().count(), 1000):
-        for case in AutoCase.objects.all()[offset:offset + 1000]:
-            if not _collect_case(case):
-                return JsonResponse({"cases": ret})
-    return JsonResponse({"cases": ret})
+    """
+    List autocases matching the pattern, paged by autocase id with
+    'cursor' (last id of previous page) and 'limit'.
+    """
+    try:
+        limit = min(int(request.GET.get('limit', 100)), 1000)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return HttpResponseBadRequest("Invalid limit")
+    cursor = request.GET.get('cursor', '')
+
+    candidates = AutoCase.objects.filter(id__in=AutoCaseSegment.candidate_ids(pattern))
+    # Only as many candidates after the cursor as needed for one page are tested
+    cases = []
+    for case_id in candidates.filter(id__gt=cursor).order_by('id').values_list('id', flat=True).iterator():
+        if is_pattern_match(pattern, case_id):
+            cases.append(case_id)
+            if len(cases) > limit:
+                break
+    has_next = len(cases) > limit
+    cases = cases[:limit]
+
+    return JsonResponse(dict(
+        _pattern_summary(pattern, candidates),
+        cases=cases,
+        next=cases[-1] if has_next else None))
+
+
+def _pattern_summary(pattern, candidates):
+    """
+    Return total and framework and component counts of autocases matching
+    the pattern, cached per data version.
+    """
+    key = 'caselink-pattern-summary-%s-%s' % (
+        hashlib.sha1(pattern.encode('utf-8')).hexdigest(), current_data_version())
+    summary = cache.get(key)
+    if summary is None:
+        matched = dict(
+            (case_id, framework) for case_id, framework
+            in candidates.values_list('id', 'framework').iterator()
+            if is_pattern_match(pattern, case_id))
+        components = Counter(
+            component for case_id, component
+            in AutoCase.components.through.objects.filter(autocase__in=candidates)
+            .values_list('autocase', 'component').iterator()
+            if case_id in matched)
+        summary = {
+            "total": len(matched),
+            "frameworks": Counter(framework or 'n/a' for framework in matched.values()),
+            "components": components,
+        }
+        cache.set(key, summary, DATA_CACHE_TIMEOUT)
+    return summary
+
+
+def pattern_coverage(request, autocase=''):
+    """
+    Reverse of pattern matcher, list linkages and autocase failures
+    whose pattern covers the autocase id.
+    """
+    linkages, failures = match_autocase(autocase)
+    return JsonResponse({
+        "case": autocase,
+        "linkages": [{
+            'id': link.id,
+            'workitem': link.workitem_id,
+            'autocase_pattern': link.autocase_pattern,
+            'framework': link.framework_id,
+        } for link in linkages],
+        "autocase_failures": [{
+            'id': failure.id,
+            'autocase_pattern': failure.autocase_pattern,
+            'failure_regex': failure.failure_regex,
+            'framework': failure.framework_id,
+        } for failure in failures],
+    })
+
+
+def _datatables_data(request, queryset, search_fields, order_fields, records, pk):
+    """
+    Respond to a DataTables server-side processing request, only records
+    of the requested page are built.
+    """
+    try:
+        draw, total, filtered, pks = datatables_page(
+            request.GET, queryset, search_fields, order_fields)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid DataTables parameters")
+    page = {}
+    for chunk in chunked(pks, 500):
+        for record in records(chunk):
+            page[record[pk]] = record
+    return JsonResponse({
+        'draw': draw,
+        'recordsTotal': total,
+        'recordsFiltered': filtered,
+        'data': [page[pk_] for pk_ in pks if pk_ in page],
+    })
+
+
+def _column_values(request, queryset, search_fields):
+    """
+    Respond with distinct values of the columns given by 'values', comma separated.
+    """
+    try:
+        values = column_values(queryset, search_fields, request.GET['values'].split(','))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid columns")
+    return JsonResponse(values)
 
 
-def _dictfetchall(cursor):
-    "Return all rows from a cursor as a dict"
-    columns = [col[0] for col in cursor.description]
-    return [
-        dict(zip(columns, row))
-        for row in cursor.fetchall()
-    ]
+def _stream_json(records, chunk_size=100, version=None):
+    """
+    Yield a {"data": [...]} JSON document, records are encoded in chunks,
+    with the data version if given.
+    """
+    yield '{"data": [' if version is None else '{"version": %d, "data": [' % version
+    chunk, first = [], True
+    for record in records:
+        chunk.append(json.dumps(record, cls=DjangoJSONEncoder))
+        if len(chunk) >= chunk_size:
+            yield ('' if first else ',') + ','.join(chunk)
+            chunk, first = [], False
+    if chunk:
+        yield ('' if first else ',') + ','.join(chunk)
+    yield ']}'
+
+
+def _versioned_json(request, name, records):
+    """
+    Respond with the {"data": [...]} document of records, streamed and
+    gzipped, the gzipped payload is cached per data version, and validated
+    with ETag.
+    """
+    return _versioned_response(
+        request, name, lambda version: _stream_json(records(), version=version))
 
 
-def _merge_table(pk, base_list, joined_list, keys=[]):
+def _versioned_response(request, name, chunks):
     """
-    Extend table with unique pk using another table with duplicated pk, for handling m2m in raw sql,
-    They should both be list of dict, ordered by pk for performance issue.
-    All attrs will be extended should be list.
+    Same as _versioned_json, with the JSON document yielded by chunks(version).
     """
-    pos = 0
-    for entry in joined_list:
-        while base_list[pos][pk] != entry[pk]:
-            pos += 1
-        for key in keys:
-            base_list[pos].get(key).append(entry[key])
+    version = current_data_version()
+    etag = '"%s-%s"' % (name, version)
+    if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    key = 'caselink-data-%s-%s' % (name, version)
+    payload = cache.get(key)
+    if payload is None:
+        gzipped = _gzip_and_cache(key, chunks(version))
+    else:
+        gzipped = _sliced(payload)
+
+    if _accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        response = StreamingHttpResponse(gzipped, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = StreamingHttpResponse(_gunzip(gzipped), content_type='application/json')
+    response['ETag'] = etag
+    response['Vary'] = 'Accept-Encoding'
+    return response
+
+
+# Size of data compressed or decompressed before it's yielded
+GZIP_CHUNK_SIZE = 64 * 1024
+
+
+def _gzip_and_cache(key, chunks):
+    """
+    Yield text chunks gzipped, the payload is cached once all are yielded.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    parts, pending, size = [], [], 0
+    for chunk in chunks:
+        chunk = chunk.encode('utf-8')
+        pending.append(compressor.compress(chunk))
+        size += len(chunk)
+        if size >= GZIP_CHUNK_SIZE:
+            # Else compressed data is held back until a block is filled
+            pending.append(compressor.flush(zlib.Z_SYNC_FLUSH))
+            parts.append(b''.join(pending))
+            yield parts[-1]
+            pending, size = [], 0
+    pending.append(compressor.flush())
+    parts.append(b''.join(pending))
+    yield parts[-1]
+    cache.set(key, b''.join(parts), DATA_CACHE_TIMEOUT)
+
+
+def _sliced(payload):
+    for offset in range(0, len(payload), GZIP_CHUNK_SIZE):
+        yield payload[offset:offset + GZIP_CHUNK_SIZE]
+
+
+def _gunzip(gzipped):
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for data in gzipped:
+        while data:
+            yield decompressor.decompress(data, GZIP_CHUNK_SIZE)
+            data = decompressor.unconsumed_tail
+    yield decompressor.flush()
+
+
+def _changes_data(request, listing, records, pk, key=str):
+    """
+    Respond with records upserted and pks deleted after the data version
+    given by 'since' (and a few versions before, see listing_changes), or a
+    reset if the listing was rebuilt since then. Records are looked up by pk
+    converted with 'key'.
+    """
+    try:
+        since = int(request.GET['since'])
+    except ValueError:
+        return HttpResponseBadRequest("Invalid since version")
+    version, rows = listing_changes(listing, since)
+    if rows is None:
+        return JsonResponse({'version': version, 'reset': True})
+    data = []
+    for chunk in chunked(sorted(rows), 500):
+        data.extend(records([key(row) for row in chunk]))
+    rows.difference_update(str(record[pk]) for record in data)
+    return JsonResponse({
+        'version': version,
+        'reset': False,
+        'data': data,
+        'deleted': [key(row) for row in sorted(rows)],
+    })
 
 
 def m2a_data(request, pk=None):
-    json_list = []
-    cursor = connection.cursor()
+    if 'values' in request.GET:
+        return _column_values(request, WorkItemListing.objects.all(), M2A_SEARCH_FIELDS)
+    if 'draw' in request.GET:
+        return _datatables_data(request, WorkItemListing.objects.all(),
+                                M2A_SEARCH_FIELDS, M2A_ORDER_FIELDS, WorkItemListing.records, 'polarion')
+    if pk:
+        return JsonResponse({'data': list(WorkItemListing.records([pk]))})
+    if 'since' in request.GET:
+        return _changes_data(request, 'm2a', WorkItemListing.records, 'polarion')
+    return _versioned_json(request, 'm2a', WorkItemListing.records)
 
-    sql = """
-    select
-    caselink_workitem.id AS "polarion",
-    caselink_workitem.title AS "title",
-    caselink_workitem.automation AS "automation",
-    caselink_workitem.need_automation AS "need_automation",
-    caselink_workitem.comment AS "comment",
-    caselink_workitem.maitai_id AS "maitai_id",
-    caselink_workitem.jira_id AS "jira_id",
-    caselink_linkage_autocases.autocase_id as "cases",
-    caselink_linkage.autocase_pattern as "patterns",
-    caselink_error.message as "errors"
-    from
-    ((((
-    caselink_workitem
-    left join caselink_linkage on caselink_linkage.workitem_id = caselink_workitem.id)
-    left join caselink_linkage_errors on caselink_linkage_errors.linkage_id = caselink_linkage.id)
-    left join caselink_error on caselink_error.id = caselink_linkage_errors.error_id)
-    left join caselink_linkage_autocases on caselink_linkage_autocases.linkage_id = caselink_linkage.id)
-    where caselink_workitem.type <> 'heading' %s
-    order by "polarion"
-    """
-    sql, params = (sql % "and caselink_workitem.id = %s", [pk]) if pk else (sql % "", [])
-    cursor.execute(sql, params)
-
-    for workitem in _dictfetchall(cursor):
-        w_id = workitem['polarion']
-        if not json_list or json_list[-1]['polarion'] != w_id:
-            json_list.append({
-                'polarion': w_id,
-                'title': workitem['title'],
-                'automation': workitem['automation'],
-                'need_automation': workitem['need_automation'],
-                'maitai_id': workitem['maitai_id'],
-                'jira_id': workitem['jira_id'],
-                'comment': workitem['comment'],
-                'patterns': [],
-                'cases': [],
-                'errors': [],
-                'documents': [],
-            })
-
-        for key in ['cases', 'patterns', 'errors']:
-            if workitem[key] and workitem[key] not in json_list[-1].get(key):
-                json_list[-1].get(key).append(workitem[key])
 
-    sql = """
+def a2m_data(request):
+    if 'values' in request.GET:
+        return _column_values(request, AutoCaseListing.objects.all(), A2M_SEARCH_FIELDS)
+    if 'draw' in request.GET:
+        return _datatables_data(request, AutoCaseListing.objects.all(),
+                                A2M_SEARCH_FIELDS, A2M_ORDER_FIELDS, AutoCaseListing.records, 'case')
+    if 'since' in request.GET:
+        return _changes_data(request, 'a2m', AutoCaseListing.records, 'case')
+    return _versioned_json(request, 'a2m', AutoCaseListing.records)
+
+
+# Lists of a blacklist entry, selecting "pk" (entry id) and "value"
+BL_LISTS = (
+    ('bugs', """
     select
-    caselink_workitem.id AS "polarion",
-    caselink_error.message as "errors"
-    from
-    ((
-    caselink_workitem
-    inner join caselink_workitem_errors on caselink_workitem.id = caselink_workitem_errors.workitem_id)
-    left join caselink_error on caselink_error.id = caselink_workitem_errors.error_id)
-    where caselink_workitem.type <> 'heading' %s
-    order by "polarion";
-    """
-    sql, params = (sql % "and caselink_workitem.id = %s", [pk]) if pk else (sql % "", [])
-    cursor.execute(sql, params)
-    _merge_table('polarion', json_list, _dictfetchall(cursor), ['errors'])
-
-    sql = """
+    caselink_blacklistentry_bugs.blacklistentry_id AS pk,
+    caselink_blacklistentry_bugs.bug_id AS value
+    from caselink_blacklistentry_bugs
+    """),
+    ('errors', """
     select
-    caselink_workitem.id AS "polarion",
-    caselink_workitem_documents.document_id as "documents"
+    caselink_blacklistentry_errors.blacklistentry_id AS pk,
+    caselink_error.message AS value
     from
     (
-    caselink_workitem
-    inner join caselink_workitem_documents on caselink_workitem.id = caselink_workitem_documents.workitem_id)
-    where caselink_workitem.type <> 'heading' %s
-    order by "polarion";
-    """
-    sql, params = (sql % "and caselink_workitem.id = %s", [pk]) if pk else (sql % "", [])
-    cursor.execute(sql, params)
-    _merge_table('polarion', json_list, _dictfetchall(cursor), ['documents'])
+    caselink_blacklistentry_errors
+    inner join caselink_error on caselink_error.id = caselink_blacklistentry_errors.error_id)
+    """),
+    ('workitems', """
+    select
+    caselink_blacklistentry_workitems.blacklistentry_id AS pk,
+    caselink_blacklistentry_workitems.workitem_id AS value
+    from caselink_blacklistentry_workitems
+    """),
+    ('autocase_failures', """
+    select
+    caselink_blacklistentry_autocase_failures.blacklistentry_id AS pk,
+    %s AS value
+    from
+    ((
+    caselink_blacklistentry_autocase_failures
+    inner join caselink_autocasefailure on caselink_autocasefailure.id = caselink_blacklistentry_autocase_failures.autocasefailure_id)
+    left join caselink_autocasefailure_autocases on caselink_autocasefailure_autocases.autocasefailure_id = caselink_autocasefailure.id)
+    """),
+)
 
-    return JsonResponse({'data': json_list})
 
+def _bl_failures(values):
+    """
+    Group 'pattern, regex, autocase' values of a entry to autocase failures.
+    """
+    failures = []
+    for value in values:
+        autocase_pattern, failure_regex, autocase = value.split(FIELD_SEPARATOR)
+        last_failure = failures and failures[-1]
+        if not last_failure or last_failure['autocase_pattern'] != autocase_pattern or last_failure['failure_regex'] != failure_regex:
+            last_failure = {
+                'autocase_pattern': autocase_pattern,
+                'failure_regex': failure_regex,
+                'autocases': [],
+            }
+            failures.append(last_failure)
+        if autocase:
+            last_failure['autocases'].append(autocase)
+    return failures
 
-def a2m_data(request):
-    json_list = []
-    cursor = connection.cursor()
 
+def _bl_records(pks=None):
+    """
+    Yield records of blacklist entries, or entries with given ids.
+    """
     sql = """
     select
-    caselink_autocase.id AS "case",
-    caselink_autocase.pr AS "pr",
-    caselink_autocase.framework_id AS "framework",
-    caselink_workitem.title as "title",
-    caselink_linkage.workitem_id as "polarion"
-    from
-    (((
-    caselink_autocase
-    left join caselink_linkage_autocases on caselink_autocase.id = caselink_linkage_autocases.autocase_id)
-    left join caselink_linkage on caselink_linkage_autocases.linkage_id = caselink_linkage.id)
-    left join caselink_workitem on caselink_linkage.workitem_id = caselink_workitem.id)
-    order by "case"
+    caselink_blacklistentry.id AS "id",
+    caselink_blacklistentry.status AS "status",
+    caselink_blacklistentry.description AS "description"
+    from caselink_blacklistentry
+    where 1 = 1 %s
+    order by "id"
     """
-    cursor.execute(sql)
-
-    for autocase in _dictfetchall(cursor):
-        autocase_id = autocase['case']
-        if len(json_list) == 0 or json_list[-1]['case'] != autocase_id:
-            json_list.append({
-                'case': autocase_id,
-                'framework': autocase['framework'],
-                'pr': autocase['pr'],
-                'components': [],
-                'title': [],
-                'polarion': [],
-                'errors': [],
-                'documents': [],
-            })
-        for key in ['title', 'polarion', ]:
-            if autocase[key]:
-                json_list[-1].get(key).append(autocase[key])
-
-    cursor.execute(
-        """
-        select
-        caselink_autocase.id AS "case",
-        caselink_error.message AS "errors"
-        from
-        ((
-        caselink_autocase
-        inner join caselink_autocase_errors on caselink_autocase.id = caselink_autocase_errors.autocase_id)
-        left join caselink_error on caselink_error.id = caselink_autocase_errors.error_id)
-        order by "case";
-        """
-    )
-    _merge_table('case', json_list, _dictfetchall(cursor), ['errors'])
-
-    cursor.execute(
-        """
-        select
-        caselink_autocase.id AS "case",
-        caselink_autocase_components.component_id AS "components"
-        from
-        (
-        caselink_autocase
-        inner join caselink_autocase_components on caselink_autocase.id = caselink_autocase_components.autocase_id)
-        order by "case";
-        """
-    )
-    _merge_table('case', json_list, _dictfetchall(cursor), ['components'])
-
-    cursor.execute(
-        """
-        select
-        caselink_autocase.id AS "case",
-        caselink_workitem_documents.document_id as "documents"
-        from
-        (((
-        caselink_autocase
-        inner join caselink_linkage_autocases on caselink_autocase.id = caselink_linkage_autocases.autocase_id)
-        left join caselink_linkage on caselink_linkage_autocases.linkage_id = caselink_linkage.id)
-        inner join caselink_workitem_documents on caselink_workitem_documents.workitem_id = caselink_linkage.workitem_id)
-        order by "case";
-        """
-    )
-    _merge_table('case', json_list, _dictfetchall(cursor), ['documents'])
-
-    return JsonResponse({'data': json_list})
+    failure = concat_fields(
+        'caselink_autocasefailure.autocase_pattern', 'caselink_autocasefailure.failure_regex',
+        "coalesce(caselink_autocasefailure_autocases.autocase_id, '')")
+    lists = [(name, list_sql % failure if name == 'autocase_failures' else list_sql)
+             for name, list_sql in BL_LISTS]
+    for entry in aggregated_rows(sql, 'id', 'caselink_blacklistentry.id', lists, pks):
+        entry['autocase_failures'] = _bl_failures(entry['autocase_failures'])
+        yield entry
 
 
 def bl_data(request, pk=None):
-    json_list = []
-    cursor = connection.cursor()
-
-    sql = """
-        select
-        caselink_blacklistentry.id AS "id",
-        caselink_blacklistentry.status AS "status",
-        caselink_blacklistentry.description AS "description",
-        caselink_error.message as "errors"
-        from
-        ((
-        caselink_blacklistentry
-        left join caselink_blacklistentry_errors on caselink_blacklistentry_errors.blacklistentry_id = caselink_blacklistentry.id)
-        left join caselink_error on caselink_error.id = caselink_blacklistentry_errors.error_id)
-        where 1 = 1 %s
-        order by "id"
-    """
-    sql, params = (sql % "and caselink_blacklistentry.id = %s", [pk]) if pk else (sql % "", [])
-    cursor.execute(sql, params)
-
-    for entry in _dictfetchall(cursor):
-        entry_id = entry['id']
-        if len(json_list) == 0 or json_list[-1]['id'] != entry_id:
-            json_list.append({
-                'id': entry_id,
-                'status': entry['status'],
-                'description': entry['description'],
-                'bugs': [],
-                'errors': [],
-                'workitems': [],
-                'autocase_failures': [],
-            })
-        for key in ['errors', ]:
-            if entry[key]:
-                json_list[-1].get(key).append(entry[key])
-
-    sql = """
-        select
-        caselink_blacklistentry.id AS "id",
-        caselink_workitem.id AS "workitems"
-        from
-        ((
-        caselink_blacklistentry
-        inner join caselink_blacklistentry_workitems on caselink_blacklistentry_workitems.blacklistentry_id = caselink_blacklistentry.id)
-        left join caselink_workitem on caselink_workitem.id = caselink_blacklistentry_workitems.workitem_id)
-        where 1 = 1 %s
-        order by "id";
+    if 'values' in request.GET:
+        return _column_values(request, BlackListEntry.objects.all(), BL_SEARCH_FIELDS)
+    if 'draw' in request.GET:
+        return _datatables_data(request, BlackListEntry.objects.all(),
+                                BL_SEARCH_FIELDS, BL_ORDER_FIELDS, _bl_records, 'id')
+    if pk:
+        return JsonResponse({'data': list(_bl_records([pk]))})
+    if 'since' in request.GET:
+        return _changes_data(request, 'bl', _bl_records, 'id', key=int)
+    return _versioned_json(request, 'bl', _bl_records)
+
+
+def _graph_edges(params):
+    edges = Linkage.autocases.through.objects.filter(
+        linkage__workitem__isnull=False).exclude(linkage__workitem__type='heading')
+    for key, lookup in sorted(GRAPH_FILTERS.items()):
+        values = params.getlist(key)
+        if values:
+            edges = edges.filter(**{lookup: values})
+    return edges.values_list('linkage__workitem_id', 'autocase_id').distinct().order_by(
+        'linkage__workitem_id', 'autocase_id').iterator()
+
+
+def graph_data(request):
     """
-    sql, params = (sql % "and caselink_blacklistentry.id = %s", [pk]) if pk else (sql % "", [])
-    cursor.execute(sql, params)
-    _merge_table('id', json_list, _dictfetchall(cursor), ['workitems'])
-
-    sql = """
-        select
-        caselink_blacklistentry.id AS "id",
-        caselink_bug.id AS "bugs"
-        from
-        ((
-        caselink_blacklistentry
-        inner join caselink_blacklistentry_bugs on caselink_blacklistentry_bugs.blacklistentry_id = caselink_blacklistentry.id)
-        left join caselink_bug on caselink_bug.id = caselink_blacklistentry_bugs.bug_id)
-        where 1 = 1 %s
-        order by "id";
+    Graph of linked workitems and autocases with its clusters, for the map,
+    see caselink.utils.graph. Edges can be filtered by 'document',
+    'component' or 'framework' (each may repeat). Clusters larger than
+    'collapse' nodes are collapsed, or only 'cluster' is expanded.
     """
-    sql, params = (sql % "and caselink_blacklistentry.id = %s", [pk]) if pk else (sql % "", [])
-    cursor.execute(sql, params)
-    _merge_table('id', json_list, _dictfetchall(cursor), ['bugs'])
-
-    sql = """
-        select
-        caselink_blacklistentry.id AS "id",
-        caselink_autocasefailure.autocase_pattern AS "autocase_pattern",
-        caselink_autocasefailure.failure_regex AS "failure_regex",
-        caselink_autocase.id AS "autocases"
-        from
-        ((((
-        caselink_blacklistentry
-        inner join caselink_blacklistentry_autocase_failures on caselink_blacklistentry_autocase_failures.blacklistentry_id = caselink_blacklistentry.id)
-        left join caselink_autocasefailure on caselink_autocasefailure.id = caselink_blacklistentry_autocase_failures.autocasefailure_id)
-        left join caselink_autocasefailure_autocases on caselink_autocasefailure_autocases.autocasefailure_id = caselink_autocasefailure.id)
-        left join caselink_autocase on caselink_autocase.id = caselink_autocasefailure_autocases.autocase_id)
-        where 1 = 1 %s
-        order by "id", "autocase_pattern", "failure_regex";
-    """
-    sql, params = (sql % "and caselink_blacklistentry.id = %s", [pk]) if pk else (sql % "", [])
-    cursor.execute(sql, params)
-
-    pos, pk = 0, "id"
-    for entry in _dictfetchall(cursor):
-        while json_list[pos][pk] != entry[pk]:
-            pos += 1
-        autocase_failures = json_list[pos]['autocase_failures']
-        last_failure = autocase_failures and autocase_failures[-1]
-        autocase_pattern = entry['autocase_pattern']
-        failure_regex = entry['failure_regex']
-        autocase = entry['autocases']
-        if not last_failure or last_failure['autocase_pattern'] != autocase_pattern or last_failure['failure_regex'] != failure_regex:
-            autocase_failures.append({
-                'autocase_pattern': autocase_pattern,
-                'failure_regex': failure_regex,
-                'autocases': [autocase] if autocase else [],
-            })
-        else:
-            last_failure['autocases'].append(autocase)
-
-    return JsonResponse({'data': json_list})
+    try:
+        collapse = int(request.GET['collapse']) if request.GET.get('collapse') else None
+    except ValueError:
+        return HttpResponseBadRequest("Invalid collapse")
+    cluster = request.GET.get('cluster') or None
+
+    params = sorted((key, value) for key in list(GRAPH_FILTERS) + ['collapse', 'cluster']
+                    for value in request.GET.getlist(key))
+    name = 'graph-%s' % hashlib.sha1(urlencode(params).encode('utf-8')).hexdigest()
+
+    def chunks(version):
+        graph = LinkageGraph(_graph_edges(request.GET)).as_dict(collapse=collapse, cluster=cluster)
+        graph['version'] = version
+        yield json.dumps(graph)
+
+    return _versioned_response(request, name, chunks)